@@ -0,0 +1,536 @@
+# ============================================================
+# /ask END-TO-END LATENCY BENCHMARK
+#
+# Starts local stand-ins for the LLM endpoint, the
+# translator and DuckDuckGo, drives the Flask app with a
+# multilingual question mix and reports p50/p95/p99 latency
+# per pipeline stage plus overall throughput.
+#
+# Usage:
+#     python benchmarks/ask_latency.py
+#     python benchmarks/ask_latency.py --requests 500 \
+#         --concurrency 16 --llm-latency 0.8
+#     python benchmarks/ask_latency.py --output before.json
+#     python benchmarks/ask_latency.py --output after.json \
+#         --baseline before.json
+#
+# Results are written as JSON (--output, by default to the
+# system temp directory, outside the repo). With --baseline
+# the run fails if any stage's p95 regressed by more than
+# --tolerance (and by more than --min-delta-ms).
+# ============================================================
+
+import argparse
+import hashlib
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+ROOT = os.path.dirname(
+    os.path.dirname(os.path.abspath(__file__))
+)
+
+
+# ============================================================
+# QUESTION MIX
+#
+# (language, question, English translation)
+# ============================================================
+
+QUESTIONS = [
+    ("en", "What is naloxone?", None),
+    ("en", "What are the signs of an opioid overdose?", None),
+    ("en", "How does methadone treatment work?", None),
+    ("en", "How does narcan work?", None),
+    ("en", "Where can I find rehab near Bowie State University?", None),
+    ("en", "Why are fentanyl overdose deaths increasing?", None),
+    ("en", "What are the withdrawal symptoms from heroin?", None),
+    ("en", "Who is the best singer of all time?", None),
+    (
+        "es",
+        "¿Qué es la naloxona?",
+        "What is naloxone?"
+    ),
+    (
+        "es",
+        "¿Cuáles son los síntomas de abstinencia de opioides?",
+        "What are the symptoms of opioid withdrawal?"
+    ),
+    (
+        "fr",
+        "Quels sont les signes d'une surdose d'opioïdes ?",
+        "What are the signs of an opioid overdose?"
+    ),
+    (
+        "fr",
+        "Comment fonctionne la buprénorphine ?",
+        "How does buprenorphine work?"
+    ),
+    (
+        "zh",
+        "什么是芬太尼？",
+        "What is fentanyl?"
+    ),
+    (
+        "zh",
+        "如何治疗阿片类药物成瘾？",
+        "How is opioid addiction treated?"
+    )
+]
+
+
+TRANSLATIONS_TO_ENGLISH = {
+    question: english
+    for _, question, english in QUESTIONS
+    if english
+}
+
+
+# ============================================================
+# STUB BACKENDS
+# ============================================================
+
+class StubSettings:
+
+    llm_latency = 0.5
+
+    llm_words = 150
+
+    llm_fallback_rate = 0.1
+
+    translate_latency = 0.1
+
+    search_latency = 0.3
+
+    head_latency = 0.05
+
+    search_results = 8
+
+
+def stable_fraction(text):
+
+    return int(
+        hashlib.sha256(text.encode("utf-8")).hexdigest()[:8],
+        16
+    ) / 0xFFFFFFFF
+
+
+class QuietHandler(BaseHTTPRequestHandler):
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def read_json(self):
+
+        length = int(self.headers.get("Content-Length", 0))
+
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def send_body(self, body, content_type):
+
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class LlmHandler(QuietHandler):
+
+    def do_POST(self):
+
+        payload = self.read_json()
+
+        question = payload["messages"][-1]["content"]
+
+        words = [
+            "Naloxone", "is", "a", "medication", "that",
+            "rapidly", "reverses", "an", "opioid", "overdose."
+        ]
+
+        answer = " ".join(
+            words[i % len(words)]
+            for i in range(StubSettings.llm_words)
+        )
+
+        if stable_fraction(question) < StubSettings.llm_fallback_rate:
+            answer += " There is no valid source for this."
+        else:
+            answer += " See https://www.cdc.gov/overdose-prevention/"
+
+        if not payload.get("stream"):
+
+            time.sleep(StubSettings.llm_latency)
+
+            self.send_body(
+                json.dumps(
+                    {
+                        "choices": [
+                            {"message": {"content": answer}}
+                        ]
+                    }
+                ).encode("utf-8"),
+                "application/json"
+            )
+
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+
+        tokens = answer.split(" ")
+
+        for token in tokens:
+
+            time.sleep(StubSettings.llm_latency / len(tokens))
+
+            chunk = {"choices": [{"delta": {"content": token + " "}}]}
+
+            self.wfile.write(
+                f"data: {json.dumps(chunk)}\n\n".encode("utf-8")
+            )
+
+        self.wfile.write(b"data: [DONE]\n\n")
+
+        self.close_connection = True
+
+
+class TranslateHandler(QuietHandler):
+
+    def do_POST(self):
+
+        payload = self.read_json()
+
+        time.sleep(StubSettings.translate_latency)
+
+        text = payload["q"]
+
+        if payload["target"] == "en":
+            translated = TRANSLATIONS_TO_ENGLISH.get(text, text)
+        else:
+            translated = f"[{payload['target']}] {text}"
+
+        self.send_body(
+            json.dumps({"translatedText": translated}).encode("utf-8"),
+            "application/json"
+        )
+
+
+class SearchHandler(QuietHandler):
+
+    def do_GET(self):
+
+        time.sleep(StubSettings.search_latency)
+
+        query = parse_qs(urlparse(self.path).query).get("q", [""])[0]
+
+        base = f"http://{self.headers['Host']}"
+
+        results = "".join(
+            f'<a class="result__a" href="{base}/page/{i}?q={query}">'
+            f"Result {i}</a>"
+            for i in range(StubSettings.search_results)
+        )
+
+        self.send_body(
+            f"<html><body>{results}</body></html>".encode("utf-8"),
+            "text/html"
+        )
+
+    def do_HEAD(self):
+
+        time.sleep(StubSettings.head_latency)
+
+        self.send_response(200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+
+def start_stub(handler):
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+
+    server.daemon_threads = True
+
+    threading.Thread(
+        target=server.serve_forever,
+        daemon=True
+    ).start()
+
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+# ============================================================
+# MEASUREMENT
+# ============================================================
+
+class StageRecorder:
+
+    def __init__(self):
+
+        self.samples = {}
+
+        self.lock = threading.Lock()
+
+    def __call__(self, name, seconds):
+
+        with self.lock:
+            self.samples.setdefault(name, []).append(seconds)
+
+
+def percentile(sorted_values, fraction):
+
+    if not sorted_values:
+        return 0.0
+
+    index = min(
+        len(sorted_values) - 1,
+        max(0, int(round(fraction * len(sorted_values) + 0.5)) - 1)
+    )
+
+    return sorted_values[index]
+
+
+def summarize(samples):
+
+    values = sorted(samples)
+
+    return {
+        "count": len(values),
+        "mean_ms": 1000 * sum(values) / len(values),
+        "p50_ms": 1000 * percentile(values, 0.50),
+        "p95_ms": 1000 * percentile(values, 0.95),
+        "p99_ms": 1000 * percentile(values, 0.99)
+    }
+
+
+def clear_caches(app_module):
+
+    for cache in (
+        app_module.answer_cache,
+        app_module.translation_cache,
+        app_module.search_cache,
+        app_module.link_status_cache,
+        app_module.semantic_cache
+    ):
+        cache.clear()
+
+
+# ============================================================
+# RUN
+# ============================================================
+
+def parse_args():
+
+    parser = argparse.ArgumentParser(
+        description="End-to-end /ask latency benchmark"
+    )
+
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--endpoint", default="/ask",
+                        choices=["/ask", "/ask/stream"])
+    parser.add_argument("--cold-caches", action="store_true",
+                        help="clear answer/translation/search caches "
+                             "before every request")
+    parser.add_argument("--llm-latency", type=float,
+                        default=StubSettings.llm_latency)
+    parser.add_argument("--llm-words", type=int,
+                        default=StubSettings.llm_words)
+    parser.add_argument("--llm-fallback-rate", type=float,
+                        default=StubSettings.llm_fallback_rate)
+    parser.add_argument("--translate-latency", type=float,
+                        default=StubSettings.translate_latency)
+    parser.add_argument("--search-latency", type=float,
+                        default=StubSettings.search_latency)
+    parser.add_argument("--head-latency", type=float,
+                        default=StubSettings.head_latency)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--output",
+        default=os.path.join(tempfile.gettempdir(),
+                             "ask_latency.json")
+    )
+    parser.add_argument("--baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="allowed relative p95 regression")
+    parser.add_argument("--min-delta-ms", type=float, default=5.0,
+                        help="ignore p95 changes smaller than this")
+
+    return parser.parse_args()
+
+
+def compare_to_baseline(result, baseline, tolerance, min_delta_ms):
+
+    regressions = []
+
+    for name, stats in result["stages"].items():
+
+        before = baseline.get("stages", {}).get(name)
+
+        if not before or before["p95_ms"] <= 0:
+            continue
+
+        change = stats["p95_ms"] / before["p95_ms"] - 1
+
+        delta_ms = stats["p95_ms"] - before["p95_ms"]
+
+        if change > tolerance and delta_ms > min_delta_ms:
+            regressions.append(
+                f"{name}: p95 {before['p95_ms']:.1f}ms -> "
+                f"{stats['p95_ms']:.1f}ms (+{100 * change:.0f}%)"
+            )
+
+    return regressions
+
+
+def main():
+
+    args = parse_args()
+
+    StubSettings.llm_latency = args.llm_latency
+    StubSettings.llm_words = args.llm_words
+    StubSettings.llm_fallback_rate = args.llm_fallback_rate
+    StubSettings.translate_latency = args.translate_latency
+    StubSettings.search_latency = args.search_latency
+    StubSettings.head_latency = args.head_latency
+
+    _, llm_url = start_stub(LlmHandler)
+    _, translate_url = start_stub(TranslateHandler)
+    _, search_url = start_stub(SearchHandler)
+
+    # The app reads its configuration at import time.
+    os.environ["LLAMA3_ENDPOINT"] = f"{llm_url}/v1/chat/completions"
+    os.environ["REN_API_KEY"] = "benchmark"
+    os.environ["TRANSLATE_ENDPOINT"] = f"{translate_url}/translate"
+    os.environ["DUCKDUCKGO_URL"] = f"{search_url}/html/"
+    os.environ["REDIS_URL"] = ""
+
+    os.chdir(ROOT)
+    sys.path.insert(0, ROOT)
+
+    import llama3chatbotopioid as chatbot
+
+    recorder = StageRecorder()
+
+    chatbot.stage_observers.append(recorder)
+
+    started = time.perf_counter()
+    chatbot.get_corpus_index()
+    index_seconds = time.perf_counter() - started
+
+    rng = random.Random(args.seed)
+
+    workload = [
+        rng.choice(QUESTIONS)
+        for _ in range(args.requests)
+    ]
+
+    def run_one(item):
+
+        lang, question, _ = item
+
+        if args.cold_caches:
+            clear_caches(chatbot)
+
+        client = chatbot.app.test_client()
+
+        request_started = time.perf_counter()
+
+        response = client.post(
+            args.endpoint,
+            json={"question": question, "language": lang}
+        )
+
+        response.get_data()
+
+        recorder("total", time.perf_counter() - request_started)
+
+        return response.status_code
+
+    run_started = time.perf_counter()
+
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        statuses = list(pool.map(run_one, workload))
+
+    wall_seconds = time.perf_counter() - run_started
+
+    result = {
+        "config": {
+            key: value
+            for key, value in vars(args).items()
+            if key not in ("output", "baseline")
+        },
+        "index_build_s": index_seconds,
+        "wall_s": wall_seconds,
+        "throughput_rps": len(workload) / wall_seconds,
+        "errors": sum(1 for status in statuses if status != 200),
+        "stages": {
+            name: summarize(samples)
+            for name, samples in sorted(recorder.samples.items())
+        }
+    }
+
+    print(
+        f"{len(workload)} requests, concurrency {args.concurrency}, "
+        f"{result['throughput_rps']:.1f} req/s, "
+        f"{result['errors']} errors "
+        f"(index build {index_seconds:.2f}s)"
+    )
+
+    print(
+        f"{'stage':<20}{'count':>7}{'p50 ms':>10}"
+        f"{'p95 ms':>10}{'p99 ms':>10}"
+    )
+
+    for name, stats in result["stages"].items():
+        print(
+            f"{name:<20}{stats['count']:>7}{stats['p50_ms']:>10.1f}"
+            f"{stats['p95_ms']:>10.1f}{stats['p99_ms']:>10.1f}"
+        )
+
+    os.makedirs(
+        os.path.dirname(os.path.abspath(args.output)),
+        exist_ok=True
+    )
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=2, sort_keys=True)
+
+    print(f"Results written to {args.output}")
+
+    if args.baseline:
+
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+
+        regressions = compare_to_baseline(
+            result,
+            baseline,
+            args.tolerance,
+            args.min_delta_ms
+        )
+
+        for line in regressions:
+            print(f"REGRESSION {line}")
+
+        if regressions:
+            sys.exit(1)
+
+        print("No regressions against baseline.")
+
+
+if __name__ == "__main__":
+    main()
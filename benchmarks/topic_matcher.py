@@ -0,0 +1,111 @@
+# ============================================================
+# TOPIC MATCHER MICRO-BENCHMARK
+#
+# Compares the compiled trie regex used by
+# is_question_relevant with a plain substring scan as the
+# topic lists grow.
+#
+# Usage:
+#     python benchmarks/topic_matcher.py
+# ============================================================
+
+import os
+import random
+import string
+import sys
+import timeit
+
+sys.path.insert(
+    0,
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+)
+
+from llama3chatbotopioid import (  # noqa: E402
+    compile_topic_matcher,
+    irrelevant_topics,
+    relevant_topics
+)
+
+
+QUESTIONS = [
+    "What are the signs of an opioid overdose?",
+    "How does naloxone reverse the effects of fentanyl?",
+    "Where can I find treatment near Bowie State University?",
+    "Who is the best singer of all time?",
+    "Is methadone or buprenorphine better for withdrawal?",
+    "What is the weather like in Spain this week?"
+]
+
+
+def make_topics(count, seed=0):
+
+    rng = random.Random(seed)
+
+    topics = list(relevant_topics)
+
+    while len(topics) < count:
+
+        topics.append(
+            "".join(
+                rng.choice(string.ascii_lowercase)
+                for _ in range(rng.randint(5, 12))
+            )
+        )
+
+    return topics
+
+
+def naive_is_relevant(question, topics):
+
+    q = question.lower()
+
+    return any(topic in q for topic in topics)
+
+
+def main():
+
+    print(
+        f"{'topics':>8}  {'naive us/q':>11}  "
+        f"{'compiled us/q':>14}"
+    )
+
+    for count in (len(relevant_topics), 100, 1000, 10000):
+
+        topics = make_topics(count)
+
+        matcher = compile_topic_matcher(
+            topics,
+            irrelevant_topics
+        )
+
+        runs = 2000
+
+        naive = timeit.timeit(
+            lambda: [
+                naive_is_relevant(q, topics)
+                for q in QUESTIONS
+            ],
+            number=runs
+        )
+
+        compiled = timeit.timeit(
+            lambda: [
+                any(
+                    m.lastgroup == "relevant"
+                    for m in matcher.finditer(q)
+                )
+                for q in QUESTIONS
+            ],
+            number=runs
+        )
+
+        per_question = runs * len(QUESTIONS) / 1e6
+
+        print(
+            f"{count:>8}  {naive / per_question:>11.2f}  "
+            f"{compiled / per_question:>14.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
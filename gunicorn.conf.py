@@ -0,0 +1,37 @@
+# ============================================================
+# GUNICORN CONFIGURATION
+#
+# Gunicorn reads ./gunicorn.conf.py automatically. Every
+# worker records Prometheus metrics into
+# PROMETHEUS_MULTIPROC_DIR so /metrics can sum them.
+# ============================================================
+
+import os
+import shutil
+
+
+PROMETHEUS_MULTIPROC_DIR = os.environ.setdefault(
+    "PROMETHEUS_MULTIPROC_DIR",
+    "/tmp/chatbot_prometheus"
+)
+
+# Start each deploy from empty metric files; this runs in
+# the master before any worker imports the app.
+shutil.rmtree(
+    PROMETHEUS_MULTIPROC_DIR,
+    ignore_errors=True
+)
+
+os.makedirs(
+    PROMETHEUS_MULTIPROC_DIR,
+    exist_ok=True
+)
+
+
+def child_exit(server, worker):
+
+    # prometheus_client picks its value class on first import,
+    # so it must not be imported before the directory is set.
+    from prometheus_client import multiprocess
+
+    multiprocess.mark_process_dead(worker.pid)
@@ -1,13 +1,72 @@
 import os
+import array
+import gzip
+import json
+import hashlib
+import heapq
+import hmac
+import itertools
+import math
+import time
+import threading
+import queue
+import atexit
+from collections import OrderedDict, deque
+import uuid
+import zipfile
+import mmap
+import multiprocessing
+import xml.etree.ElementTree as ET
+from contextlib import contextmanager
+from contextvars import ContextVar
+import numpy as np
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from concurrent.futures import (
+    ProcessPoolExecutor,
+    FIRST_COMPLETED,
+    ThreadPoolExecutor,
+    wait
+)
 import pdfplumber
 import urllib.parse as urlparse
-from flask import Flask, request, render_template, jsonify
+from flask import (
+    Flask,
+    Response,
+    request,
+    redirect,
+    render_template,
+    jsonify,
+    stream_with_context,
+    url_for
+)
 from flask_cors import CORS
 from googletrans import Translator
 import re
 from bs4 import BeautifulSoup
 import psycopg2
+import psycopg2.pool
+from psycopg2.extras import execute_values
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Histogram,
+    generate_latest,
+    multiprocess
+)
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
 
 
 # ============================================================
@@ -31,6 +90,25 @@ FEEDBACK_SECRET_KEY = os.environ.get(
 
 DATABASE_URL = os.environ.get("DATABASE_URL", "")
 
+REDIS_URL = os.environ.get("REDIS_URL", "")
+
+# Optional LibreTranslate-compatible endpoint used instead
+# of googletrans, e.g. a self-hosted translator.
+TRANSLATE_ENDPOINT = os.environ.get(
+    "TRANSLATE_ENDPOINT",
+    ""
+)
+
+DUCKDUCKGO_URL = os.environ.get(
+    "DUCKDUCKGO_URL",
+    "https://duckduckgo.com/html/"
+)
+
+PDF_CACHE_DIR = os.environ.get(
+    "PDF_CACHE_DIR",
+    ".pdf_cache"
+)
+
 
 # ============================================================
 # DATABASE CONFIGURATION
@@ -55,553 +133,5823 @@ if DATABASE_URL:
 
 
 # ============================================================
-# DUCKDUCKGO FALLBACK SEARCH
+# STAGE TIMING
+#
+# Pipeline stages are wrapped in stage(name). Observers
+# (benchmarks, metrics) receive (name, seconds) for every
+# completed stage. When a request is being traced, each
+# stage is also recorded as a span nested under the stage
+# that was open when it started.
 # ============================================================
 
-def duckduckgo_search(query, max_results=3):
+stage_observers = []
 
-    try:
+current_trace = ContextVar(
+    "current_trace",
+    default=None
+)
 
-        url = (
-            f"https://duckduckgo.com/html/"
-            f"?q={urlparse.quote_plus(query)}"
-        )
+current_span = ContextVar(
+    "current_span",
+    default=None
+)
 
-        headers = {
-            "User-Agent": "Mozilla/5.0"
-        }
 
-        res = requests.get(
-            url,
-            headers=headers,
-            timeout=10
-        )
+@contextmanager
+def stage(name):
 
-        res.raise_for_status()
+    trace = current_trace.get()
+
+    if trace is not None:
 
-        soup = BeautifulSoup(
-            res.text,
-            "html.parser"
+        span = trace.open_span(
+            name,
+            current_span.get()
         )
 
-        links = []
+        span_token = current_span.set(span["id"])
+
+    started = time.perf_counter()
+
+    try:
+        yield
+
+    finally:
 
-        for a in soup.select(".result__a[href]"):
+        elapsed = time.perf_counter() - started
 
-            href = a["href"]
+        if trace is not None:
 
-            match = re.search(
-                r"u=(https?%3A%2F%2F[^&]+)",
-                href
+            current_span.reset(span_token)
+
+            span["duration_ms"] = round(
+                elapsed * 1000,
+                3
             )
 
-            if match:
+        for observer in stage_observers:
+            observer(name, elapsed)
 
-                decoded_url = urlparse.unquote(
-                    match.group(1)
-                )
 
-            else:
+# ============================================================
+# METRICS
+#
+# Prometheus histograms for every stage() plus counters for
+# cache lookups, fallback searches and translation failures,
+# served on /metrics. Under gunicorn, PROMETHEUS_MULTIPROC_DIR
+# (set by gunicorn.conf.py) makes every worker write to
+# shared files so /metrics reports totals across workers.
+# ============================================================
 
-                decoded_url = href
+PROMETHEUS_MULTIPROC_DIR = os.environ.get(
+    "PROMETHEUS_MULTIPROC_DIR",
+    ""
+)
 
-            decoded_url = (
-                decoded_url
-                .strip()
-                .rstrip(">")
-                .rstrip("/.")
-            )
+STAGE_BUCKETS = (
+    0.001, 0.005, 0.01, 0.025, 0.05, 0.1,
+    0.25, 0.5, 1, 2.5, 5, 10, 30, 60
+)
 
-            if (
-                decoded_url.startswith("http")
-                and len(decoded_url.split("/")) > 3
-            ):
 
-                try:
+stage_seconds = Histogram(
+    "chatbot_stage_seconds",
+    "Time spent in each pipeline stage.",
+    ["stage"],
+    buckets=STAGE_BUCKETS
+)
 
-                    response = requests.head(
-                        decoded_url,
-                        allow_redirects=True,
-                        timeout=5
-                    )
+cache_lookups = Counter(
+    "chatbot_cache_lookups_total",
+    "Cache lookups by cache and result.",
+    ["cache", "result"]
+)
 
-                    if response.status_code == 200:
-                        links.append(decoded_url)
+fallback_searches = Counter(
+    "chatbot_fallback_searches_total",
+    "Answers that needed DuckDuckGo fallback sources."
+)
 
-                except requests.RequestException:
-                    continue
+table_answers = Counter(
+    "chatbot_table_answers_total",
+    "Questions answered from the PDF table index."
+)
 
-            if len(links) >= max_results:
-                break
+translation_failures = Counter(
+    "chatbot_translation_failures_total",
+    "Translation calls that raised.",
+    ["kind"]
+)
 
-        return links
 
-    except Exception as e:
+def observe_stage(name, seconds):
 
-        app.logger.error(
-            f"DuckDuckGo search error: {e}"
-        )
+    stage_seconds.labels(name).observe(seconds)
 
-        return []
 
+stage_observers.append(observe_stage)
 
-# ============================================================
-# URL EXTRACTION
-# ============================================================
 
-def extract_urls_from_context(context_text):
+def get_metrics_registry():
 
-    return set(
-        re.findall(
-            r'https?://[^\s<>"]+',
-            context_text
-        )
-    )
+    if not PROMETHEUS_MULTIPROC_DIR:
+        return REGISTRY
 
+    registry = CollectorRegistry()
 
-# ============================================================
-# TRUSTED GOVERNMENT DOMAINS
-# ============================================================
+    multiprocess.MultiProcessCollector(registry)
 
-ALLOWED_DOMAINS = [
-    "nida.nih.gov",
-    "samhsa.gov",
-    "cdc.gov",
-    "dea.gov",
-    "nih.gov"
-]
+    return registry
 
 
 # ============================================================
-# RESPONSE URL FILTER
+# REQUEST TRACING
+#
+# /ask?trace=1 (or an "X-Trace: 1" header) records every
+# stage of that request as a span. Spans are returned in the
+# JSON body and as a Server-Timing header, and written to
+# TRACE_DIR in Chrome trace format (chrome://tracing,
+# Perfetto, speedscope) when that is set.
 # ============================================================
 
-def filter_response_urls(
-    response_text,
-    valid_urls
-):
-
-    found_urls = re.findall(
-        r'https?://[^\s<>"]+',
-        response_text
-    )
-
-    for url in found_urls:
+TRACE_DIR = os.environ.get("TRACE_DIR", "")
 
-        if url in valid_urls:
-            continue
 
-        if any(
-            domain in url
-            for domain in ALLOWED_DOMAINS
-        ):
-            continue
+class RequestTrace:
 
-        try:
+    def __init__(self):
 
-            domain = (
-                urlparse
-                .urlparse(url)
-                .netloc
-            )
+        self.id = uuid.uuid4().hex
 
-            response_text = (
-                response_text
-                .replace(
-                    url,
-                    domain
-                )
-            )
+        self.started = time.perf_counter()
 
-        except Exception:
+        self.spans = []
 
-            response_text = (
-                response_text
-                .replace(
-                    url,
-                    "trusted site"
-                )
-            )
+        self.lock = threading.Lock()
 
-    return response_text
+    def open_span(self, name, parent):
 
+        span = {
+            "name": name,
+            "parent": parent,
+            "start_ms": round(
+                (time.perf_counter() - self.started)
+                * 1000,
+                3
+            ),
+            "duration_ms": None,
+            "thread": threading.get_ident()
+        }
 
-# ============================================================
-# CONVERSATION SETTINGS
-# ============================================================
+        with self.lock:
 
-conversation_history = []
+            span["id"] = len(self.spans)
 
+            self.spans.append(span)
 
-irrelevant_topics = [
-    "singer",
-    "actor",
-    "movie",
-    "music",
-    "pop culture",
-    "celebrity",
-    "weather",
-    "food",
-    "games"
-]
+        return span
 
+    def to_dict(self):
 
-relevant_topics = [
-    "opioid",
-    "opioids",
-    "addiction",
-    "overdose",
-    "pain",
-    "treatment",
-    "naloxone",
-    "withdrawal",
-    "rehab",
-    "fentanyl",
-    "heroin",
-    "oxycodone",
-    "hydrocodone",
-    "morphine",
-    "buprenorphine",
-    "methadone"
-]
+        return {
+            "id": self.id,
+            "total_ms": round(
+                (time.perf_counter() - self.started)
+                * 1000,
+                3
+            ),
+            "spans": [
+                {
+                    key: value
+                    for key, value in span.items()
+                    if key != "thread"
+                }
+                for span in self.spans
+            ]
+        }
 
+    def server_timing(self):
 
-# ============================================================
-# LANGUAGE NORMALIZATION
-# ============================================================
+        return ", ".join(
+            f"{span['name']};dur={span['duration_ms']}"
+            for span in self.spans
+            if span["duration_ms"] is not None
+        )
 
-def normalize_language_code(lang):
+    def to_chrome_trace(self):
+
+        pid = os.getpid()
+
+        return {
+            "traceEvents": [
+                {
+                    "name": span["name"],
+                    "ph": "X",
+                    "ts": round(span["start_ms"] * 1000),
+                    "dur": round(
+                        (span["duration_ms"] or 0) * 1000
+                    ),
+                    "pid": pid,
+                    "tid": span["thread"]
+                }
+                for span in self.spans
+            ],
+            "displayTimeUnit": "ms",
+            "otherData": {"trace_id": self.id}
+        }
 
-    if not lang:
-        return "en"
 
-    zh_map = {
-        "zh": "zh-CN",
-        "zh-cn": "zh-CN",
-        "zh-tw": "zh-TW"
-    }
+def is_trace_requested():
 
-    return zh_map.get(
-        lang.lower(),
-        lang
+    flag = (
+        request.args.get("trace")
+        or request.headers.get("X-Trace")
+        or ""
     )
 
+    return flag.lower() in ("1", "true", "yes")
 
-# ============================================================
-# QUESTION RELEVANCE
-# ============================================================
 
-def is_question_relevant(question):
+def write_trace_file(trace):
 
-    if not question:
-        return False
+    if not TRACE_DIR:
+        return
+
+    try:
 
-    q = question.lower()
+        os.makedirs(TRACE_DIR, exist_ok=True)
 
-    if any(
-        topic in q
-        for topic in relevant_topics
-    ):
-        return True
+        with open(
+            os.path.join(TRACE_DIR, f"{trace.id}.json"),
+            "w",
+            encoding="utf-8"
+        ) as f:
+            json.dump(trace.to_chrome_trace(), f)
 
-    if any(
-        topic in q
-        for topic in irrelevant_topics
-    ):
-        return False
+    except OSError as e:
 
-    return False
+        app.logger.warning(
+            f"Trace write failed: {e}"
+        )
 
 
 # ============================================================
-# PDF TEXT EXTRACTION
+# FEEDBACK WRITE QUEUE
+#
+# Feedback rows go into a bounded in-memory queue and a
+# background thread writes them in batched multi-row
+# inserts over pooled connections. The request returns as
+# soon as the row is queued. A batch that fails to insert
+# stays pending and is retried with exponential backoff,
+# and whatever is still pending at exit is flushed then.
 # ============================================================
 
-def extract_text_from_pdf(pdf_path):
-
-    text = ""
-
-    try:
-
-        with pdfplumber.open(pdf_path) as pdf:
+DB_POOL_MAXCONN = int(
+    os.environ.get(
+        "DB_POOL_MAXCONN",
+        4
+    )
+)
 
-            for page in pdf.pages:
+FEEDBACK_QUEUE_SIZE = int(
+    os.environ.get(
+        "FEEDBACK_QUEUE_SIZE",
+        1000
+    )
+)
 
-                try:
+FEEDBACK_BATCH_SIZE = int(
+    os.environ.get(
+        "FEEDBACK_BATCH_SIZE",
+        100
+    )
+)
 
-                    page_text = (
-                        page.extract_text()
-                    )
+FEEDBACK_FLUSH_INTERVAL = float(
+    os.environ.get(
+        "FEEDBACK_FLUSH_INTERVAL",
+        1.0
+    )
+)
 
-                    if page_text:
-                        text += (
-                            page_text + "\n"
-                        )
+FEEDBACK_RETRY_MAX_DELAY = float(
+    os.environ.get(
+        "FEEDBACK_RETRY_MAX_DELAY",
+        60.0
+    )
+)
 
-                except Exception as e:
 
-                    app.logger.warning(
-                        f"Could not extract text "
-                        f"from page in "
-                        f"{pdf_path}: {e}"
-                    )
+db_pool = None
 
-    except Exception as e:
+db_pool_pid = None
 
-        app.logger.error(
-            f"Could not open PDF "
-            f"{pdf_path}: {e}"
-        )
+db_pool_lock = threading.Lock()
 
-    return text.strip()
 
+feedback_queue = queue.Queue(
+    maxsize=FEEDBACK_QUEUE_SIZE
+)
 
-# ============================================================
-# PDF TABLE EXTRACTION
-# ============================================================
+# Rows taken off the queue but not yet written. Only
+# changed under feedback_flush_lock, so the writer and the
+# exit handler never insert the same rows twice.
+feedback_pending = []
 
-def extract_tables_from_pdf(pdf_path):
+feedback_flush_lock = threading.Lock()
 
-    table_text = ""
+feedback_writer_pid = None
 
-    try:
+feedback_writer_lock = threading.Lock()
 
-        with pdfplumber.open(pdf_path) as pdf:
+feedback_metrics = {
+    "queued": 0,
+    "written": 0,
+    "failed": 0,
+    "retries": 0,
+    "written_directly": 0,
+    "flushes": 0,
+    "last_flush_ms": 0.0,
+    "total_flush_ms": 0.0
+}
 
-            for page in pdf.pages:
 
-                try:
+def get_db_pool():
 
-                    tables = (
-                        page.extract_tables()
-                    )
+    global db_pool
+    global db_pool_pid
 
-                    for table in tables:
+    with db_pool_lock:
 
-                        for row in table:
+        if db_pool_pid != os.getpid():
 
-                            table_text += (
-                                " | ".join(
-                                    cell or ""
-                                    for cell in row
-                                )
-                                + "\n"
-                            )
+            db_pool = (
+                psycopg2.pool.ThreadedConnectionPool(
+                    1,
+                    DB_POOL_MAXCONN,
+                    **db_config
+                )
+            )
 
-                except Exception as e:
+            db_pool_pid = os.getpid()
 
-                    app.logger.warning(
-                        f"Could not extract "
-                        f"table from "
-                        f"{pdf_path}: {e}"
-                    )
+    return db_pool
 
-    except Exception as e:
 
-        app.logger.error(
-            f"Could not open PDF "
-            f"{pdf_path}: {e}"
-        )
+def run_in_db_transaction(callback):
 
-    return table_text.strip()
+    pool = get_db_pool()
 
+    conn = pool.getconn()
 
-# ============================================================
-# READ PDF FOLDER
-# ============================================================
+    broken = False
 
-def read_pdfs_in_folder(folder):
+    try:
 
-    output = ""
+        with conn.cursor() as cur:
+            result = callback(cur)
 
-    if not os.path.isdir(folder):
+        conn.commit()
 
-        app.logger.warning(
-            f"PDF folder '{folder}' "
-            f"does not exist."
-        )
+        return result
 
-        return output
+    except Exception:
 
-    try:
+        try:
+            conn.rollback()
+        except Exception:
+            broken = True
 
-        filenames = os.listdir(folder)
+        raise
 
-    except Exception as e:
+    finally:
 
-        app.logger.error(
-            f"Unable to read PDF folder: {e}"
+        pool.putconn(
+            conn,
+            close=broken or bool(conn.closed)
         )
 
-        return output
 
-    for filename in filenames:
+def insert_feedback_rows(rows):
 
-        if filename.lower().endswith(".pdf"):
+    def insert(cur):
 
-            path = os.path.join(
-                folder,
-                filename
+        execute_values(
+            cur,
+            """
+            INSERT INTO feedback
+            (
+                user_id,
+                rating,
+                comments
             )
+            VALUES %s;
+            """,
+            rows
+        )
 
-            app.logger.info(
-                f"Loading PDF: {filename}"
-            )
+    run_in_db_transaction(insert)
 
-            text = extract_text_from_pdf(
-                path
+
+# ------------------------------------------------------------
+# Dashboard aggregates
+#
+# feedback_daily_summary holds one row per (day, rating). A
+# statement trigger on feedback keeps it current, keyed on
+# each row's own timestamp, so every writer is counted and
+# the insert path never runs DDL. Each process runs the
+# migration (table, trigger, backfill) once and latches the
+# outcome; if the role cannot run it, the dashboard
+# aggregates the feedback table directly instead.
+# ------------------------------------------------------------
+
+feedback_summary_pid = None
+
+feedback_summary_ready = False
+
+
+def feedback_day_expression(cur):
+
+    cur.execute(
+        """
+        SELECT column_name
+        FROM information_schema.columns
+        WHERE table_name = 'feedback'
+        AND data_type IN (
+            'date',
+            'timestamp without time zone',
+            'timestamp with time zone'
+        )
+        ORDER BY ordinal_position
+        LIMIT 1;
+        """
+    )
+
+    row = cur.fetchone()
+
+    # Rows without a timestamp column are counted on the
+    # day they are seen.
+    if row is None:
+        return "CURRENT_DATE"
+
+    return f'COALESCE(CAST("{row[0]}" AS DATE), CURRENT_DATE)'
+
+
+def migrate_feedback_summary(cur):
+
+    cur.execute(
+        "SELECT pg_advisory_xact_lock("
+        "hashtext('feedback_daily_summary'));"
+    )
+
+    cur.execute(
+        """
+        SELECT 1
+        FROM pg_trigger
+        WHERE tgname = 'feedback_daily_summary_count'
+        AND tgrelid = 'feedback'::regclass;
+        """
+    )
+
+    if cur.fetchone() is not None:
+        return
+
+    # Hold off writers so no row lands between the backfill
+    # and the trigger.
+    cur.execute(
+        "LOCK TABLE feedback "
+        "IN SHARE ROW EXCLUSIVE MODE;"
+    )
+
+    day_expr = feedback_day_expression(cur)
+
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS feedback_daily_summary
+        (
+            day DATE NOT NULL,
+            rating INTEGER NOT NULL,
+            count BIGINT NOT NULL,
+            PRIMARY KEY (day, rating)
+        );
+        """
+    )
+
+    # Summaries kept by earlier versions may have drifted.
+    cur.execute(
+        "TRUNCATE feedback_daily_summary;"
+    )
+
+    cur.execute(
+        f"""
+        CREATE OR REPLACE FUNCTION
+            feedback_daily_summary_count()
+        RETURNS trigger AS $$
+        BEGIN
+            INSERT INTO feedback_daily_summary
+            (
+                day,
+                rating,
+                count
+            )
+            SELECT
+                {day_expr},
+                rating,
+                COUNT(*)
+            FROM inserted_feedback
+            WHERE rating IS NOT NULL
+            GROUP BY 1, 2
+            ON CONFLICT (day, rating)
+            DO UPDATE SET count =
+                feedback_daily_summary.count
+                + EXCLUDED.count;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+        """
+    )
+
+    cur.execute(
+        """
+        CREATE TRIGGER feedback_daily_summary_count
+        AFTER INSERT ON feedback
+        REFERENCING NEW TABLE AS inserted_feedback
+        FOR EACH STATEMENT
+        EXECUTE PROCEDURE feedback_daily_summary_count();
+        """
+    )
+
+    cur.execute(
+        f"""
+        INSERT INTO feedback_daily_summary
+        (
+            day,
+            rating,
+            count
+        )
+        SELECT
+            {day_expr},
+            rating,
+            COUNT(*)
+        FROM feedback
+        WHERE rating IS NOT NULL
+        GROUP BY 1, 2;
+        """
+    )
+
+
+def ensure_feedback_summary():
+
+    global feedback_summary_pid
+    global feedback_summary_ready
+
+    if feedback_summary_pid == os.getpid():
+        return feedback_summary_ready
+
+    try:
+
+        run_in_db_transaction(
+            migrate_feedback_summary
+        )
+
+        feedback_summary_ready = True
+
+    except Exception as e:
+
+        app.logger.warning(
+            f"Feedback summary unavailable, the "
+            f"dashboard will scan feedback: {e}"
+        )
+
+        feedback_summary_ready = False
+
+    feedback_summary_pid = os.getpid()
+
+    return feedback_summary_ready
+
+
+def flush_feedback_batch(rows):
+
+    started = time.perf_counter()
+
+    try:
+
+        insert_feedback_rows(rows)
+
+        feedback_metrics["written"] += len(rows)
+
+        ok = True
+
+    except Exception as e:
+
+        feedback_metrics["failed"] += len(rows)
+
+        app.logger.error(
+            f"DB Error writing "
+            f"{len(rows)} feedback rows: {e}"
+        )
+
+        ok = False
+
+    elapsed_ms = (
+        time.perf_counter() - started
+    ) * 1000
+
+    feedback_metrics["flushes"] += 1
+
+    feedback_metrics["last_flush_ms"] = elapsed_ms
+
+    feedback_metrics["total_flush_ms"] += elapsed_ms
+
+    return ok
+
+
+def flush_pending_feedback():
+
+    with feedback_flush_lock:
+
+        while len(feedback_pending) < FEEDBACK_BATCH_SIZE:
+
+            try:
+                feedback_pending.append(
+                    feedback_queue.get_nowait()
+                )
+            except queue.Empty:
+                break
+
+            feedback_queue.task_done()
+
+        if not feedback_pending:
+            return True
+
+        if not flush_feedback_batch(
+            list(feedback_pending)
+        ):
+            return False
+
+        del feedback_pending[:]
+
+        return True
+
+
+def feedback_writer():
+
+    delay = FEEDBACK_FLUSH_INTERVAL
+
+    while True:
+
+        if not feedback_pending:
+
+            first = feedback_queue.get()
+
+            with feedback_flush_lock:
+                feedback_pending.append(first)
+
+            feedback_queue.task_done()
+
+        # Give concurrent submissions a moment to arrive so
+        # they share one insert, and back off while the
+        # database is failing.
+        time.sleep(delay)
+
+        if flush_pending_feedback():
+
+            delay = FEEDBACK_FLUSH_INTERVAL
+
+        else:
+
+            feedback_metrics["retries"] += 1
+
+            delay = min(
+                delay * 2,
+                FEEDBACK_RETRY_MAX_DELAY
+            )
+
+
+def ensure_feedback_writer():
+
+    global feedback_writer_pid
+
+    with feedback_writer_lock:
+
+        if feedback_writer_pid != os.getpid():
+
+            threading.Thread(
+                target=feedback_writer,
+                name="feedback-writer",
+                daemon=True
+            ).start()
+
+            feedback_writer_pid = os.getpid()
+
+
+def flush_feedback_on_exit():
+
+    if feedback_writer_pid != os.getpid():
+        return
+
+    # Includes the rows the writer holds while it sleeps.
+    while feedback_pending or not feedback_queue.empty():
+
+        if not flush_pending_feedback():
+
+            app.logger.error(
+                f"Lost "
+                f"{len(feedback_pending) + feedback_queue.qsize()}"
+                f" feedback rows at exit"
+            )
+
+            break
+
+
+atexit.register(flush_feedback_on_exit)
+
+
+def submit_feedback(user_id, rating, comments):
+
+    row = (user_id, rating, comments)
+
+    ensure_feedback_writer()
+
+    try:
+
+        feedback_queue.put_nowait(row)
+
+        feedback_metrics["queued"] += 1
+
+    except queue.Full:
+
+        # Never drop feedback: write it inline instead.
+        insert_feedback_rows([row])
+
+        feedback_metrics["written_directly"] += 1
+
+
+def get_feedback_stats():
+
+    flushes = feedback_metrics["flushes"]
+
+    return {
+        **feedback_metrics,
+        "queue_depth": feedback_queue.qsize(),
+        "queue_maxsize": FEEDBACK_QUEUE_SIZE,
+        "avg_flush_ms": (
+            feedback_metrics["total_flush_ms"]
+            / flushes
+            if flushes
+            else 0.0
+        )
+    }
+
+
+# ============================================================
+# SHARED HTTP SESSION
+#
+# All outbound HTTP goes through one pooled keep-alive
+# session per process, with retry and backoff on 429 and
+# 5xx responses. POSTs to the LLM and translator are not
+# idempotent, so their adapter only retries when the server
+# refused the request (429/503) or the connection was never
+# made, never after a read error. Sessions are never shared
+# across a fork.
+# ============================================================
+
+HTTP_POOL_CONNECTIONS = int(
+    os.environ.get(
+        "HTTP_POOL_CONNECTIONS",
+        10
+    )
+)
+
+HTTP_POOL_MAXSIZE = int(
+    os.environ.get(
+        "HTTP_POOL_MAXSIZE",
+        20
+    )
+)
+
+HTTP_MAX_RETRIES = int(
+    os.environ.get(
+        "HTTP_MAX_RETRIES",
+        3
+    )
+)
+
+HTTP_BACKOFF_FACTOR = float(
+    os.environ.get(
+        "HTTP_BACKOFF_FACTOR",
+        0.5
+    )
+)
+
+
+http_session = None
+
+http_session_pid = None
+
+http_session_lock = threading.Lock()
+
+http_request_count = 0
+
+
+def count_http_response(response, *args, **kwargs):
+
+    global http_request_count
+
+    http_request_count += 1
+
+
+def get_http_session():
+
+    global http_session
+    global http_session_pid
+
+    if (
+        http_session is not None
+        and http_session_pid == os.getpid()
+    ):
+        return http_session
+
+    with http_session_lock:
+
+        if (
+            http_session is None
+            or http_session_pid != os.getpid()
+        ):
+
+            retry = Retry(
+                total=HTTP_MAX_RETRIES,
+                backoff_factor=HTTP_BACKOFF_FACTOR,
+                status_forcelist=[
+                    429,
+                    500,
+                    502,
+                    503,
+                    504
+                ],
+                raise_on_status=False
+            )
+
+            post_retry = Retry(
+                total=HTTP_MAX_RETRIES,
+                read=0,
+                backoff_factor=HTTP_BACKOFF_FACTOR,
+                status_forcelist=[
+                    429,
+                    503
+                ],
+                allowed_methods=None,
+                raise_on_status=False
+            )
+
+            adapter = HTTPAdapter(
+                pool_connections=HTTP_POOL_CONNECTIONS,
+                pool_maxsize=HTTP_POOL_MAXSIZE,
+                max_retries=retry
+            )
+
+            post_adapter = HTTPAdapter(
+                pool_connections=HTTP_POOL_CONNECTIONS,
+                pool_maxsize=HTTP_POOL_MAXSIZE,
+                max_retries=post_retry
+            )
+
+            session = requests.Session()
+
+            session.mount("http://", adapter)
+
+            session.mount("https://", adapter)
+
+            # requests picks the longest matching prefix.
+            for endpoint in (
+                LLAMA3_ENDPOINT,
+                TRANSLATE_ENDPOINT
+            ):
+
+                if endpoint:
+                    session.mount(endpoint, post_adapter)
+
+            session.hooks["response"].append(
+                count_http_response
+            )
+
+            http_session = session
+
+            http_session_pid = os.getpid()
+
+    return http_session
+
+
+def get_http_pool_stats():
+
+    stats = {
+        "pid": os.getpid(),
+        "requests": http_request_count,
+        "pool_connections": HTTP_POOL_CONNECTIONS,
+        "pool_maxsize": HTTP_POOL_MAXSIZE,
+        "pools": {}
+    }
+
+    if (
+        http_session is None
+        or http_session_pid != os.getpid()
+    ):
+        return stats
+
+    for adapter in dict.fromkeys(
+        http_session.adapters.values()
+    ):
+
+        pools = adapter.poolmanager.pools
+
+        for key in list(pools.keys()):
+
+            pool = pools.get(key)
+
+            if pool is None:
+                continue
+
+            entry = stats["pools"].setdefault(
+                f"{pool.scheme}://{pool.host}:{pool.port}",
+                {
+                    "connections_opened": 0,
+                    "requests": 0
+                }
+            )
+
+            entry["connections_opened"] += pool.num_connections
+
+            entry["requests"] += pool.num_requests
+
+    return stats
+
+
+# ============================================================
+# BOUNDED LRU CACHE
+#
+# Thread-safe LRU with an optional time-to-live, used for
+# every in-process cache in this file.
+# ============================================================
+
+class LRUCache:
+
+    def __init__(self, maxsize, ttl=None, name=None):
+
+        self.maxsize = maxsize
+
+        self.ttl = ttl
+
+        self.name = name
+
+        self.items = OrderedDict()
+
+        self.lock = threading.Lock()
+
+        self.hits = 0
+
+        self.misses = 0
+
+    def get(self, key, default=None):
+
+        with self.lock:
+
+            item = self.items.get(key)
+
+            if item is not None:
+
+                value, expires = item
+
+                if (
+                    expires is None
+                    or expires > time.monotonic()
+                ):
+
+                    self.items.move_to_end(key)
+
+                    self.hits += 1
+
+                    self.record("hit")
+
+                    return value
+
+                del self.items[key]
+
+            self.misses += 1
+
+            self.record("miss")
+
+            return default
+
+    def record(self, result):
+
+        if self.name:
+            cache_lookups.labels(self.name, result).inc()
+
+    def set(self, key, value, ttl=None):
+
+        if ttl is None:
+            ttl = self.ttl
+
+        expires = (
+            time.monotonic() + ttl
+            if ttl
+            else None
+        )
+
+        with self.lock:
+
+            self.items[key] = (value, expires)
+
+            self.items.move_to_end(key)
+
+            while len(self.items) > self.maxsize:
+                self.items.popitem(last=False)
+
+    def clear(self):
+
+        with self.lock:
+            self.items.clear()
+
+    def stats(self):
+
+        return {
+            "size": len(self.items),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses
+        }
+
+
+# ============================================================
+# OPTIONAL SHARED STORE
+#
+# When REDIS_URL is set (and the redis package is
+# installed) caches can share entries between workers.
+# ============================================================
+
+shared_store = None
+
+shared_store_pid = None
+
+
+def get_shared_store():
+
+    global shared_store
+    global shared_store_pid
+
+    if not REDIS_URL or redis is None:
+        return None
+
+    if shared_store_pid != os.getpid():
+
+        shared_store = redis.Redis.from_url(
+            REDIS_URL,
+            socket_timeout=0.5,
+            socket_connect_timeout=0.5
+        )
+
+        shared_store_pid = os.getpid()
+
+    return shared_store
+
+
+# ============================================================
+# DUCKDUCKGO FALLBACK SEARCH
+#
+# Candidate links are checked with concurrent HEAD requests
+# under one overall deadline. Search results and per-URL
+# liveness are cached with a TTL; failed checks are often
+# transient, so they expire after LINK_FAILURE_TTL, and a
+# result list cut short by the deadline is not cached.
+# ============================================================
+
+LINK_CHECK_WORKERS = int(
+    os.environ.get(
+        "LINK_CHECK_WORKERS",
+        8
+    )
+)
+
+LINK_CHECK_DEADLINE = float(
+    os.environ.get(
+        "LINK_CHECK_DEADLINE",
+        4
+    )
+)
+
+SEARCH_CACHE_TTL = int(
+    os.environ.get(
+        "SEARCH_CACHE_TTL",
+        6 * 60 * 60
+    )
+)
+
+LINK_FAILURE_TTL = int(
+    os.environ.get(
+        "LINK_FAILURE_TTL",
+        5 * 60
+    )
+)
+
+
+search_cache = LRUCache(
+    512,
+    SEARCH_CACHE_TTL,
+    name="search"
+)
+
+link_status_cache = LRUCache(
+    4096,
+    SEARCH_CACHE_TTL,
+    name="link_status"
+)
+
+
+link_check_executor = None
+
+link_check_executor_pid = None
+
+link_check_executor_lock = threading.Lock()
+
+
+def get_link_check_executor():
+
+    global link_check_executor
+    global link_check_executor_pid
+
+    with link_check_executor_lock:
+
+        if link_check_executor_pid != os.getpid():
+
+            link_check_executor = ThreadPoolExecutor(
+                max_workers=LINK_CHECK_WORKERS,
+                thread_name_prefix="link-check"
+            )
+
+            link_check_executor_pid = os.getpid()
+
+    return link_check_executor
+
+
+def is_link_alive(url):
+
+    try:
+
+        response = get_http_session().head(
+            url,
+            allow_redirects=True,
+            timeout=min(5, LINK_CHECK_DEADLINE)
+        )
+
+        alive = response.status_code == 200
+
+    except requests.RequestException:
+
+        alive = False
+
+    link_status_cache.set(
+        url,
+        alive,
+        None if alive else LINK_FAILURE_TTL
+    )
+
+    return alive
+
+
+def links_decided(urls, alive, max_results):
+
+    # True once the first max_results live links, in
+    # result order, no longer depend on pending checks.
+    found = 0
+
+    for url in urls:
+
+        if url not in alive:
+            return False
+
+        if alive[url]:
+
+            found += 1
+
+            if found >= max_results:
+                return True
+
+    return True
+
+
+def check_links(urls, max_results):
+
+    alive = {}
+
+    pending = {}
+
+    for url in urls:
+
+        status = link_status_cache.get(url)
+
+        if status is None:
+
+            pending[
+                get_link_check_executor().submit(
+                    is_link_alive,
+                    url
+                )
+            ] = url
+
+        else:
+
+            alive[url] = status
+
+    deadline = (
+        time.monotonic() + LINK_CHECK_DEADLINE
+    )
+
+    while pending and not links_decided(
+        urls,
+        alive,
+        max_results
+    ):
+
+        remaining = deadline - time.monotonic()
+
+        if remaining <= 0:
+            break
+
+        done, _ = wait(
+            pending,
+            timeout=remaining,
+            return_when=FIRST_COMPLETED
+        )
+
+        for future in done:
+
+            alive[pending.pop(future)] = (
+                future.result()
+            )
+
+    for future in pending:
+        future.cancel()
+
+    return [
+        url
+        for url in urls
+        if alive.get(url)
+    ][:max_results], links_decided(
+        urls,
+        alive,
+        max_results
+    )
+
+
+def extract_search_result_urls(html):
+
+    soup = BeautifulSoup(
+        html,
+        "html.parser"
+    )
+
+    urls = []
+
+    for a in soup.select(".result__a[href]"):
+
+        href = a["href"]
+
+        match = re.search(
+            r"u=(https?%3A%2F%2F[^&]+)",
+            href
+        )
+
+        if match:
+
+            decoded_url = urlparse.unquote(
+                match.group(1)
+            )
+
+        else:
+
+            decoded_url = href
+
+        decoded_url = (
+            decoded_url
+            .strip()
+            .rstrip(">")
+            .rstrip("/.")
+        )
+
+        if (
+            decoded_url.startswith("http")
+            and len(decoded_url.split("/")) > 3
+            and decoded_url not in urls
+        ):
+
+            urls.append(decoded_url)
+
+    return urls
+
+
+def duckduckgo_search(query, max_results=3):
+
+    with stage("fallback_search"):
+        return search_duckduckgo(
+            query,
+            max_results
+        )
+
+
+def search_duckduckgo(query, max_results):
+
+    cache_key = (
+        " ".join(query.lower().split()),
+        max_results
+    )
+
+    cached = search_cache.get(cache_key)
+
+    if cached is not None:
+        return list(cached)
+
+    try:
+
+        url = (
+            f"{DUCKDUCKGO_URL}"
+            f"?q={urlparse.quote_plus(query)}"
+        )
+
+        headers = {
+            "User-Agent": "Mozilla/5.0"
+        }
+
+        with stage("search_fetch"):
+
+            res = get_http_session().get(
+                url,
+                headers=headers,
+                timeout=10
+            )
+
+        res.raise_for_status()
+
+        with stage("link_check"):
+
+            links, decided = check_links(
+                extract_search_result_urls(
+                    res.text
+                ),
+                max_results
+            )
+
+        if decided:
+
+            search_cache.set(
+                cache_key,
+                links
+            )
+
+        return list(links)
+
+    except Exception as e:
+
+        app.logger.error(
+            f"DuckDuckGo search error: {e}"
+        )
+
+        return []
+
+
+# ============================================================
+# URL EXTRACTION
+# ============================================================
+
+def extract_urls_from_context(context_text):
+
+    return set(
+        re.findall(
+            r'https?://[^\s<>"]+',
+            context_text
+        )
+    )
+
+
+# ============================================================
+# TRUSTED GOVERNMENT DOMAINS
+# ============================================================
+
+ALLOWED_DOMAINS = [
+    "nida.nih.gov",
+    "samhsa.gov",
+    "cdc.gov",
+    "dea.gov",
+    "nih.gov"
+]
+
+
+# ============================================================
+# RESPONSE URL FILTER
+# ============================================================
+
+def filter_response_urls(
+    response_text,
+    valid_urls
+):
+
+    found_urls = re.findall(
+        r'https?://[^\s<>"]+',
+        response_text
+    )
+
+    for url in found_urls:
+
+        if url in valid_urls:
+            continue
+
+        if any(
+            domain in url
+            for domain in ALLOWED_DOMAINS
+        ):
+            continue
+
+        try:
+
+            domain = (
+                urlparse
+                .urlparse(url)
+                .netloc
+            )
+
+            response_text = (
+                response_text
+                .replace(
+                    url,
+                    domain
+                )
+            )
+
+        except Exception:
+
+            response_text = (
+                response_text
+                .replace(
+                    url,
+                    "trusted site"
+                )
+            )
+
+    return response_text
+
+
+# ============================================================
+# CONVERSATION SETTINGS
+#
+# History is kept per browser session in a bounded ring
+# buffer. Idle sessions expire, and the number of sessions
+# and total characters held per worker are capped. With
+# REDIS_URL set, history lives in Redis so every worker
+# sees the same conversation.
+# ============================================================
+
+CONVERSATION_MAX_TURNS = int(
+    os.environ.get(
+        "CONVERSATION_MAX_TURNS",
+        10
+    )
+)
+
+CONVERSATION_IDLE_TTL = int(
+    os.environ.get(
+        "CONVERSATION_IDLE_TTL",
+        30 * 60
+    )
+)
+
+CONVERSATION_MAX_SESSIONS = int(
+    os.environ.get(
+        "CONVERSATION_MAX_SESSIONS",
+        5000
+    )
+)
+
+CONVERSATION_MAX_CHARS = int(
+    os.environ.get(
+        "CONVERSATION_MAX_CHARS",
+        20_000_000
+    )
+)
+
+SESSION_COOKIE_NAME = "chat_session"
+
+
+class ConversationStore:
+
+    def __init__(
+        self,
+        max_turns,
+        idle_ttl,
+        max_sessions,
+        max_chars
+    ):
+
+        self.max_turns = max_turns
+
+        self.idle_ttl = idle_ttl
+
+        self.max_sessions = max_sessions
+
+        self.max_chars = max_chars
+
+        # session_id -> [deque of (role, content), last_seen]
+        self.sessions = OrderedDict()
+
+        self.total_chars = 0
+
+        self.evictions = 0
+
+        self.lock = threading.Lock()
+
+    def _drop(self, session_id):
+
+        turns, _ = self.sessions.pop(session_id)
+
+        self.total_chars -= sum(
+            len(content)
+            for _, content in turns
+        )
+
+        self.evictions += 1
+
+    def _evict(self, now):
+
+        while self.sessions:
+
+            oldest_id, (_, last_seen) = next(
+                iter(self.sessions.items())
+            )
+
+            if (
+                now - last_seen > self.idle_ttl
+                or len(self.sessions) > self.max_sessions
+                or self.total_chars > self.max_chars
+            ):
+                self._drop(oldest_id)
+
+            else:
+                break
+
+    def append(self, session_id, role, content):
+
+        store = get_shared_store()
+
+        if store is not None:
+
+            try:
+
+                key = f"conversation:{session_id}"
+
+                pipe = store.pipeline()
+
+                pipe.rpush(
+                    key,
+                    json.dumps([role, content])
+                )
+
+                pipe.ltrim(key, -self.max_turns, -1)
+
+                pipe.expire(key, self.idle_ttl)
+
+                pipe.execute()
+
+                return
+
+            except Exception as e:
+
+                app.logger.warning(
+                    f"Shared conversation "
+                    f"write failed: {e}"
+                )
+
+        now = time.monotonic()
+
+        with self.lock:
+
+            session = self.sessions.get(session_id)
+
+            if session is None:
+
+                session = [
+                    deque(maxlen=self.max_turns),
+                    now
+                ]
+
+                self.sessions[session_id] = session
+
+            turns = session[0]
+
+            if len(turns) == turns.maxlen:
+
+                self.total_chars -= len(
+                    turns[0][1]
+                )
+
+            turns.append((role, content))
+
+            self.total_chars += len(content)
+
+            session[1] = now
+
+            self.sessions.move_to_end(session_id)
+
+            self._evict(now)
+
+    def recent(self, session_id, count):
+
+        store = get_shared_store()
+
+        if store is not None:
+
+            try:
+
+                return [
+                    {
+                        "role": role,
+                        "content": content
+                    }
+                    for role, content in (
+                        json.loads(item)
+                        for item in store.lrange(
+                            f"conversation:{session_id}",
+                            -count,
+                            -1
+                        )
+                    )
+                ]
+
+            except Exception as e:
+
+                app.logger.warning(
+                    f"Shared conversation "
+                    f"read failed: {e}"
+                )
+
+        with self.lock:
+
+            self._evict(time.monotonic())
+
+            session = self.sessions.get(session_id)
+
+            if session is None:
+                return []
+
+            turns = list(session[0])[-count:]
+
+        return [
+            {
+                "role": role,
+                "content": content
+            }
+            for role, content in turns
+        ]
+
+    def stats(self):
+
+        return {
+            "sessions": len(self.sessions),
+            "total_chars": self.total_chars,
+            "evictions": self.evictions,
+            "max_sessions": self.max_sessions,
+            "max_chars": self.max_chars
+        }
+
+
+conversation_store = ConversationStore(
+    CONVERSATION_MAX_TURNS,
+    CONVERSATION_IDLE_TTL,
+    CONVERSATION_MAX_SESSIONS,
+    CONVERSATION_MAX_CHARS
+)
+
+
+def get_session_id(data):
+
+    session_id = (
+        data.get("session_id")
+        or request.cookies.get(
+            SESSION_COOKIE_NAME
+        )
+        or ""
+    )
+
+    if isinstance(session_id, str) and re.fullmatch(
+        r"[A-Za-z0-9_-]{1,64}",
+        session_id
+    ):
+        return session_id
+
+    return uuid.uuid4().hex
+
+
+def set_session_cookie(response, session_id):
+
+    response.set_cookie(
+        SESSION_COOKIE_NAME,
+        session_id,
+        max_age=CONVERSATION_IDLE_TTL,
+        httponly=True,
+        samesite="Lax"
+    )
+
+    return response
+
+
+irrelevant_topics = [
+    "singer",
+    "actor",
+    "movie",
+    "music",
+    "pop culture",
+    "celebrity",
+    "weather",
+    "food",
+    "games"
+]
+
+
+relevant_topics = [
+    "opioid",
+    "opioids",
+    "opiate",
+    "opium",
+    "addiction",
+    "addicted",
+    "overdose",
+    "pain",
+    "painkiller",
+    "treatment",
+    "naloxone",
+    "narcan",
+    "withdrawal",
+    "rehab",
+    "detox",
+    "recovery",
+    "harm reduction",
+    "substance use",
+    "fentanyl",
+    "carfentanil",
+    "heroin",
+    "oxycodone",
+    "oxycontin",
+    "percocet",
+    "hydrocodone",
+    "vicodin",
+    "hydromorphone",
+    "dilaudid",
+    "oxymorphone",
+    "morphine",
+    "codeine",
+    "tramadol",
+    "tapentadol",
+    "meperidine",
+    "demerol",
+    "buprenorphine",
+    "suboxone",
+    "methadone",
+    "naltrexone",
+    "vivitrol",
+    "xylazine"
+]
+
+
+# ============================================================
+# LANGUAGE NORMALIZATION
+# ============================================================
+
+def normalize_language_code(lang):
+
+    if not lang:
+        return "en"
+
+    zh_map = {
+        "zh": "zh-CN",
+        "zh-cn": "zh-CN",
+        "zh-tw": "zh-TW"
+    }
+
+    return zh_map.get(
+        lang.lower(),
+        lang
+    )
+
+
+def is_english(lang):
+
+    return lang.lower() in [
+        "en",
+        "en-us",
+        "en-gb"
+    ]
+
+
+# ============================================================
+# TRANSLATION SERVICE
+#
+# One googletrans client is reused per worker thread and
+# results are cached by (text, source, destination).
+# Fixed strings are pre-translated so they never hit the
+# network.
+# ============================================================
+
+TRANSLATION_CACHE_SIZE = int(
+    os.environ.get(
+        "TRANSLATION_CACHE_SIZE",
+        2048
+    )
+)
+
+
+translation_cache = LRUCache(
+    TRANSLATION_CACHE_SIZE,
+    name="translation"
+)
+
+translator_local = threading.local()
+
+
+OFF_TOPIC_MESSAGE = (
+    "Sorry, I can only answer "
+    "questions about opioids, "
+    "addiction, overdose, "
+    "or treatment."
+)
+
+
+PRETRANSLATED_MESSAGES = {
+
+    OFF_TOPIC_MESSAGE: {
+
+        "en":
+            OFF_TOPIC_MESSAGE,
+
+        "es":
+            "Lo siento, solo puedo responder "
+            "preguntas sobre opioides, "
+            "adicción, sobredosis "
+            "o tratamiento.",
+
+        "fr":
+            "Désolé, je peux seulement répondre "
+            "aux questions sur les opioïdes, "
+            "la dépendance, les surdoses "
+            "ou le traitement.",
+
+        "zh-CN":
+            "抱歉，我只能回答有关阿片类药物、"
+            "成瘾、过量服用或治疗的问题。",
+
+        "tw":
+            "Kafra, metumi ma mmuae wɔ "
+            "nsɛmmisa a ɛfa opioid, "
+            "nnubɔnenom, nnuru a wɔanom "
+            "aboro so, anaa ayaresa ho "
+            "nko ara."
+
+    }
+
+}
+
+
+def get_translator():
+
+    if getattr(
+        translator_local,
+        "pid",
+        None
+    ) != os.getpid():
+
+        translator_local.translator = (
+            Translator()
+        )
+
+        translator_local.pid = os.getpid()
+
+    return translator_local.translator
+
+
+def translate_text(
+    text,
+    dest,
+    src="auto"
+):
+
+    # Fixed messages are answered from the table, never
+    # from the LRU, where they could be evicted.
+    pretranslated = PRETRANSLATED_MESSAGES.get(
+        text,
+        {}
+    ).get(dest)
+
+    if pretranslated is not None:
+        return pretranslated
+
+    key = (text, src, dest)
+
+    cached = translation_cache.get(key)
+
+    if cached is not None:
+        return cached
+
+    with stage("translator"):
+
+        if TRANSLATE_ENDPOINT:
+
+            res = get_http_session().post(
+                TRANSLATE_ENDPOINT,
+                json={
+                    "q": text,
+                    "source": src,
+                    "target": dest,
+                    "format": "text"
+                },
+                timeout=10
+            )
+
+            res.raise_for_status()
+
+            translated = res.json()["translatedText"]
+
+        else:
+
+            translated = (
+                get_translator()
+                .translate(
+                    text,
+                    dest=dest,
+                    src=src
+                )
+                .text
+            )
+
+    translation_cache.set(
+        key,
+        translated
+    )
+
+    return translated
+
+
+# ============================================================
+# LOCAL LANGUAGE DETECTION
+#
+# Questions are scored against small lists of common words
+# per language, so the common case (an English question)
+# skips the network round trip to the translator. Only a
+# positive English result skips translation; unknown
+# scripts and close calls always go to the translator.
+# ============================================================
+
+LANGID_MIN_CONFIDENCE = float(
+    os.environ.get(
+        "LANGID_MIN_CONFIDENCE",
+        0.5
+    )
+)
+
+
+LANGUAGE_WORDS = {
+
+    "en": {
+        "a", "about", "after", "all", "am", "an", "and", "any",
+        "are", "at", "be", "been", "before", "being", "best",
+        "but", "by", "can", "could", "did", "do", "does",
+        "doing", "during", "each", "every", "for", "from",
+        "get", "getting", "give", "go", "had", "has", "have",
+        "having", "he", "help", "her", "him", "his", "how",
+        "i", "if", "in", "into", "is", "it", "its", "just",
+        "know", "last", "long", "many", "may", "me", "mean",
+        "more", "most", "much", "must", "my", "near", "need",
+        "no", "not", "of", "off", "on", "or", "other", "our",
+        "out", "over", "people", "safe", "she", "should",
+        "so", "some", "someone", "something", "take", "tell",
+        "than", "that", "the", "their", "them", "then",
+        "there", "these", "they", "this", "those", "to",
+        "too", "up", "use", "used", "uses", "using", "very",
+        "want", "was", "way", "we", "were", "what", "when",
+        "where", "which", "while", "who", "why", "will",
+        "with", "without", "would", "you", "your"
+    },
+
+    "es": {
+        "a", "al", "como", "cómo", "con", "cual", "cuál",
+        "cuales", "cuáles", "de", "del", "donde", "dónde",
+        "el", "en", "es", "esta", "está", "están", "hay",
+        "la", "las", "lo", "los", "mi", "mí", "para", "pero",
+        "por", "porque", "puede", "puedo", "que", "qué",
+        "se", "si", "sí", "sin", "son", "su", "sus", "un",
+        "una", "y", "yo"
+    },
+
+    "fr": {
+        "au", "aux", "avec", "ce", "cette", "comment", "dans",
+        "de", "des", "du", "elle", "en", "est", "et", "il",
+        "je", "la", "le", "les", "mon", "ne", "où", "par",
+        "pas", "peut", "pour", "pourquoi", "qu", "que",
+        "quel", "quelle", "quels", "qui", "sont", "sur",
+        "un", "une", "vous"
+    },
+
+    "de": {
+        "auf", "bei", "bin", "das", "dem", "den", "der",
+        "die", "ein", "eine", "einer", "es", "für", "hat",
+        "ich", "ist", "kann", "mit", "nicht", "sich", "sie",
+        "sind", "und", "von", "warum", "was", "welche",
+        "wie", "wo", "zu"
+    },
+
+    "pt": {
+        "ao", "com", "como", "da", "das", "de", "do", "dos",
+        "e", "é", "em", "está", "eu", "mim", "na", "não",
+        "no", "o", "onde", "os", "para", "pode", "por",
+        "porque", "posso", "que", "quê", "se", "sem", "são",
+        "um", "uma"
+    },
+
+    "nl": {
+        "bij", "dat", "de", "die", "een", "en", "hebben",
+        "het", "hoe", "ik", "in", "is", "kan", "met", "niet",
+        "of", "op", "van", "voor", "waar", "waarom", "wat",
+        "welke", "wie", "zijn"
+    },
+
+    "it": {
+        "che", "chi", "come", "con", "cosa", "del", "della",
+        "di", "dove", "è", "gli", "il", "in", "la", "le",
+        "lo", "non", "per", "perché", "posso", "può", "quale",
+        "sono", "un", "una"
+    },
+
+    "pl": {
+        "co", "czy", "dla", "do", "gdzie", "i", "jak",
+        "jest", "jestem", "mogę", "na", "nie", "od", "po",
+        "się", "to", "w", "z", "za", "że"
+    },
+
+    "tw": {
+        "aboro", "ama", "anaa", "ara", "bɛn", "dɛn", "ɛhe",
+        "ɛyɛ", "fa", "ho", "kasa", "kyerɛ", "me", "mu", "na",
+        "ne", "nko", "obi", "so", "sɛ", "sɛn", "wo", "wɔ",
+        "yi"
+    }
+
+}
+
+
+def detect_language(text):
+
+    letters = [
+        ch for ch in text
+        if ch.isalpha()
+    ]
+
+    if not letters:
+        return None, 0.0
+
+    cjk = sum(
+        1 for ch in letters
+        if "\u4e00" <= ch <= "\u9fff"
+    )
+
+    if cjk / len(letters) > 0.3:
+        return "zh-CN", 1.0
+
+    # Cyrillic, kana, Hangul and other scripts have no word
+    # list here; they are never taken for English.
+    ascii_letters = sum(
+        1 for ch in letters
+        if ch.isascii()
+    )
+
+    if ascii_letters / len(letters) < 0.7:
+        return None, 0.0
+
+    words = re.findall(
+        r"[^\W\d_]+",
+        text.lower()
+    )
+
+    known = [
+        word for word in words
+        if any(
+            word in vocabulary
+            for vocabulary in LANGUAGE_WORDS.values()
+        )
+    ]
+
+    if not known:
+        return None, 0.0
+
+    scores = sorted(
+        (
+            (
+                sum(
+                    1 for word in known
+                    if word in vocabulary
+                ) / len(known),
+                lang
+            )
+            for lang, vocabulary
+            in LANGUAGE_WORDS.items()
+        ),
+        reverse=True
+    )
+
+    (best, lang), (runner_up, _) = (
+        scores[0],
+        scores[1]
+    )
+
+    if best <= runner_up:
+        return None, 0.0
+
+    return lang, best
+
+
+def question_needs_translation(
+    question,
+    client_lang
+):
+
+    lang, confidence = detect_language(
+        question
+    )
+
+    # A bare drug name or an unknown script is not evidence
+    # of English, whatever language the client reports.
+    return not (
+        lang == "en"
+        and confidence >= LANGID_MIN_CONFIDENCE
+    )
+
+
+# ============================================================
+# QUESTION RELEVANCE
+#
+# Both topic lists are compiled into one regex whose
+# alternatives are factored into a character trie, so a
+# question is scanned once and the work per position is
+# bounded by keyword length rather than list size. Matches
+# start at a word boundary and accept any ending, so
+# "overdosed" and "opioids" count, and stems ending in "e"
+# also match their "-ing" form ("overdosing").
+# ============================================================
+
+def build_trie_pattern(words):
+
+    trie = {}
+
+    for word in words:
+
+        node = trie
+
+        for ch in word.lower():
+            node = node.setdefault(ch, {})
+
+        node[""] = {}
+
+    def to_pattern(node):
+
+        terminal = "" in node
+
+        branches = [
+            (
+                r"[\s-]+"
+                if ch == " "
+                else re.escape(ch)
+            )
+            + to_pattern(child)
+            for ch, child in sorted(node.items())
+            if ch
+        ]
+
+        if not branches:
+            return ""
+
+        if len(branches) == 1:
+            body = branches[0]
+        else:
+            body = "(?:" + "|".join(branches) + ")"
+
+        if terminal:
+            return "(?:" + body + ")?"
+
+        return body
+
+    return to_pattern(trie)
+
+
+def with_inflections(words):
+
+    return list(words) + [
+        word[:-1] + "ing"
+        for word in words
+        if word.endswith("e")
+    ]
+
+
+def compile_topic_matcher(
+    relevant,
+    irrelevant
+):
+
+    relevant = with_inflections(relevant)
+
+    irrelevant = with_inflections(irrelevant)
+
+    return re.compile(
+        r"\b(?:"
+        r"(?P<relevant>"
+        + build_trie_pattern(relevant)
+        + r")|(?P<irrelevant>"
+        + build_trie_pattern(irrelevant)
+        + r"))\w*",
+        re.IGNORECASE
+    )
+
+
+topic_matcher = compile_topic_matcher(
+    relevant_topics,
+    irrelevant_topics
+)
+
+
+def is_question_relevant(question):
+
+    if not question:
+        return False
+
+    # Any relevant topic wins, even if an irrelevant one
+    # also appears in the question.
+    return any(
+        match.lastgroup == "relevant"
+        for match in topic_matcher.finditer(
+            question
+        )
+    )
+
+
+# ============================================================
+# PDF EXTRACTION
+#
+# Each PDF is opened once and every page yields both its
+# text and its table rows.
+# ============================================================
+
+def iter_pdf_pages(pdf_path):
+
+    try:
+
+        with pdfplumber.open(pdf_path) as pdf:
+
+            for page in pdf.pages:
+
+                page_text = ""
+
+                page_tables = []
+
+                try:
+
+                    page_text = (
+                        page.extract_text()
+                        or ""
+                    )
+
+                except Exception as e:
+
+                    app.logger.warning(
+                        f"Could not extract text "
+                        f"from page in "
+                        f"{pdf_path}: {e}"
+                    )
+
+                try:
+
+                    page_tables = [
+                        [
+                            [
+                                cell or ""
+                                for cell in row
+                            ]
+                            for row in table
+                        ]
+                        for table
+                        in page.extract_tables()
+                    ]
+
+                except Exception as e:
+
+                    app.logger.warning(
+                        f"Could not extract "
+                        f"table from "
+                        f"{pdf_path}: {e}"
+                    )
+
+                yield {
+                    "text": page_text.strip(),
+                    "tables": page_tables
+                }
+
+    except Exception as e:
+
+        app.logger.error(
+            f"Could not open PDF "
+            f"{pdf_path}: {e}"
+        )
+
+
+def extract_pdf(pdf_path):
+
+    started = time.perf_counter()
+
+    pages = list(
+        iter_pdf_pages(pdf_path)
+    )
+
+    app.logger.info(
+        f"Extracted {len(pages)} pages "
+        f"from {pdf_path} in "
+        f"{time.perf_counter() - started:.2f}s"
+    )
+
+    return pages
+
+
+def format_table_rows(table):
+
+    return "\n".join(
+        " | ".join(row)
+        for row in table
+    )
+
+
+# ============================================================
+# PDF EXTRACTION CACHE
+#
+# Extracted pages (text and tables) are stored on disk, one gzip'd
+# JSON file per document named by the SHA-256 of the PDF.
+# A small manifest maps each path to its size, mtime and
+# hash, so unchanged files are recognised without hashing.
+# ============================================================
+
+PDF_CACHE_VERSION = 2
+
+pdf_cache_manifest = None
+
+
+def get_pdf_cache_manifest_path():
+
+    return os.path.join(
+        PDF_CACHE_DIR,
+        "manifest.json"
+    )
+
+
+def load_pdf_cache_manifest():
+
+    global pdf_cache_manifest
+
+    if pdf_cache_manifest is not None:
+        return pdf_cache_manifest
+
+    pdf_cache_manifest = {}
+
+    try:
+
+        with open(
+            get_pdf_cache_manifest_path(),
+            "r",
+            encoding="utf-8"
+        ) as f:
+
+            data = json.load(f)
+
+        if data.get("version") == PDF_CACHE_VERSION:
+
+            pdf_cache_manifest = (
+                data.get("files", {})
+            )
+
+    except FileNotFoundError:
+        pass
+
+    except Exception as e:
+
+        app.logger.warning(
+            f"Ignoring unreadable PDF "
+            f"cache manifest: {e}"
+        )
+
+    return pdf_cache_manifest
+
+
+def write_file_atomic(path, data):
+
+    tmp_path = (
+        f"{path}.{os.getpid()}.tmp"
+    )
+
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+
+    os.replace(tmp_path, path)
+
+
+def save_pdf_cache_manifest():
+
+    try:
+
+        os.makedirs(
+            PDF_CACHE_DIR,
+            exist_ok=True
+        )
+
+        write_file_atomic(
+            get_pdf_cache_manifest_path(),
+            json.dumps(
+                {
+                    "version":
+                        PDF_CACHE_VERSION,
+                    "files":
+                        load_pdf_cache_manifest()
+                },
+                sort_keys=True
+            ).encode("utf-8")
+        )
+
+    except Exception as e:
+
+        app.logger.warning(
+            f"Could not save PDF cache "
+            f"manifest: {e}"
+        )
+
+
+def file_sha256(path):
+
+    digest = hashlib.sha256()
+
+    with open(path, "rb") as f:
+
+        for block in iter(
+            lambda: f.read(1024 * 1024),
+            b""
+        ):
+            digest.update(block)
+
+    return digest.hexdigest()
+
+
+def get_pdf_cache_entry_path(sha256):
+
+    return os.path.join(
+        PDF_CACHE_DIR,
+        f"{sha256}.json.gz"
+    )
+
+
+def read_pdf_cache_entry(sha256):
+
+    try:
+
+        with gzip.open(
+            get_pdf_cache_entry_path(sha256),
+            "rt",
+            encoding="utf-8"
+        ) as f:
+
+            entry = json.load(f)
+
+        if entry.get("version") == PDF_CACHE_VERSION:
+            return entry
+
+    except FileNotFoundError:
+        pass
+
+    except Exception as e:
+
+        app.logger.warning(
+            f"Ignoring unreadable PDF "
+            f"cache entry {sha256}: {e}"
+        )
+
+    return None
+
+
+def write_pdf_cache_entry(sha256, entry):
+
+    try:
+
+        os.makedirs(
+            PDF_CACHE_DIR,
+            exist_ok=True
+        )
+
+        write_file_atomic(
+            get_pdf_cache_entry_path(sha256),
+            gzip.compress(
+                json.dumps(
+                    entry,
+                    separators=(",", ":")
+                ).encode("utf-8")
+            )
+        )
+
+    except Exception as e:
+
+        app.logger.warning(
+            f"Could not write PDF cache "
+            f"entry for {sha256}: {e}"
+        )
+
+
+def lookup_cached_pdf(pdf_path):
+
+    try:
+
+        stat = os.stat(pdf_path)
+
+    except OSError as e:
+
+        app.logger.error(
+            f"Could not stat PDF "
+            f"{pdf_path}: {e}"
+        )
+
+        return None, {"pages": []}
+
+    known = load_pdf_cache_manifest().get(
+        pdf_path
+    )
+
+    if (
+        known
+        and known.get("size") == stat.st_size
+        and known.get("mtime") == stat.st_mtime_ns
+    ):
+
+        sha256 = known["sha256"]
+
+    else:
+
+        sha256 = file_sha256(pdf_path)
+
+    fingerprint = {
+        "size": stat.st_size,
+        "mtime": stat.st_mtime_ns,
+        "sha256": sha256
+    }
+
+    return (
+        fingerprint,
+        read_pdf_cache_entry(sha256)
+    )
+
+
+def store_cached_pdf(
+    pdf_path,
+    fingerprint,
+    entry=None
+):
+
+    if entry is not None:
+
+        write_pdf_cache_entry(
+            fingerprint["sha256"],
+            entry
+        )
+
+    manifest = load_pdf_cache_manifest()
+
+    if manifest.get(pdf_path) == fingerprint:
+        return False
+
+    manifest[pdf_path] = fingerprint
+
+    return True
+
+
+def make_pdf_cache_entry(pages):
+
+    return {
+        "version": PDF_CACHE_VERSION,
+        "pages": pages
+    }
+
+
+def load_cached_pdf(pdf_path):
+
+    fingerprint, entry = lookup_cached_pdf(
+        pdf_path
+    )
+
+    if fingerprint is None:
+        return entry
+
+    new_entry = None
+
+    if entry is None:
+
+        app.logger.info(
+            f"Extracting PDF: {pdf_path}"
+        )
+
+        entry = new_entry = (
+            make_pdf_cache_entry(
+                extract_pdf(pdf_path)
+            )
+        )
+
+    if store_cached_pdf(
+        pdf_path,
+        fingerprint,
+        new_entry
+    ):
+        save_pdf_cache_manifest()
+
+    return entry
+
+
+# ============================================================
+# PARALLEL PDF INGESTION
+#
+# Cache misses are extracted in a process pool because
+# pdfplumber is CPU-bound. Results are merged back in
+# filename order so the index is built deterministically.
+# ============================================================
+
+PDF_INGEST_WORKERS = int(
+    os.environ.get(
+        "PDF_INGEST_WORKERS",
+        os.cpu_count() or 1
+    )
+)
+
+# Extraction also runs from the corpus watcher thread, and
+# forking a multithreaded worker can copy held locks into
+# the children, so the pool never uses fork.
+PDF_INGEST_START_METHOD = (
+    "forkserver"
+    if "forkserver" in multiprocessing.get_all_start_methods()
+    else "spawn"
+)
+
+
+def load_cached_pdfs(
+    pdf_paths,
+    workers=PDF_INGEST_WORKERS
+):
+
+    entries = {}
+
+    fingerprints = {}
+
+    missing = []
+
+    for path in pdf_paths:
+
+        fingerprint, entry = (
+            lookup_cached_pdf(path)
+        )
+
+        entries[path] = entry
+
+        if fingerprint is None:
+            continue
+
+        fingerprints[path] = fingerprint
+
+        if entry is None:
+            missing.append(path)
+
+    if len(missing) > 1 and workers > 1:
+
+        app.logger.info(
+            f"Extracting {len(missing)} PDFs "
+            f"with {workers} processes"
+        )
+
+        with ProcessPoolExecutor(
+            max_workers=min(
+                workers,
+                len(missing)
+            ),
+            mp_context=multiprocessing.get_context(
+                PDF_INGEST_START_METHOD
+            )
+        ) as pool:
+
+            extracted = pool.map(
+                extract_pdf,
+                missing
+            )
+
+            for path, pages in zip(
+                missing,
+                extracted
+            ):
+
+                entries[path] = (
+                    make_pdf_cache_entry(pages)
+                )
+
+    else:
+
+        for path in missing:
+
+            app.logger.info(
+                f"Extracting PDF: {path}"
+            )
+
+            entries[path] = (
+                make_pdf_cache_entry(
+                    extract_pdf(path)
+                )
+            )
+
+    manifest_changed = False
+
+    for path, fingerprint in (
+        fingerprints.items()
+    ):
+
+        if store_cached_pdf(
+            path,
+            fingerprint,
+            entries[path]
+            if path in missing
+            else None
+        ):
+            manifest_changed = True
+
+    if manifest_changed:
+        save_pdf_cache_manifest()
+
+    return [
+        entries[path]
+        for path in pdf_paths
+    ]
+
+
+# ============================================================
+# STREAMING PDF READER
+#
+# Extraction is a generator pipeline:
+# documents -> pages -> text blocks.
+# Consumers pull only as many pages as they need, so
+# nothing is parsed just to be thrown away.
+# ============================================================
+
+def iter_pdf_paths(folder):
+
+    if not os.path.isdir(folder):
+
+        app.logger.warning(
+            f"PDF folder '{folder}' "
+            f"does not exist."
+        )
+
+        return
+
+    try:
+
+        filenames = sorted(
+            os.listdir(folder)
+        )
+
+    except Exception as e:
+
+        app.logger.error(
+            f"Unable to read PDF folder: {e}"
+        )
+
+        return
+
+    for filename in filenames:
+
+        if filename.lower().endswith(".pdf"):
+
+            yield (
+                filename,
+                os.path.join(folder, filename)
+            )
+
+
+def iter_cached_pdf_pages(pdf_path):
+
+    fingerprint, entry = lookup_cached_pdf(
+        pdf_path
+    )
+
+    if entry is not None:
+
+        yield from entry["pages"]
+
+        return
+
+    pages = []
+
+    for page in iter_pdf_pages(pdf_path):
+
+        pages.append(page)
+
+        yield page
+
+    # Only a fully read document is cached; a consumer
+    # that stops early never reaches this point.
+    if store_cached_pdf(
+        pdf_path,
+        fingerprint,
+        make_pdf_cache_entry(pages)
+    ):
+        save_pdf_cache_manifest()
+
+
+def iter_folder_pages(folder):
+
+    for filename, path in iter_pdf_paths(
+        folder
+    ):
+
+        for page in iter_cached_pdf_pages(
+            path
+        ):
+
+            yield filename, page
+
+
+def iter_document_pages(documents):
+
+    for filename, document in documents:
+
+        for page in document["pages"]:
+
+            yield filename, page
+
+
+# ============================================================
+# DOCUMENT CHUNKING
+#
+# Each page is split into paragraph-sized chunks so that
+# retrieval can send only the passages that matter.
+# ============================================================
+
+CHUNK_MAX_CHARS = int(
+    os.environ.get(
+        "CHUNK_MAX_CHARS",
+        800
+    )
+)
+
+
+def split_into_chunks(
+    text,
+    max_chars=CHUNK_MAX_CHARS
+):
+
+    current = []
+
+    current_len = 0
+
+    for line in text.splitlines():
+
+        line = line.strip()
+
+        if not line:
+            continue
+
+        if (
+            current
+            and current_len + len(line) > max_chars
+        ):
+
+            yield "\n".join(current)
+
+            current = []
+
+            current_len = 0
+
+        current.append(line)
+
+        current_len += len(line) + 1
+
+    if current:
+
+        yield "\n".join(current)
+
+
+def iter_text_blocks(pages):
+
+    for filename, page in pages:
+
+        parts = [page["text"]] + [
+            format_table_rows(table)
+            for table in page["tables"]
+        ]
+
+        for part in parts:
+
+            for chunk in split_into_chunks(
+                part
+            ):
+
+                yield filename, chunk
+
+
+def chunk_documents(documents):
+
+    return list(
+        iter_text_blocks(
+            iter_document_pages(documents)
+        )
+    )
+
+
+# ============================================================
+# CONTEXT BUDGET
+#
+# Budgets are measured with any length function, so the
+# same consumer works for characters or estimated tokens.
+# ============================================================
+
+def collect_within_budget(
+    blocks,
+    budget,
+    measure=len
+):
+
+    parts = []
+
+    used = 0
+
+    for filename, block in blocks:
+
+        part = f"[Source: {filename}]\n{block}"
+
+        cost = measure(part)
+
+        if used + cost > budget:
+            break
+
+        parts.append(part)
+
+        used += cost
+
+    return parts
+
+
+# ============================================================
+# BM25 RETRIEVAL INDEX
+# ============================================================
+
+RETRIEVAL_TOP_K = int(
+    os.environ.get(
+        "RETRIEVAL_TOP_K",
+        5
+    )
+)
+
+
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by",
+    "can", "do", "does", "for", "from", "how", "i",
+    "in", "is", "it", "me", "of", "on", "or", "that",
+    "the", "this", "to", "was", "what", "when",
+    "where", "which", "who", "why", "with", "you"
+}
+
+
+def tokenize(text):
+
+    return [
+        token
+        for token in re.findall(
+            r"[a-z0-9]+",
+            text.lower()
+        )
+        if token not in STOPWORDS
+    ]
+
+
+class BM25Index:
+
+    def __init__(
+        self,
+        chunks,
+        k1=1.5,
+        b=0.75
+    ):
+
+        self.chunks = chunks
+
+        self.k1 = k1
+
+        self.b = b
+
+        self.postings = {}
+
+        self.chunk_lengths = []
+
+        for chunk_id, (_, text) in enumerate(
+            chunks
+        ):
+
+            tokens = tokenize(text)
+
+            self.chunk_lengths.append(
+                len(tokens)
+            )
+
+            counts = {}
+
+            for token in tokens:
+
+                counts[token] = (
+                    counts.get(token, 0) + 1
+                )
+
+            for token, tf in counts.items():
+
+                self.postings.setdefault(
+                    token,
+                    []
+                ).append(
+                    (chunk_id, tf)
+                )
+
+        total = len(self.chunk_lengths)
+
+        self.avg_length = (
+            sum(self.chunk_lengths) / total
+            if total
+            else 0.0
+        )
+
+        self.idf = {
+            token: math.log(
+                1
+                + (total - len(postings) + 0.5)
+                / (len(postings) + 0.5)
+            )
+            for token, postings
+            in self.postings.items()
+        }
+
+    def __len__(self):
+
+        return len(self.chunks)
+
+    def search(self, query, k=RETRIEVAL_TOP_K):
+
+        scores = {}
+
+        for token in set(tokenize(query)):
+
+            idf = self.idf.get(token)
+
+            if idf is None:
+                continue
+
+            for chunk_id, tf in self.postings[token]:
+
+                norm = self.k1 * (
+                    1
+                    - self.b
+                    + self.b
+                    * self.chunk_lengths[chunk_id]
+                    / self.avg_length
+                )
+
+                scores[chunk_id] = (
+                    scores.get(chunk_id, 0.0)
+                    + idf * tf * (self.k1 + 1)
+                    / (tf + norm)
+                )
+
+        ranked = heapq.nlargest(
+            k,
+            scores.items(),
+            key=lambda item: item[1]
+        )
+
+        return [
+            self.chunks[chunk_id]
+            for chunk_id, _ in ranked
+        ]
+
+
+# ============================================================
+# MEMORY-MAPPED CORPUS FILE
+#
+# The chunk texts and the BM25 postings are written once to
+# a binary file (JSON header, then 8-byte aligned arrays)
+# that every worker maps read-only, so the OS page cache
+# holds a single copy. Terms are found by binary search over
+# the sorted term blob, so attaching parses only the header.
+# Each document's raw tables are a separate JSON slice,
+# decoded only when the table index is first needed.
+# The file is keyed by the PDF folder's sizes and mtimes;
+# a worker that finds a matching file maps it instead of
+# reading any PDFs.
+# ============================================================
+
+CORPUS_MMAP = os.environ.get(
+    "CORPUS_MMAP",
+    "true"
+).lower() in ("1", "true", "yes")
+
+CORPUS_FILE = os.environ.get(
+    "CORPUS_FILE",
+    os.path.join(PDF_CACHE_DIR, "corpus.bin")
+)
+
+CORPUS_FILE_MAGIC = b"CORPUS01"
+
+CORPUS_FILE_VERSION = 2
+
+
+@contextmanager
+def corpus_file_lock():
+
+    if fcntl is None:
+        yield
+        return
+
+    os.makedirs(
+        os.path.dirname(CORPUS_FILE) or ".",
+        exist_ok=True
+    )
+
+    with open(f"{CORPUS_FILE}.lock", "w") as lock_file:
+
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+
+        try:
+            yield
+
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def write_corpus_file(key, filenames, chunks, page_tables):
+
+    index = BM25Index(chunks)
+
+    file_ids = {
+        filename: file_id
+        for file_id, filename in enumerate(filenames)
+    }
+
+    texts = [text.encode("utf-8") for _, text in chunks]
+
+    terms = sorted(
+        index.postings,
+        key=lambda term: term.encode("utf-8")
+    )
+
+    encoded_terms = [term.encode("utf-8") for term in terms]
+
+    postings = [index.postings[term] for term in terms]
+
+    tables = [
+        json.dumps(
+            [
+                entry
+                for entry in page_tables
+                if entry[0] == filename
+            ]
+        ).encode("utf-8")
+        for filename in filenames
+    ]
+
+    sections = {
+        "chunk_file": np.array(
+            [file_ids[filename] for filename, _ in chunks],
+            dtype=np.int32
+        ),
+        "chunk_lengths": np.array(
+            index.chunk_lengths,
+            dtype=np.float32
+        ),
+        "text_offsets": np.cumsum(
+            [0] + [len(text) for text in texts],
+            dtype=np.int64
+        ),
+        "text": np.frombuffer(
+            b"".join(texts),
+            dtype=np.uint8
+        ),
+        "term_offsets": np.cumsum(
+            [0] + [len(term) for term in encoded_terms],
+            dtype=np.int64
+        ),
+        "terms": np.frombuffer(
+            b"".join(encoded_terms),
+            dtype=np.uint8
+        ),
+        "idf": np.array(
+            [index.idf[term] for term in terms],
+            dtype=np.float64
+        ),
+        "posting_offsets": np.cumsum(
+            [0] + [len(posting) for posting in postings],
+            dtype=np.int64
+        ),
+        "posting_chunks": np.array(
+            [
+                chunk_id
+                for posting in postings
+                for chunk_id, _ in posting
+            ],
+            dtype=np.int32
+        ),
+        "posting_tf": np.array(
+            [
+                tf
+                for posting in postings
+                for _, tf in posting
+            ],
+            dtype=np.float32
+        ),
+        "table_offsets": np.cumsum(
+            [0] + [len(table) for table in tables],
+            dtype=np.int64
+        ),
+        "tables": np.frombuffer(
+            b"".join(tables),
+            dtype=np.uint8
+        )
+    }
+
+    layout = {}
+
+    offset = 0
+
+    for name, values in sections.items():
+
+        layout[name] = [offset, values.dtype.str, len(values)]
+
+        offset += -(-values.nbytes // 8) * 8
+
+    header = json.dumps(
+        {
+            "version": CORPUS_FILE_VERSION,
+            "key": key,
+            "k1": index.k1,
+            "b": index.b,
+            "avg_length": index.avg_length,
+            "filenames": filenames,
+            "sections": layout
+        }
+    ).encode("utf-8")
+
+    header += b" " * (-len(header) % 8)
+
+    temp_path = f"{CORPUS_FILE}.{os.getpid()}.tmp"
+
+    with open(temp_path, "wb") as f:
+
+        f.write(CORPUS_FILE_MAGIC)
+
+        f.write(len(header).to_bytes(8, "little"))
+
+        f.write(header)
+
+        for values in sections.values():
+
+            f.write(values.tobytes())
+
+            f.write(b"\0" * (-values.nbytes % 8))
+
+    # Workers that mapped the previous file keep reading it
+    # until they swap.
+    os.replace(temp_path, CORPUS_FILE)
+
+
+class MappedCorpusIndex:
+
+    def __init__(self, path):
+
+        with open(path, "rb") as f:
+
+            self.mm = mmap.mmap(
+                f.fileno(),
+                0,
+                access=mmap.ACCESS_READ
+            )
+
+        if self.mm[:8] != CORPUS_FILE_MAGIC:
+            raise ValueError(f"{path} is not a corpus file")
+
+        header_length = int.from_bytes(
+            self.mm[8:16],
+            "little"
+        )
+
+        header = json.loads(
+            self.mm[16:16 + header_length]
+        )
+
+        if header.get("version") != CORPUS_FILE_VERSION:
+            raise ValueError(
+                f"{path} is version {header.get('version')}, "
+                f"expected {CORPUS_FILE_VERSION}"
+            )
+
+        self.key = header["key"]
+
+        self.k1 = header["k1"]
+
+        self.b = header["b"]
+
+        self.avg_length = header["avg_length"]
+
+        self.filenames = header["filenames"]
+
+        base = 16 + header_length
+
+        for name, (offset, dtype, count) in (
+            header["sections"].items()
+        ):
+
+            setattr(
+                self,
+                name,
+                np.frombuffer(
+                    self.mm,
+                    dtype=np.dtype(dtype),
+                    count=count,
+                    offset=base + offset
+                )
+            )
+
+        self.text_base = base + header["sections"]["text"][0]
+
+        self.terms_base = base + header["sections"]["terms"][0]
+
+        self.tables_base = base + header["sections"]["tables"][0]
+
+    def __len__(self):
+
+        return len(self.chunk_file)
+
+    def chunk(self, chunk_id):
+
+        start = self.text_base + int(
+            self.text_offsets[chunk_id]
+        )
+
+        end = self.text_base + int(
+            self.text_offsets[chunk_id + 1]
+        )
+
+        return (
+            self.filenames[self.chunk_file[chunk_id]],
+            self.mm[start:end].decode("utf-8")
+        )
+
+    def term(self, term_id):
+
+        return self.mm[
+            self.terms_base + int(self.term_offsets[term_id]):
+            self.terms_base + int(self.term_offsets[term_id + 1])
+        ]
+
+    def find_term(self, token):
+
+        target = token.encode("utf-8")
+
+        low, high = 0, len(self.idf)
+
+        while low < high:
+
+            middle = (low + high) // 2
+
+            if self.term(middle) < target:
+                low = middle + 1
+            else:
+                high = middle
+
+        if low < len(self.idf) and self.term(low) == target:
+            return low
+
+        return None
+
+    def search(self, query, k=RETRIEVAL_TOP_K):
+
+        scores = np.zeros(len(self))
+
+        for token in set(tokenize(query)):
+
+            term_id = self.find_term(token)
+
+            if term_id is None:
+                continue
+
+            start = self.posting_offsets[term_id]
+
+            end = self.posting_offsets[term_id + 1]
+
+            chunk_ids = self.posting_chunks[start:end]
+
+            tf = self.posting_tf[start:end]
+
+            norm = self.k1 * (
+                1
+                - self.b
+                + self.b
+                * self.chunk_lengths[chunk_ids]
+                / self.avg_length
+            )
+
+            # Each chunk appears once per posting list.
+            scores[chunk_ids] += (
+                self.idf[term_id] * tf * (self.k1 + 1)
+                / (tf + norm)
+            )
+
+        matched = np.flatnonzero(scores)
+
+        ranked = matched[
+            np.argsort(-scores[matched], kind="stable")[:k]
+        ]
+
+        return [
+            self.chunk(int(chunk_id))
+            for chunk_id in ranked
+        ]
+
+    def document_chunks(self, filename):
+
+        if filename not in self.filenames:
+            return []
+
+        file_id = self.filenames.index(filename)
+
+        return [
+            self.chunk(int(chunk_id))
+            for chunk_id in np.flatnonzero(
+                self.chunk_file == file_id
+            )
+        ]
+
+    def file_tables(self, file_id):
+
+        start = self.tables_base + int(
+            self.table_offsets[file_id]
+        )
+
+        end = self.tables_base + int(
+            self.table_offsets[file_id + 1]
+        )
+
+        return [
+            tuple(page_tables)
+            for page_tables in json.loads(self.mm[start:end])
+        ]
+
+    def document_tables(self, filename):
+
+        if filename not in self.filenames:
+            return []
+
+        return self.file_tables(
+            self.filenames.index(filename)
+        )
+
+    @property
+    def page_tables(self):
+
+        for file_id in range(len(self.filenames)):
+            yield from self.file_tables(file_id)
+
+
+def open_corpus_file(key):
+
+    try:
+
+        index = MappedCorpusIndex(CORPUS_FILE)
+
+    except (OSError, ValueError):
+        return None
+
+    if index.key != key:
+        return None
+
+    return index
+
+
+# ============================================================
+# STRUCTURED TABLE INDEX
+#
+# Numeric PDF tables are kept as typed tables (row headers,
+# column headers, one float array per column) and indexed by
+# row header. Simple lookups such as "what percentage of ...
+# in Maryland" are answered straight from the table with a
+# page citation, without calling the LLM.
+# ============================================================
+
+TABLE_ANSWERS = os.environ.get(
+    "TABLE_ANSWERS",
+    "true"
+).lower() in ("1", "true", "yes")
+
+TABLE_ANSWER_MIN_SCORE = float(
+    os.environ.get(
+        "TABLE_ANSWER_MIN_SCORE",
+        0.75
+    )
+)
+
+TABLE_MISSING_MARKERS = {"", "-", "NaN", "N/A", "NSD", "NR", "*"}
+
+TABLE_NUMBER_PATTERN = re.compile(
+    r"^[-+]?\$?\d[\d,]*(?:\.\d+)?%?$"
+)
+
+TABLE_QUANTITY_PATTERN = re.compile(
+    r"\b(?:how many|how much|number of|percent|percentage|"
+    r"share of|proportion of|total)\b|%"
+)
+
+# Question words that carry no meaning for picking a cell.
+TABLE_QUESTION_FILLER = {
+    "how", "many", "much", "number", "share", "proportion",
+    "total", "were", "there", "had", "have", "has", "did",
+    "people", "person", "individual", "recorded", "reported"
+}
+
+TABLE_TERM_SYNONYMS = {
+    "die": "death",
+    "died": "death",
+    "dying": "death",
+    "dead": "death"
+}
+
+
+def clean_table_cell(cell):
+
+    return " ".join(cell.split())
+
+
+def parse_table_number(cell):
+
+    if not TABLE_NUMBER_PATTERN.match(cell):
+        return None
+
+    return float(
+        cell.strip("%$+").replace(",", "")
+    )
+
+
+def table_terms(text):
+
+    terms = set()
+
+    for token in tokenize(text):
+
+        if token.startswith("percent"):
+            token = "percent"
+
+        elif len(token) > 3 and token.endswith("s"):
+            token = token[:-1]
+
+        terms.add(TABLE_TERM_SYNONYMS.get(token, token))
+
+    return terms
+
+
+def is_numeric_row(row):
+
+    values = [cell for cell in row[1:] if cell]
+
+    return bool(values) and all(
+        parse_table_number(cell) is not None
+        or cell in TABLE_MISSING_MARKERS
+        for cell in values
+    )
+
+
+class StructuredTable:
+
+    def __init__(self, source, title, columns):
+
+        self.source = source
+
+        self.title = title
+
+        self.context = f"{title} {source}"
+
+        self.context_terms = table_terms(self.context)
+
+        self.columns = columns
+
+        self.column_terms = [
+            table_terms(column)
+            for column in columns
+        ]
+
+        self.row_headers = []
+
+        self.pages = array.array("H")
+
+        self.raw = []
+
+        self.values = [
+            array.array("d")
+            for _ in columns
+        ]
+
+    def add_row(self, row, page):
+
+        row = (row + [""] * len(self.columns))[
+            :len(self.columns) + 1
+        ]
+
+        self.row_headers.append(row[0])
+
+        self.pages.append(page)
+
+        self.raw.append(row[1:])
+
+        for column, cell in enumerate(row[1:]):
+
+            value = parse_table_number(cell)
+
+            self.values[column].append(
+                math.nan if value is None else value
+            )
+
+    def format_value(self, row_id, column):
+
+        raw = self.raw[row_id][column]
+
+        value = self.values[column][row_id]
+
+        if (
+            "percent" in self.column_terms[column]
+            and not raw.endswith("%")
+            and 0 <= value <= 1
+        ):
+            return f"{value:.0%}"
+
+        return raw
+
+
+def build_structured_tables(page_tables):
+
+    tables = []
+
+    previous = None
+
+    previous_filename = None
+
+    for filename, page_number, raw_tables in page_tables:
+
+        if filename != previous_filename:
+
+            previous = None
+
+            previous_filename = filename
+
+        for raw_table in raw_tables:
+
+            rows = [
+                [clean_table_cell(cell) for cell in row]
+                for row in raw_table
+            ]
+
+            rows = [row for row in rows if any(row)]
+
+            context = []
+
+            header = None
+
+            data = []
+
+            for row in rows:
+
+                if is_numeric_row(row) and row[0]:
+                    data.append(row)
+
+                elif data:
+                    break
+
+                elif sum(1 for cell in row if cell) > 1:
+                    header = row
+
+                elif row[0]:
+                    context.append(row[0])
+
+            if len(data) < 2:
+                continue
+
+            # A table without its own header row that
+            # matches the previous table's width continues
+            # it on the next page.
+            if (
+                header is None
+                and previous is not None
+                and len(data[0]) - 1
+                == len(previous.columns)
+            ):
+
+                for row in data:
+                    previous.add_row(row, page_number)
+
+                continue
+
+            if header is None:
+                continue
+
+            table = StructuredTable(
+                filename,
+                " ".join(context),
+                header[1:]
+            )
+
+            for row in data:
+                table.add_row(row, page_number)
+
+            tables.append(table)
+
+            previous = table
+
+    return tables
+
+
+class TableIndex:
+
+    def __init__(self, tables):
+
+        self.tables = tables
+
+        self.rows = {}
+
+        for table_id, table in enumerate(tables):
+
+            for row_id, header in enumerate(
+                table.row_headers
+            ):
+
+                if re.search(r"[a-z]{3}", header.lower()):
+
+                    self.rows.setdefault(
+                        header.lower(),
+                        []
+                    ).append((table_id, row_id))
+
+        self.row_pattern = None
+
+        if self.rows:
+
+            # Longest headers first, so "West Virginia" wins
+            # over "Virginia".
+            self.row_pattern = re.compile(
+                r"(?<![a-z])(?:"
+                + "|".join(
+                    re.escape(header)
+                    for header in sorted(
+                        self.rows,
+                        key=len,
+                        reverse=True
+                    )
+                )
+                + r")(?![a-z])"
+            )
+
+    def lookup(self, question):
+
+        text = question.lower()
+
+        if (
+            self.row_pattern is None
+            or not TABLE_QUANTITY_PATTERN.search(text)
+        ):
+            return None
+
+        row_headers = set(
+            match.group(0)
+            for match in self.row_pattern.finditer(text)
+        )
+
+        if len(row_headers) != 1:
+            return None
+
+        row_header = row_headers.pop()
+
+        years = set(re.findall(r"\b(?:19|20)\d\d\b", text))
+
+        terms = (
+            table_terms(question)
+            - table_terms(row_header)
+            - TABLE_QUESTION_FILLER
+            - years
+        )
+
+        candidates = []
+
+        for table_id, row_id in self.rows[row_header]:
+
+            table = self.tables[table_id]
+
+            if years and not any(
+                year in table.context
+                for year in years
+            ):
+                continue
+
+            for column, column_terms in enumerate(
+                table.column_terms
+            ):
+
+                if not column_terms or (
+                    ("percent" in terms)
+                    != ("percent" in column_terms)
+                ):
+                    continue
+
+                # Every qualifier in the question ("teens",
+                # "aged 55") must be accounted for, or the
+                # cell answers a different question.
+                if not terms <= (
+                    column_terms | table.context_terms
+                ):
+                    continue
+
+                score = (
+                    len(terms & column_terms)
+                    / len(column_terms)
+                )
+
+                candidates.append(
+                    (score, table, row_id, column)
+                )
+
+        if not candidates:
+            return None
+
+        candidates.sort(
+            key=lambda candidate: candidate[0],
+            reverse=True
+        )
+
+        score, table, row_id, column = candidates[0]
+
+        if score < TABLE_ANSWER_MIN_SCORE:
+            return None
+
+        answer = table.format_value(row_id, column)
+
+        # Ambiguous: another column scores as well but
+        # disagrees.
+        if any(
+            other[0] == score
+            and other[1].format_value(other[2], other[3])
+            != answer
+            for other in candidates[1:]
+        ):
+            return None
+
+        if math.isnan(table.values[column][row_id]):
+            return None
+
+        return {
+            "title": table.title,
+            "row": table.row_headers[row_id],
+            "column": table.columns[column],
+            "value": answer,
+            "source": table.source,
+            "page": table.pages[row_id]
+        }
+
+    def answer(self, question):
+
+        found = self.lookup(question)
+
+        if found is None:
+            return None
+
+        title = re.sub(
+            r"^Title:\s*",
+            "",
+            found["title"]
+        )
+
+        return (
+            (f"{title}\n" if title else "")
+            + f"{found['column']} for {found['row']}: "
+            f"{found['value']}.\n\n"
+            f"[Source: {found['source']}, "
+            f"page {found['page']}]"
+        )
+
+    def stats(self):
+
+        return {
+            "tables": len(self.tables),
+            "rows": sum(
+                len(table.row_headers)
+                for table in self.tables
+            ),
+            "row_headers": len(self.rows)
+        }
+
+
+# ============================================================
+# LAZY PDF LOADING
+#
+# IMPORTANT:
+# PDFs are NOT processed while Gunicorn imports this file.
+# This allows Render/Gunicorn to bind to PORT first.
+# ============================================================
+
+pdf_folder = "pdfs"
+
+corpus_index = None
+
+table_index = None
+
+corpus_index_lock = threading.Lock()
+
+# filename -> {"signature", "chunks", "tables"} for every PDF
+# behind the current indexes. Chunks and tables are dropped
+# once they are in the memory-mapped corpus file.
+corpus_documents = {}
+
+# filename -> (size, mtime) for the PDFs and workbooks the
+# current indexes and statistics store were built from.
+corpus_signatures = {}
+
+
+def get_corpus_index():
+
+    if corpus_index is not None:
+        return corpus_index
+
+    with corpus_index_lock:
+
+        if corpus_index is None:
+
+            app.logger.info(
+                "Loading opioid PDF context..."
+            )
+
+            with stage("pdf_index"):
+
+                # Scanned before reading, so a file that
+                # changes mid-load is picked up by the watcher.
+                signatures = scan_corpus_folder(pdf_folder)
+
+                update_corpus(signatures)
+
+            corpus_signatures.update(signatures)
+
+            app.logger.info(
+                f"PDF context loaded: "
+                f"{len(corpus_index)} chunks indexed."
+            )
+
+    ensure_corpus_watcher()
+
+    return corpus_index
+
+
+def make_corpus_document(filename, entry, signature):
+
+    return {
+        "signature": signature,
+        "chunks": chunk_documents([(filename, entry)]),
+        "tables": [
+            (filename, page_number, page["tables"])
+            for page_number, page in enumerate(
+                entry["pages"],
+                start=1
+            )
+            if page["tables"]
+        ]
+    }
+
+
+def pdf_signatures(signatures):
+
+    return {
+        filename: signature
+        for filename, signature in signatures.items()
+        if filename.lower().endswith(".pdf")
+    }
+
+
+def corpus_key(signatures):
+
+    return hashlib.sha256(
+        json.dumps(
+            [
+                CORPUS_FILE_VERSION,
+                PDF_CACHE_VERSION,
+                CHUNK_MAX_CHARS,
+                sorted(pdf_signatures(signatures).items())
+            ]
+        ).encode("utf-8")
+    ).hexdigest()
+
+
+def diff_corpus(signatures):
+
+    changed = sorted(
+        filename
+        for filename, signature
+        in pdf_signatures(signatures).items()
+        if corpus_documents.get(filename, {}).get("signature")
+        != signature
+    )
+
+    removed = [
+        filename
+        for filename in corpus_documents
+        if filename not in signatures
+    ]
+
+    return changed, removed
+
+
+def sync_corpus_documents(signatures):
+
+    changed, removed = diff_corpus(signatures)
+
+    # Unchanged documents that only live in the mapped file
+    # are read back so the new file can be written.
+    for filename, document in corpus_documents.items():
+
+        if "chunks" not in document:
+
+            document["chunks"] = (
+                corpus_index.document_chunks(filename)
+            )
+
+            document["tables"] = (
+                corpus_index.document_tables(filename)
+            )
+
+    if changed:
+
+        app.logger.info(
+            f"Loading {len(changed)} PDFs "
+            f"from {pdf_folder}"
+        )
+
+    entries = load_cached_pdfs(
+        [
+            os.path.join(pdf_folder, filename)
+            for filename in changed
+        ]
+    )
+
+    for filename, entry in zip(changed, entries):
+
+        corpus_documents[filename] = make_corpus_document(
+            filename,
+            entry,
+            signatures[filename]
+        )
+
+    for filename in removed:
+        del corpus_documents[filename]
+
+
+def collect_corpus_parts():
+
+    filenames = sorted(corpus_documents)
+
+    return (
+        filenames,
+        [
+            chunk
+            for filename in filenames
+            for chunk in corpus_documents[filename]["chunks"]
+        ],
+        [
+            page_tables
+            for filename in filenames
+            for page_tables in corpus_documents[filename]["tables"]
+        ]
+    )
+
+
+def load_mapped_corpus(signatures):
+
+    key = corpus_key(signatures)
+
+    with corpus_file_lock():
+
+        mapped = open_corpus_file(key)
+
+        if mapped is None:
+
+            sync_corpus_documents(signatures)
+
+            write_corpus_file(key, *collect_corpus_parts())
+
+            mapped = open_corpus_file(key)
+
+            if mapped is None:
+                raise ValueError(
+                    f"{CORPUS_FILE} could not be reopened"
+                )
+
+    # Everything now lives in the mapped file.
+    corpus_documents.clear()
+
+    for filename in mapped.filenames:
+
+        corpus_documents[filename] = {
+            "signature": signatures.get(filename)
+        }
+
+    return mapped
+
+
+def update_corpus(signatures):
+
+    global corpus_index, table_index
+
+    new_corpus_index = None
+
+    if CORPUS_MMAP:
+
+        try:
+
+            new_corpus_index = load_mapped_corpus(
+                signatures
+            )
+
+        except (OSError, ValueError) as e:
+
+            app.logger.warning(
+                f"Memory-mapped corpus unavailable, "
+                f"indexing in memory: {e}"
+            )
+
+    # The mapped file's tables are only decoded when a
+    # question first needs the table index.
+    new_table_index = None
+
+    if new_corpus_index is None:
+
+        sync_corpus_documents(signatures)
+
+        _, chunks, page_tables = collect_corpus_parts()
+
+        new_corpus_index = BM25Index(chunks)
+
+        new_table_index = TableIndex(
+            build_structured_tables(page_tables)
+        )
+
+    # Swapped by reference: requests already holding the
+    # old indexes finish with them. The table index goes
+    # first because corpus_index being set is what tells
+    # callers the corpus is ready.
+    table_index = new_table_index
+
+    corpus_index = new_corpus_index
+
+
+def get_table_index():
+
+    global table_index
+
+    get_corpus_index()
+
+    if table_index is None:
+
+        # Under the same lock as update_corpus, so the
+        # tables always come from the current corpus.
+        with corpus_index_lock:
+
+            if table_index is None:
+
+                table_index = TableIndex(
+                    build_structured_tables(
+                        corpus_index.page_tables
+                    )
+                )
+
+    return table_index
+
+
+def iter_context_blocks(question):
+
+    ranked = get_corpus_index().search(
+        question
+    )
+
+    if ranked:
+        return iter(ranked)
+
+    # Nothing matched: fall back to the opening
+    # passages of the corpus. The stream is lazy, so only
+    # as many pages are read as the budget takes.
+    return iter_text_blocks(
+        iter_folder_pages(pdf_folder)
+    )
+
+
+# ============================================================
+# SPREADSHEET STATISTICS
+#
+# The KFF workbooks in the PDF folder are loaded into a
+# columnar store: one typed array per column, string columns
+# dictionary-encoded, with row-id indexes by location and by
+# (dimension, group). Rows matching the states, age groups
+# and races named in a question are added to the prompt as
+# exact figures.
+# ============================================================
+
+XLSX_NS = {
+    "m": "http://schemas.openxmlformats.org/"
+         "spreadsheetml/2006/main"
+}
+
+STATISTICS_MAX_ROWS = int(
+    os.environ.get(
+        "STATISTICS_MAX_ROWS",
+        40
+    )
+)
+
+# Markers the workbooks use in place of a number.
+STATISTICS_STATUSES = ["", "NSD", "N/A", "NaN", "blank"]
+
+
+def xlsx_column_index(cell_ref):
+
+    index = 0
+
+    for char in re.match(r"[A-Z]+", cell_ref).group(0):
+        index = index * 26 + ord(char) - ord("A") + 1
+
+    return index - 1
+
+
+def read_xlsx_rows(path):
+
+    with zipfile.ZipFile(path) as workbook:
+
+        shared_strings = []
+
+        if "xl/sharedStrings.xml" in workbook.namelist():
+
+            shared_strings = [
+                "".join(
+                    t.text or ""
+                    for t in si.iter(
+                        f"{{{XLSX_NS['m']}}}t"
+                    )
+                )
+                for si in ET.fromstring(
+                    workbook.read("xl/sharedStrings.xml")
+                ).findall("m:si", XLSX_NS)
+            ]
+
+        sheet = ET.fromstring(
+            workbook.read("xl/worksheets/sheet1.xml")
+        )
+
+    for row in sheet.iterfind(
+        "m:sheetData/m:row",
+        XLSX_NS
+    ):
+
+        values = []
+
+        for cell in row.findall("m:c", XLSX_NS):
+
+            column = xlsx_column_index(cell.get("r"))
+
+            values.extend(
+                [None] * (column - len(values))
+            )
+
+            value = cell.find("m:v", XLSX_NS)
+
+            if value is None:
+
+                inline = cell.find("m:is", XLSX_NS)
+
+                values.append(
+                    "".join(inline.itertext())
+                    if inline is not None
+                    else None
+                )
+
+            elif cell.get("t") == "s":
+                values.append(shared_strings[int(value.text)])
+
+            elif cell.get("t") in ("str", "e"):
+                values.append(value.text)
+
+            else:
+                values.append(float(value.text))
+
+        yield values
+
+
+def describe_statistics_column(title, header):
+
+    if header.startswith("Age "):
+        return "age", header[4:], "Opioid Overdose Deaths"
+
+    if "race" in title.lower():
+        return "race", header, "Opioid Overdose Deaths"
+
+    return "all", "All", header
+
+
+class StatisticsStore:
+
+    def __init__(self):
+
+        self.dictionaries = {
+            "source": [],
+            "location": [],
+            "dimension": [],
+            "group": [],
+            "measure": []
+        }
+
+        self.codes = {
+            name: {}
+            for name in self.dictionaries
+        }
+
+        self.columns = {
+            "source": array.array("B"),
+            "location": array.array("H"),
+            "dimension": array.array("B"),
+            "group": array.array("H"),
+            "measure": array.array("H"),
+            "year": array.array("H"),
+            "status": array.array("B"),
+            "value": array.array("d")
+        }
+
+        self.titles = {}
+
+        self.by_location = {}
+
+        self.by_group = {}
+
+        self.pattern = None
+
+        self.lowercase_locations = {}
+
+    def __len__(self):
+
+        return len(self.columns["value"])
+
+    def encode(self, column, text):
+
+        codes = self.codes[column]
+
+        if text not in codes:
+
+            codes[text] = len(self.dictionaries[column])
+
+            self.dictionaries[column].append(text)
+
+        return codes[text]
+
+    def location_pattern(self):
+
+        if self.pattern is None:
+
+            self.lowercase_locations = {
+                location.lower(): location
+                for location in self.codes["location"]
+            }
+
+            # Longest names first, so "West Virginia" wins
+            # over "Virginia".
+            self.pattern = re.compile(
+                r"(?<![a-z])(?:"
+                + "|".join(
+                    re.escape(location)
+                    for location in sorted(
+                        self.lowercase_locations,
+                        key=len,
+                        reverse=True
+                    )
+                )
+                + r")(?![a-z])"
+            )
+
+        return self.pattern
+
+    def groups(self, dimension):
+
+        return [
+            self.dictionaries["group"][group_code]
+            for dimension_code, group_code in self.by_group
+            if self.dictionaries["dimension"][dimension_code]
+            == dimension
+        ]
+
+    def decode(self, column, row_id):
+
+        return self.dictionaries[column][
+            self.columns[column][row_id]
+        ]
+
+    def add(
+        self,
+        source,
+        location,
+        dimension,
+        group,
+        measure,
+        year,
+        value
+    ):
+
+        row_id = len(self)
+
+        if isinstance(value, float):
+            status = 0
+        elif value is None:
+            status = STATISTICS_STATUSES.index("blank")
+        elif value in STATISTICS_STATUSES:
+            status = STATISTICS_STATUSES.index(value)
+        else:
+            status = STATISTICS_STATUSES.index("N/A")
+
+        values = {
+            "source": self.encode("source", source),
+            "location": self.encode("location", location),
+            "dimension": self.encode("dimension", dimension),
+            "group": self.encode("group", group),
+            "measure": self.encode("measure", measure),
+            "year": year,
+            "status": status,
+            "value": value if status == 0 else math.nan
+        }
+
+        for column, code in values.items():
+            self.columns[column].append(code)
+
+        self.by_location.setdefault(
+            values["location"],
+            array.array("I")
+        ).append(row_id)
+
+        self.by_group.setdefault(
+            (values["dimension"], values["group"]),
+            array.array("I")
+        ).append(row_id)
+
+    def load_workbook(self, path):
+
+        source = os.path.basename(path)
+
+        title = ""
+
+        headers = None
+
+        for row in read_xlsx_rows(path):
+
+            if not row or not isinstance(row[0], str):
+                continue
+
+            if headers is None:
+
+                if row[0].strip() == "Location":
+                    headers = row
+                else:
+                    title = title or row[0].strip()
+
+                continue
+
+            year_match = re.search(r"\b(19|20)\d\d\b", title)
+
+            year = int(year_match.group(0)) if year_match else 0
+
+            for header, value in zip(headers[1:], row[1:]):
+
+                if not header:
+                    continue
+
+                dimension, group, measure = (
+                    describe_statistics_column(
+                        title,
+                        header.strip()
+                    )
+                )
+
+                self.add(
+                    source,
+                    row[0].strip(),
+                    dimension,
+                    group,
+                    measure,
+                    year,
+                    value
+                )
+
+        self.titles[source] = title
+
+    def lookup(self, locations, groups):
+
+        location_codes = [
+            self.codes["location"][location]
+            for location in locations
+            if location in self.codes["location"]
+        ]
+
+        group_keys = [
+            (
+                self.codes["dimension"][dimension],
+                self.codes["group"][group]
+            )
+            for dimension, group in groups
+            if dimension in self.codes["dimension"]
+            and group in self.codes["group"]
+        ]
+
+        group_rows = set()
+
+        for key in group_keys:
+            group_rows.update(self.by_group.get(key, ()))
+
+        row_ids = []
+
+        for code in location_codes:
+
+            for row_id in self.by_location.get(code, ()):
+
+                if row_id in group_rows:
+                    row_ids.append(row_id)
+
+        return row_ids[:STATISTICS_MAX_ROWS]
+
+    def format_value(self, row_id):
+
+        status = self.columns["status"][row_id]
+
+        if status:
+
+            return (
+                "not reported"
+                f" ({STATISTICS_STATUSES[status]})"
+            )
+
+        value = self.columns["value"][row_id]
+
+        if "Percent" in self.decode("measure", row_id):
+            return f"{value:.0%}"
+
+        return f"{value:,.0f}"
+
+    def iter_blocks(self, row_ids):
+
+        lines = {}
+
+        for row_id in row_ids:
+
+            source = self.decode("source", row_id)
+
+            dimension = self.decode("dimension", row_id)
+
+            label = self.decode("location", row_id)
+
+            if dimension != "all":
+                label += (
+                    f", {dimension} "
+                    f"{self.decode('group', row_id)}"
+                )
+
+            lines.setdefault(source, []).append(
+                f"- {label}: "
+                f"{self.decode('measure', row_id)} "
+                f"({self.columns['year'][row_id]}) = "
+                f"{self.format_value(row_id)}"
+            )
+
+        for source, source_lines in lines.items():
+
+            yield source, "\n".join(
+                [f"{self.titles[source]}:"]
+                + source_lines
+            )
+
+    def stats(self):
+
+        return {
+            "rows": len(self),
+            "locations": len(self.dictionaries["location"]),
+            "bytes": sum(
+                column.itemsize * len(column)
+                for column in self.columns.values()
+            )
+        }
+
+
+statistics_store = None
+
+statistics_store_lock = threading.Lock()
+
+
+def get_statistics_store():
+
+    global statistics_store
+
+    if statistics_store is not None:
+        return statistics_store
+
+    with statistics_store_lock:
+
+        if statistics_store is None:
+            statistics_store = build_statistics_store()
+
+    return statistics_store
+
+
+def build_statistics_store():
+
+    store = StatisticsStore()
+
+    with stage("statistics_index"):
+
+        filenames = (
+            sorted(os.listdir(pdf_folder))
+            if os.path.isdir(pdf_folder)
+            else []
+        )
+
+        for filename in filenames:
+
+            if not filename.lower().endswith(".xlsx"):
+                continue
+
+            try:
+
+                store.load_workbook(
+                    os.path.join(pdf_folder, filename)
+                )
+
+            except Exception as e:
+
+                app.logger.error(
+                    f"Error reading {filename}: {e}"
+                )
+
+    return store
+
+
+# Rows are only injected for questions that ask for a
+# figure; "What is black tar heroin?" mentions a race word
+# but wants no statistics.
+STATISTICS_CUE_TERMS = (
+    "death", "deaths", "died", "die", "dying", "rate",
+    "rates", "statistic", "statistics", "stats", "data",
+    "figures", "numbers", "count", "trend", "trends",
+    "increase", "increased", "decrease", "decreased",
+    "compare", "compared", "highest", "lowest", "most",
+    "fewest", "how common", "prevalence"
+)
+
+NATIONAL_ALIASES = (
+    "united states", "u.s.", "usa", "nationwide",
+    "national", "nationally", "america", "the country"
+)
+
+AGE_GROUP_TERMS = {
+    "0-24": ("young", "youth", "teen", "adolescent",
+             "children", "kids", "under 25"),
+    "55+": ("older", "elderly", "senior", "55+",
+            "over 55")
+}
+
+RACE_GROUP_TERMS = {
+    "White": ("white",),
+    "Black": ("black", "african american"),
+    "Hispanic": ("hispanic", "latino", "latina", "latinx"),
+    "Asian": ("asian",),
+    "American Indian or Alaska Native": (
+        "american indian", "alaska native",
+        "native american", "indigenous"
+    ),
+    "Native Hawaiian/Pacific Islander": (
+        "native hawaiian", "pacific islander"
+    ),
+    "Multiple Races": ("multiracial", "multiple races",
+                       "mixed race")
+}
+
+
+def find_terms(text, terms):
+
+    return any(
+        re.search(
+            rf"(?<![a-z]){re.escape(term)}(?![a-z])",
+            text
+        )
+        for term in terms
+    )
+
+
+def match_statistics_query(store, question):
+
+    text = question.lower()
+
+    if not (
+        TABLE_QUANTITY_PATTERN.search(text)
+        or find_terms(text, STATISTICS_CUE_TERMS)
+    ):
+        return [], []
+
+    pattern = store.location_pattern()
+
+    locations = list(
+        dict.fromkeys(
+            store.lowercase_locations[match.group(0)]
+            for match in pattern.finditer(text)
+        )
+    )
+
+    age_groups = store.groups("age")
+
+    groups = []
+
+    for group in age_groups:
+
+        bounds = re.match(r"(\d+)-(\d+)", group)
+
+        if (
+            bounds and re.search(
+                rf"\b{bounds.group(1)}\s*(?:-|to|–)\s*"
+                rf"{bounds.group(2)}\b",
+                text
+            )
+        ) or find_terms(text, AGE_GROUP_TERMS.get(group, ())):
+            groups.append(("age", group))
+
+    if not groups and find_terms(text, ("age", "ages", "aged")):
+
+        groups.extend(
+            ("age", group)
+            for group in age_groups
+        )
+
+    race_groups = [
+        ("race", group)
+        for group, terms in RACE_GROUP_TERMS.items()
+        if find_terms(text, terms)
+    ]
+
+    if not race_groups and find_terms(
+        text,
+        ("race", "races", "racial", "ethnicity", "ethnic")
+    ):
+        race_groups = [
+            ("race", group)
+            for group in store.groups("race")
+        ]
+
+    groups.extend(race_groups)
+
+    if not locations and (
+        groups or find_terms(text, NATIONAL_ALIASES)
+    ):
+        locations = ["United States"]
+
+    if not locations:
+        return [], []
+
+    if not groups:
+        groups = [("all", "All")]
+
+    return locations, groups
+
+
+def iter_statistics_blocks(question):
+
+    store = get_statistics_store()
+
+    locations, groups = match_statistics_query(
+        store,
+        question
+    )
+
+    if not locations:
+        return iter(())
+
+    return store.iter_blocks(
+        store.lookup(locations, groups)
+    )
+
+
+# ============================================================
+# CORPUS WATCHER
+#
+# A background thread polls sizes and mtimes in the PDF
+# folder. Once a change has held still for one interval,
+# only added or changed PDFs are re-extracted (through the
+# extraction cache), removed ones are dropped, and the
+# rebuilt indexes are swapped in by reference. Changed
+# workbooks rebuild the statistics store the same way.
+# CORPUS_WATCH_INTERVAL=0 disables the watcher.
+# ============================================================
+
+CORPUS_WATCH_INTERVAL = float(
+    os.environ.get(
+        "CORPUS_WATCH_INTERVAL",
+        30
+    )
+)
+
+corpus_watcher_pid = None
+
+corpus_watcher_lock = threading.Lock()
+
+corpus_refresh_metrics = {
+    "refreshes": 0,
+    "documents_reindexed": 0,
+    "documents_removed": 0,
+    "last_refresh": None
+}
+
+
+def scan_corpus_folder(folder):
+
+    signatures = {}
+
+    if not os.path.isdir(folder):
+        return signatures
+
+    for filename in os.listdir(folder):
+
+        if not filename.lower().endswith(
+            (".pdf", ".xlsx")
+        ):
+            continue
+
+        try:
+
+            stat = os.stat(
+                os.path.join(folder, filename)
+            )
+
+        except OSError:
+            continue
+
+        signatures[filename] = (
+            stat.st_size,
+            stat.st_mtime_ns
+        )
+
+    return signatures
+
+
+def workbook_signatures(signatures):
+
+    return {
+        filename: signature
+        for filename, signature in signatures.items()
+        if filename.lower().endswith(".xlsx")
+    }
+
+
+def refresh_corpus_index(signatures):
+
+    global statistics_store
+
+    with corpus_index_lock:
+
+        if corpus_index is None:
+            return False
+
+        changed, removed = diff_corpus(signatures)
+
+        workbooks_changed = (
+            workbook_signatures(signatures)
+            != workbook_signatures(corpus_signatures)
+        )
+
+        if not (changed or removed or workbooks_changed):
+            return False
+
+        with stage("corpus_refresh"):
+
+            if changed or removed:
+                update_corpus(signatures)
+
+            if (
+                workbooks_changed
+                and statistics_store is not None
+            ):
+                statistics_store = build_statistics_store()
+
+        corpus_signatures.clear()
+
+        corpus_signatures.update(signatures)
+
+    # Answers keyed only by question may now be stale; the
+    # answer cache is keyed by context and needs no help.
+    semantic_cache.clear()
+
+    corpus_refresh_metrics["refreshes"] += 1
+
+    corpus_refresh_metrics["documents_reindexed"] += len(changed)
+
+    corpus_refresh_metrics["documents_removed"] += len(removed)
+
+    corpus_refresh_metrics["last_refresh"] = time.time()
+
+    app.logger.info(
+        f"Corpus refreshed: {len(changed)} changed, "
+        f"{len(removed)} removed"
+        + (", workbooks reloaded" if workbooks_changed else "")
+    )
+
+    return True
+
+
+def corpus_watcher():
+
+    previous = None
+
+    while True:
+
+        time.sleep(CORPUS_WATCH_INTERVAL)
+
+        try:
+
+            current = scan_corpus_folder(pdf_folder)
+
+            # Wait until a copy in progress has finished.
+            if current == previous:
+                refresh_corpus_index(current)
+
+            previous = current
+
+        except Exception as e:
+
+            app.logger.error(
+                f"Corpus refresh failed: {e}"
             )
 
-            tables = extract_tables_from_pdf(
-                path
-            )
 
-            if text:
+def ensure_corpus_watcher():
+
+    global corpus_watcher_pid
+
+    if (
+        CORPUS_WATCH_INTERVAL <= 0
+        or corpus_watcher_pid == os.getpid()
+    ):
+        return
+
+    with corpus_watcher_lock:
+
+        if corpus_watcher_pid != os.getpid():
+
+            threading.Thread(
+                target=corpus_watcher,
+                name="corpus-watcher",
+                daemon=True
+            ).start()
+
+            corpus_watcher_pid = os.getpid()
+
+
+# ============================================================
+# ANSWER CACHE
+#
+# Final answers are cached by normalized English question,
+# target language and a hash of the retrieved context.
+# Hits are served from the local LRU first and then from
+# the shared store, if one is configured.
+# ============================================================
+
+ANSWER_CACHE_SIZE = int(
+    os.environ.get(
+        "ANSWER_CACHE_SIZE",
+        1024
+    )
+)
+
+ANSWER_CACHE_TTL = int(
+    os.environ.get(
+        "ANSWER_CACHE_TTL",
+        24 * 60 * 60
+    )
+)
+
+
+answer_cache = LRUCache(
+    ANSWER_CACHE_SIZE,
+    ANSWER_CACHE_TTL,
+    name="answer"
+)
+
+
+def normalize_question(question):
+
+    return " ".join(
+        re.sub(
+            r"[^\w\s]",
+            " ",
+            question.lower()
+        ).split()
+    )
+
+
+def make_answer_cache_key(
+    question,
+    user_lang,
+    context_text,
+    history=()
+):
+
+    context_hash = hashlib.sha256(
+        context_text.encode("utf-8")
+    ).hexdigest()
+
+    # A follow-up ("what about for teens?") means something
+    # different after each conversation.
+    history_hash = hashlib.sha256(
+        json.dumps(list(history)).encode("utf-8")
+    ).hexdigest()
+
+    return "answer:" + hashlib.sha256(
+        "\0".join(
+            [
+                normalize_question(question),
+                user_lang,
+                context_hash,
+                history_hash
+            ]
+        ).encode("utf-8")
+    ).hexdigest()
+
+
+def get_cached_answer(key):
+
+    cached = answer_cache.get(key)
+
+    if cached is not None:
+        return cached
+
+    store = get_shared_store()
+
+    if store is None:
+        return None
+
+    try:
+
+        raw = store.get(key)
+
+    except Exception as e:
+
+        app.logger.warning(
+            f"Shared answer cache "
+            f"read failed: {e}"
+        )
+
+        return None
+
+    if raw is None:
+
+        cache_lookups.labels("answer_shared", "miss").inc()
+
+        return None
+
+    cache_lookups.labels("answer_shared", "hit").inc()
+
+    cached = json.loads(raw)
+
+    answer_cache.set(key, cached)
+
+    return cached
+
+
+def set_cached_answer(key, content, answer):
+
+    cached = {
+        "content": content,
+        "answer": answer
+    }
+
+    answer_cache.set(key, cached)
+
+    store = get_shared_store()
+
+    if store is None:
+        return
+
+    try:
+
+        store.set(
+            key,
+            json.dumps(cached),
+            ex=ANSWER_CACHE_TTL
+        )
+
+    except Exception as e:
+
+        app.logger.warning(
+            f"Shared answer cache "
+            f"write failed: {e}"
+        )
+
+
+# ============================================================
+# SEMANTIC ANSWER CACHE
+#
+# Paraphrased questions are matched by cosine similarity of
+# hashed word and character-trigram vectors. All cached
+# questions live in one NumPy matrix, so a lookup is a
+# single matrix-vector product. Known synonyms (e.g.
+# narcan -> naloxone) are folded together first. Numbers
+# and place names must match exactly, since "Virginia" and
+# "West Virginia" or 2021 and 2022 differ by only a few
+# trigrams but ask for different answers.
+# ============================================================
+
+SEMANTIC_CACHE_SIZE = int(
+    os.environ.get(
+        "SEMANTIC_CACHE_SIZE",
+        2048
+    )
+)
+
+SEMANTIC_CACHE_THRESHOLD = float(
+    os.environ.get(
+        "SEMANTIC_CACHE_THRESHOLD",
+        0.80
+    )
+)
+
+SEMANTIC_VECTOR_DIM = 1024
+
+
+QUESTION_SYNONYMS = {
+    "narcan": "naloxone",
+    "kloxxado": "naloxone",
+    "zimhi": "naloxone",
+    "opiate": "opioid",
+    "opiates": "opioid",
+    "opioids": "opioid",
+    "od": "overdose",
+    "overdosing": "overdose",
+    "suboxone": "buprenorphine",
+    "subutex": "buprenorphine",
+    "vivitrol": "naltrexone",
+    "oxycontin": "oxycodone",
+    "percocet": "oxycodone",
+    "vicodin": "hydrocodone",
+    "dilaudid": "hydromorphone",
+    "rehabilitation": "rehab",
+    "symptoms": "signs"
+}
+
+# Verbs and fillers that paraphrases swap freely ("how does
+# narcan work" / "what does naloxone do").
+QUESTION_FILLER = {
+    "work", "works", "working", "happen", "happens",
+    "mean", "means", "tell", "about", "know", "explain",
+    "please", "exactly", "actually", "really", "were",
+    "there", "having"
+}
+
+# Population groups also change the answer, and "men" and
+# "women" share most of their trigrams.
+QUESTION_GROUP_TERMS = {
+    "men", "women", "male", "males", "female", "females",
+    "teen", "teens", "teenager", "teenagers", "adolescents",
+    "youth", "children", "kids", "adult", "adults",
+    "seniors", "elderly", "veterans", "pregnant",
+    "pregnancy", "black", "white", "hispanic", "latino",
+    "asian", "native"
+}
+
+US_LOCATIONS = [
+    "Alabama", "Alaska", "Arizona", "Arkansas", "California",
+    "Colorado", "Connecticut", "Delaware",
+    "District of Columbia", "Florida", "Georgia", "Hawaii",
+    "Idaho", "Illinois", "Indiana", "Iowa", "Kansas",
+    "Kentucky", "Louisiana", "Maine", "Maryland",
+    "Massachusetts", "Michigan", "Minnesota", "Mississippi",
+    "Missouri", "Montana", "Nebraska", "Nevada",
+    "New Hampshire", "New Jersey", "New Mexico", "New York",
+    "North Carolina", "North Dakota", "Ohio", "Oklahoma",
+    "Oregon", "Pennsylvania", "Puerto Rico", "Rhode Island",
+    "South Carolina", "South Dakota", "Tennessee", "Texas",
+    "Utah", "Vermont", "Virginia", "Washington",
+    "West Virginia", "Wisconsin", "Wyoming", "United States"
+]
+
+# Longest names first, so "West Virginia" wins over
+# "Virginia".
+US_LOCATION_PATTERN = re.compile(
+    r"\b(?:"
+    + "|".join(
+        re.escape(location.lower())
+        for location in sorted(
+            US_LOCATIONS,
+            key=len,
+            reverse=True
+        )
+    )
+    + r")\b"
+)
+
+
+def question_vector(question):
+
+    words = [
+        QUESTION_SYNONYMS.get(word, word)
+        for word in normalize_question(
+            question
+        ).split()
+        if word not in STOPWORDS
+        and word not in QUESTION_FILLER
+    ]
+
+    features = list(words)
+
+    for word in words:
+
+        padded = f" {word} "
+
+        features.extend(
+            padded[i:i + 3]
+            for i in range(len(padded) - 2)
+        )
+
+    vector = np.zeros(
+        SEMANTIC_VECTOR_DIM,
+        dtype=np.float32
+    )
+
+    for feature in features:
+
+        digest = hashlib.blake2b(
+            feature.encode("utf-8"),
+            digest_size=8
+        ).digest()
+
+        vector[
+            int.from_bytes(digest, "little")
+            % SEMANTIC_VECTOR_DIM
+        ] += 1.0
+
+    norm = np.linalg.norm(vector)
+
+    if norm:
+        vector /= norm
+
+    return vector
+
+
+def question_signature(question):
+
+    text = normalize_question(question)
+
+    return (
+        frozenset(re.findall(r"\d+", text)),
+        frozenset(US_LOCATION_PATTERN.findall(text)),
+        frozenset(text.split()) & QUESTION_GROUP_TERMS
+    )
+
+
+class SemanticCache:
+
+    def __init__(self, capacity, threshold):
+
+        self.capacity = capacity
+
+        self.threshold = threshold
+
+        self.vectors = np.zeros(
+            (capacity, SEMANTIC_VECTOR_DIM),
+            dtype=np.float32
+        )
+
+        self.last_used = np.zeros(
+            capacity,
+            dtype=np.float64
+        )
+
+        self.languages = [None] * capacity
+
+        self.signatures = [None] * capacity
+
+        self.values = [None] * capacity
+
+        self.size = 0
+
+        self.lock = threading.Lock()
+
+        self.hits = 0
+
+        self.misses = 0
+
+    def lookup(self, question, lang):
+
+        vector = question_vector(question)
+
+        signature = question_signature(question)
+
+        with self.lock:
+
+            if self.size:
 
-                output += (
-                    text + "\n\n"
+                scores = (
+                    self.vectors[:self.size] @ vector
                 )
 
-            if tables:
+                for i in np.argsort(scores)[::-1]:
 
-                output += (
-                    tables + "\n\n"
+                    if scores[i] < self.threshold:
+                        break
+
+                    if (
+                        self.languages[i] == lang
+                        and self.signatures[i] == signature
+                    ):
+
+                        self.last_used[i] = (
+                            time.monotonic()
+                        )
+
+                        self.hits += 1
+
+                        cache_lookups.labels(
+                            "semantic",
+                            "hit"
+                        ).inc()
+
+                        return self.values[i]
+
+            self.misses += 1
+
+            cache_lookups.labels("semantic", "miss").inc()
+
+            return None
+
+    def add(self, question, lang, value):
+
+        vector = question_vector(question)
+
+        signature = question_signature(question)
+
+        with self.lock:
+
+            if self.size < self.capacity:
+
+                slot = self.size
+
+                self.size += 1
+
+            else:
+
+                slot = int(
+                    np.argmin(self.last_used)
                 )
 
-            # Prevent unnecessary processing
-            # after enough context is collected.
-            if len(output) >= 2000:
-                break
+            self.vectors[slot] = vector
+
+            self.last_used[slot] = time.monotonic()
+
+            self.languages[slot] = lang
+
+            self.signatures[slot] = signature
+
+            self.values[slot] = value
+
+    def clear(self):
+
+        with self.lock:
+
+            self.size = 0
+
+            self.languages = [None] * self.capacity
+
+            self.signatures = [None] * self.capacity
+
+            self.values = [None] * self.capacity
+
+    def stats(self):
+
+        return {
+            "size": self.size,
+            "capacity": self.capacity,
+            "threshold": self.threshold,
+            "hits": self.hits,
+            "misses": self.misses
+        }
+
+
+semantic_cache = SemanticCache(
+    SEMANTIC_CACHE_SIZE,
+    SEMANTIC_CACHE_THRESHOLD
+)
+
+
+def remember_answer(prepared, content, answer):
+
+    set_cached_answer(
+        prepared["cache_key"],
+        content,
+        answer
+    )
 
-    return output[:2000]
+    # Matched on the question alone, so only answers given
+    # without prior turns are safe to reuse.
+    if prepared["history"]:
+        return
+
+    semantic_cache.add(
+        prepared["translated_question"],
+        prepared["user_lang"],
+        {
+            "content": content,
+            "answer": answer
+        }
+    )
 
 
 # ============================================================
-# LAZY PDF LOADING
+# PROMPT BUILDER
 #
-# IMPORTANT:
-# PDFs are NOT processed while Gunicorn imports this file.
-# This allows Render/Gunicorn to bind to PORT first.
+# Token counts are estimated locally with a rough model of
+# the Llama 3 tokenizer (a tiktoken-style BPE with a 128K
+# vocabulary): text is pre-split the way its regex does,
+# and each piece is costed by length and script. The
+# budget goes to the system prompt and question first,
+# then up to HISTORY_TOKEN_BUDGET of the newest history,
+# then retrieved context in rank order. Older turns and
+# lower-ranked passages are dropped first.
 # ============================================================
 
-pdf_folder = "pdfs"
+PROMPT_TOKEN_BUDGET = int(
+    os.environ.get(
+        "PROMPT_TOKEN_BUDGET",
+        6000
+    )
+)
 
-combined_text = None
+HISTORY_TOKEN_BUDGET = int(
+    os.environ.get(
+        "HISTORY_TOKEN_BUDGET",
+        1500
+    )
+)
 
+# <|start_header_id|>role<|end_header_id|>\n\n ... <|eot_id|>
+MESSAGE_TOKEN_OVERHEAD = 5
 
-def get_combined_text():
 
-    global combined_text
+LLAMA3_PRETOKENIZE = re.compile(
+    r"'(?:[sdmt]|ll|ve|re)"
+    r"|[^\r\n\w]?[^\W\d_]+"
+    r"|\d{1,3}"
+    r"| ?[^\s\w]+[\r\n]*"
+    r"|\s*[\r\n]+"
+    r"|\s+",
+    re.IGNORECASE
+)
 
-    if combined_text is None:
 
-        app.logger.info(
-            "Loading opioid PDF context..."
-        )
+def estimate_tokens(text):
+
+    tokens = 0
+
+    for piece in LLAMA3_PRETOKENIZE.findall(text):
+
+        if piece.isascii():
+
+            # Common English words are single tokens;
+            # long or rare ones split every ~4 chars.
+            tokens += max(
+                1,
+                (len(piece.strip()) + 3) // 4
+                if len(piece) > 8
+                else 1
+            )
+
+        else:
 
-        combined_text = (
-            read_pdfs_in_folder(
-                pdf_folder
+            # CJK and other non-Latin text is close to
+            # one token per character.
+            tokens += len(piece.strip()) or 1
+
+    return tokens
+
+
+def estimate_message_tokens(message):
+
+    return (
+        estimate_tokens(message["content"])
+        + MESSAGE_TOKEN_OVERHEAD
+    )
+
+
+def trim_to_tokens(text, max_tokens):
+
+    if estimate_tokens(text) <= max_tokens:
+        return text
+
+    low, high = 0, len(text)
+
+    while low < high:
+
+        mid = (low + high + 1) // 2
+
+        if estimate_tokens(text[:mid]) + 1 <= max_tokens:
+            low = mid
+        else:
+            high = mid - 1
+
+    return text[:low].rstrip() + "…"
+
+
+def select_history(history, budget):
+
+    selected = []
+
+    used = 0
+
+    for message in reversed(history):
+
+        cost = estimate_message_tokens(message)
+
+        if used + cost > budget:
+
+            remaining = (
+                budget - used
+                - MESSAGE_TOKEN_OVERHEAD
             )
+
+            # Keep the most recent turn in shortened
+            # form rather than losing it entirely.
+            if not selected and remaining > 20:
+
+                selected.append(
+                    {
+                        "role": message["role"],
+                        "content": trim_to_tokens(
+                            message["content"],
+                            remaining
+                        )
+                    }
+                )
+
+                used = budget
+
+            break
+
+        selected.append(message)
+
+        used += cost
+
+    selected.reverse()
+
+    return selected, used
+
+
+def build_prompt(
+    system_prompt,
+    context_blocks,
+    history,
+    question
+):
+
+    question_message = {
+        "role": "user",
+        "content": question
+    }
+
+    fixed = (
+        estimate_tokens(
+            f"{system_prompt}\n\nContext:\n"
+        )
+        + MESSAGE_TOKEN_OVERHEAD
+        + estimate_message_tokens(
+            question_message
+        )
+    )
+
+    history, history_tokens = select_history(
+        history,
+        min(
+            HISTORY_TOKEN_BUDGET,
+            max(0, PROMPT_TOKEN_BUDGET - fixed)
         )
+    )
 
-        app.logger.info(
-            "PDF context loaded."
+    context_parts = collect_within_budget(
+        context_blocks,
+        PROMPT_TOKEN_BUDGET
+        - fixed
+        - history_tokens,
+        measure=lambda part: (
+            estimate_tokens(part) + 1
+        )
+    )
+
+    context_text = "\n\n".join(context_parts)
+
+    messages = [
+
+        {
+            "role": "system",
+
+            "content":
+                f"{system_prompt}"
+                f"\n\nContext:\n"
+                f"{context_text}"
+        },
+
+        *history,
+
+        question_message
+
+    ]
+
+    return (
+        messages,
+        context_text,
+        sum(
+            estimate_message_tokens(message)
+            for message in messages
         )
+    )
 
-    return combined_text
+
+prompt_token_stats = {
+    "requests": 0,
+    "total_tokens": 0,
+    "max_tokens": 0
+}
+
+
+def record_prompt_tokens(tokens):
+
+    prompt_token_stats["requests"] += 1
+
+    prompt_token_stats["total_tokens"] += tokens
+
+    prompt_token_stats["max_tokens"] = max(
+        prompt_token_stats["max_tokens"],
+        tokens
+    )
 
 
 # ============================================================
 # LLAMA RESPONSE
+#
+# The pipeline is split into a preparation stage (translate,
+# check relevance, retrieve context, build messages) and a
+# finishing stage (history, URL filtering, fallback search,
+# translation) so the blocking and streaming routes share
+# everything except the LLM call itself.
 # ============================================================
 
-def get_llama3_response(
-    question,
-    user_lang="en"
-):
-
-    user_lang = normalize_language_code(
-        user_lang
-    )
+LLAMA3_MODEL = "meta-llama/Llama-3.3-70B-Instruct-Turbo"
 
-    translator = Translator()
 
+def translate_question(question, user_lang):
 
-    # --------------------------------------------------------
-    # Translate incoming question to English
-    # --------------------------------------------------------
+    if not question_needs_translation(
+        question,
+        user_lang
+    ):
+        return question
 
     try:
 
-        translated_question = (
-            translator
-            .translate(
+        with stage("translate_question"):
+
+            return translate_text(
                 question,
                 dest="en"
             )
-            .text
-        )
 
     except Exception as e:
 
+        translation_failures.labels("question").inc()
+
         app.logger.warning(
             f"Question translation "
             f"failed: {e}"
         )
 
-        translated_question = question
+        return question
+
+
+def prepare_llama3_request(
+    question,
+    user_lang="en",
+    session_id="default",
+    translated_question=None
+):
+
+    user_lang = normalize_language_code(
+        user_lang
+    )
+
+    prepared = {
+        "user_lang": user_lang,
+        "session_id": session_id
+    }
+
+
+    # --------------------------------------------------------
+    # Translate incoming question to English
+    # --------------------------------------------------------
+
+    if translated_question is None:
+
+        translated_question = translate_question(
+            question,
+            user_lang
+        )
+
+    prepared["translated_question"] = (
+        translated_question
+    )
 
 
     # --------------------------------------------------------
     # Reject unrelated questions
     # --------------------------------------------------------
 
-    if not is_question_relevant(
-        translated_question
-    ):
+    with stage("relevance"):
 
-        message = (
-            "Sorry, I can only answer "
-            "questions about opioids, "
-            "addiction, overdose, "
-            "or treatment."
+        relevant = is_question_relevant(
+            translated_question
         )
 
+    if not relevant:
+
         try:
 
-            return (
-                translator
-                .translate(
-                    message,
-                    dest=user_lang
-                )
-                .text
+            prepared["answer"] = translate_text(
+                OFF_TOPIC_MESSAGE,
+                dest=user_lang
             )
 
         except Exception:
 
-            return message
+            translation_failures.labels("off_topic").inc()
+
+            prepared["answer"] = (
+                OFF_TOPIC_MESSAGE
+            )
+
+        return prepared
 
 
     # --------------------------------------------------------
-    # Load PDFs only when actually needed
+    # Direct answers from the PDF table index
     # --------------------------------------------------------
 
-    context_text = get_combined_text()
+    if TABLE_ANSWERS:
 
+        with stage("table_lookup"):
 
-    # --------------------------------------------------------
-    # Conversation history
-    # --------------------------------------------------------
+            table_answer = get_table_index().answer(
+                translated_question
+            )
 
-    conversation_history.append(
-        {
-            "role": "user",
-            "content":
+        if table_answer is not None:
+
+            table_answers.inc()
+
+            conversation_store.append(
+                session_id,
+                "user",
                 translated_question
-        }
-    )
+            )
+
+            conversation_store.append(
+                session_id,
+                "assistant",
+                table_answer
+            )
+
+            prepared["answer"] = translate_answer(
+                prepared,
+                table_answer
+            )
+
+            return prepared
 
 
     # --------------------------------------------------------
@@ -610,6 +5958,7 @@ def get_llama3_response(
 
     system_prompt = (
         "Only use the provided PDF data "
+        "and KFF statistics "
         "to answer questions related to "
         "opioids. "
         "Never use hallucinated or "
@@ -622,20 +5971,94 @@ def get_llama3_response(
     )
 
 
-    messages = [
+    # --------------------------------------------------------
+    # Retrieve passages and fit the prompt to its budget
+    # --------------------------------------------------------
+
+    with stage("context"):
+
+        messages, context_text, prompt_tokens = (
+            build_prompt(
+                system_prompt,
+                itertools.chain(
+                    iter_statistics_blocks(
+                        translated_question
+                    ),
+                    iter_context_blocks(
+                        translated_question
+                    )
+                ),
+                conversation_store.recent(
+                    session_id,
+                    CONVERSATION_MAX_TURNS
+                ),
+                translated_question
+            )
+        )
+
+    prepared["messages"] = messages
+
+    prepared["context_text"] = context_text
+
+    prepared["prompt_tokens"] = prompt_tokens
+
+    # The turns that made it into the prompt, between the
+    # system prompt and the question.
+    prepared["history"] = messages[1:-1]
+
+
+    # --------------------------------------------------------
+    # Answer cache
+    # --------------------------------------------------------
+
+    cache_key = make_answer_cache_key(
+        translated_question,
+        user_lang,
+        context_text,
+        prepared["history"]
+    )
+
+    prepared["cache_key"] = cache_key
+
+    with stage("answer_cache"):
+
+        cached = get_cached_answer(cache_key)
+
+        if cached is None and not prepared["history"]:
+
+            cached = semantic_cache.lookup(
+                translated_question,
+                user_lang
+            )
+
+    if cached is not None:
 
-        {
-            "role": "system",
+        conversation_store.append(
+            session_id,
+            "user",
+            translated_question
+        )
 
-            "content":
-                f"{system_prompt}"
-                f"\n\nContext:\n"
-                f"{context_text}"
-        },
+        conversation_store.append(
+            session_id,
+            "assistant",
+            cached["content"]
+        )
 
-        *conversation_history[-5:]
+        prepared["answer"] = cached["answer"]
 
-    ]
+        return prepared
+
+
+    # --------------------------------------------------------
+    # Conversation history
+    # --------------------------------------------------------
+
+    conversation_store.append(
+        session_id,
+        "user",
+        translated_question
+    )
 
 
     # --------------------------------------------------------
@@ -648,11 +6071,13 @@ def get_llama3_response(
             "LLAMA3_ENDPOINT is not set."
         )
 
-        return (
+        prepared["answer"] = (
             "The chatbot AI service "
             "is not currently configured."
         )
 
+        return prepared
+
 
     if not REN_API_KEY:
 
@@ -660,17 +6085,27 @@ def get_llama3_response(
             "REN_API_KEY is not set."
         )
 
-        return (
+        prepared["answer"] = (
             "The chatbot API key "
             "is not currently configured."
         )
 
+        return prepared
 
-    # --------------------------------------------------------
-    # API request
-    # --------------------------------------------------------
 
-    headers = {
+    record_prompt_tokens(prompt_tokens)
+
+    app.logger.info(
+        f"Sending prompt of ~{prompt_tokens} "
+        f"tokens ({len(messages)} messages)"
+    )
+
+    return prepared
+
+
+def get_llama3_headers():
+
+    return {
 
         "Authorization":
             f"Bearer {REN_API_KEY}",
@@ -681,10 +6116,12 @@ def get_llama3_response(
     }
 
 
+def request_llama3_completion(messages):
+
     payload = {
 
         "model":
-            "meta-llama/Llama-3.3-70B-Instruct-Turbo",
+            LLAMA3_MODEL,
 
         "messages":
             messages
@@ -694,12 +6131,14 @@ def get_llama3_response(
 
     try:
 
-        res = requests.post(
-            LLAMA3_ENDPOINT,
-            headers=headers,
-            json=payload,
-            timeout=60
-        )
+        with stage("llm"):
+
+            res = get_http_session().post(
+                LLAMA3_ENDPOINT,
+                headers=get_llama3_headers(),
+                json=payload,
+                timeout=60
+            )
 
         res.raise_for_status()
 
@@ -708,19 +6147,17 @@ def get_llama3_response(
 
         if data.get("choices"):
 
-            content = (
+            return (
                 data["choices"][0]
                 ["message"]
                 ["content"]
                 .strip()
-            )
-
-        else:
+            ), True
 
-            content = (
-                "No valid response "
-                "was returned."
-            )
+        return (
+            "No valid response "
+            "was returned."
+        ), False
 
 
     except requests.RequestException as e:
@@ -729,10 +6166,10 @@ def get_llama3_response(
             f"LLaMA request error: {e}"
         )
 
-        content = (
+        return (
             "Error getting response "
             "from LLaMA."
-        )
+        ), False
 
 
     except Exception as e:
@@ -741,21 +6178,100 @@ def get_llama3_response(
             f"LLaMA response error: {e}"
         )
 
-        content = (
+        return (
             "Error processing response "
             "from LLaMA."
+        ), False
+
+
+def needs_fallback_sources(filtered_content):
+
+    return (
+        "[URL removed" in filtered_content
+        or
+        "no valid source"
+        in filtered_content.lower()
+    )
+
+
+def format_fallback_sources(fallback_links):
+
+    if not fallback_links:
+        return ""
+
+    fallback_sources = "\n".join(
+        f"- {link}"
+        for link
+        in fallback_links
+    )
+
+    return (
+        "\n\n"
+        "[Fallback sources via "
+        "DuckDuckGo:]\n"
+        f"{fallback_sources}"
+    )
+
+
+def get_fallback_sources(
+    translated_question,
+    filtered_content
+):
+
+    if not needs_fallback_sources(
+        filtered_content
+    ):
+        return ""
+
+    fallback_searches.inc()
+
+    return format_fallback_sources(
+        duckduckgo_search(
+            translated_question
+        )
+    )
+
+
+def translate_answer(prepared, content):
+
+    if is_english(prepared["user_lang"]):
+        return content
+
+    try:
+
+        with stage("translate_answer"):
+
+            return translate_text(
+                content,
+                dest=prepared["user_lang"]
+            )
+
+    except Exception as e:
+
+        translation_failures.labels("answer").inc()
+
+        app.logger.warning(
+            f"Response translation "
+            f"failed: {e}"
         )
 
+        return content
+
+
+def finish_llama3_response(
+    prepared,
+    content,
+    cacheable=False
+):
 
     # --------------------------------------------------------
     # Save assistant response
     # --------------------------------------------------------
 
-    conversation_history.append(
-        {
-            "role": "assistant",
-            "content": content
-        }
+    conversation_store.append(
+        prepared["session_id"],
+        "assistant",
+        content
     )
 
 
@@ -765,84 +6281,349 @@ def get_llama3_response(
 
     valid_urls = (
         extract_urls_from_context(
-            context_text
+            prepared["context_text"]
         )
     )
 
 
-    filtered_content = (
-        filter_response_urls(
-            content,
-            valid_urls
+    with stage("url_filter"):
+
+        filtered_content = (
+            filter_response_urls(
+                content,
+                valid_urls
+            )
         )
-    )
 
 
     # --------------------------------------------------------
     # DuckDuckGo fallback
     # --------------------------------------------------------
 
-    if (
-        "[URL removed" in filtered_content
-        or
-        "no valid source"
-        in filtered_content.lower()
-    ):
+    filtered_content += (
+        get_fallback_sources(
+            prepared["translated_question"],
+            filtered_content
+        )
+    )
 
-        fallback_links = (
-            duckduckgo_search(
-                translated_question
+
+    # --------------------------------------------------------
+    # Translate response
+    # --------------------------------------------------------
+
+    answer = translate_answer(
+        prepared,
+        filtered_content
+    )
+
+    if cacheable:
+
+        remember_answer(
+            prepared,
+            content,
+            answer
+        )
+
+    return answer
+
+
+def get_llama3_response(
+    question,
+    user_lang="en",
+    session_id="default"
+):
+
+    prepared = prepare_llama3_request(
+        question,
+        user_lang,
+        session_id
+    )
+
+    if "answer" in prepared:
+        return prepared["answer"]
+
+    content, ok = request_llama3_completion(
+        prepared["messages"]
+    )
+
+    return finish_llama3_response(
+        prepared,
+        content,
+        cacheable=ok
+    )
+
+
+# ============================================================
+# STREAMING LLAMA RESPONSE
+#
+# Tokens are requested with "stream": true and relayed as
+# Server-Sent Events. URLs never contain whitespace, so the
+# URL filter runs on every whitespace-terminated piece of
+# the stream while the tail is held back until it completes.
+# ============================================================
+
+def iter_llama3_stream(messages):
+
+    payload = {
+
+        "model":
+            LLAMA3_MODEL,
+
+        "messages":
+            messages,
+
+        "stream":
+            True
+
+    }
+
+    with stage("llm_stream"):
+
+        with get_http_session().post(
+            LLAMA3_ENDPOINT,
+            headers=get_llama3_headers(),
+            json=payload,
+            timeout=60,
+            stream=True
+        ) as res:
+
+            res.raise_for_status()
+
+            for line in res.iter_lines(
+                decode_unicode=True
+            ):
+
+                if not line or not line.startswith(
+                    "data:"
+                ):
+                    continue
+
+                data = line[len("data:"):].strip()
+
+                if data == "[DONE]":
+                    break
+
+                choices = (
+                    json.loads(data).get("choices")
+                    or []
+                )
+
+                if not choices:
+                    continue
+
+                delta = (
+                    choices[0]
+                    .get("delta", {})
+                    .get("content")
+                )
+
+                if delta:
+                    yield delta
+
+
+def iter_filtered_stream(
+    deltas,
+    valid_urls
+):
+
+    pending = ""
+
+    for delta in deltas:
+
+        pending += delta
+
+        cut = max(
+            pending.rfind(" "),
+            pending.rfind("\n"),
+            pending.rfind("\t")
+        )
+
+        if cut < 0:
+            continue
+
+        ready = pending[:cut + 1]
+
+        pending = pending[cut + 1:]
+
+        yield filter_response_urls(
+            ready,
+            valid_urls
+        )
+
+    if pending:
+
+        yield filter_response_urls(
+            pending,
+            valid_urls
+        )
+
+
+def format_sse(event, data):
+
+    return (
+        f"event: {event}\n"
+        f"data: {json.dumps(data)}\n\n"
+    )
+
+
+def stream_llama3_response(
+    question,
+    user_lang="en",
+    session_id="default"
+):
+
+    prepared = prepare_llama3_request(
+        question,
+        user_lang,
+        session_id
+    )
+
+    if "answer" in prepared:
+
+        yield format_sse(
+            "done",
+            {"answer": prepared["answer"]}
+        )
+
+        return
+
+    # Partial text can only be shown as it arrives when no
+    # translation is needed afterwards.
+    show_tokens = is_english(
+        prepared["user_lang"]
+    )
+
+    valid_urls = (
+        extract_urls_from_context(
+            prepared["context_text"]
+        )
+    )
+
+    content_parts = []
+
+    filtered_parts = []
+
+    cacheable = True
+
+    def record(deltas):
+
+        for delta in deltas:
+
+            content_parts.append(delta)
+
+            yield delta
+
+    try:
+
+        for piece in iter_filtered_stream(
+            record(
+                iter_llama3_stream(
+                    prepared["messages"]
+                )
+            ),
+            valid_urls
+        ):
+
+            filtered_parts.append(piece)
+
+            if show_tokens and piece:
+
+                yield format_sse(
+                    "token",
+                    {"text": piece}
+                )
+
+    except requests.RequestException as e:
+
+        app.logger.error(
+            f"LLaMA stream error: {e}"
+        )
+
+        cacheable = False
+
+        if not content_parts:
+
+            content_parts.append(
+                "Error getting response "
+                "from LLaMA."
+            )
+
+            filtered_parts.append(
+                content_parts[0]
             )
+
+    except Exception as e:
+
+        app.logger.error(
+            f"LLaMA stream response error: {e}"
         )
 
-        if fallback_links:
+        cacheable = False
 
-            fallback_sources = "\n".join(
-                f"- {link}"
-                for link
-                in fallback_links
+        if not content_parts:
+
+            content_parts.append(
+                "Error processing response "
+                "from LLaMA."
             )
 
-            filtered_content += (
-                "\n\n"
-                "[Fallback sources via "
-                "DuckDuckGo:]\n"
-                f"{fallback_sources}"
+            filtered_parts.append(
+                content_parts[0]
             )
 
+    content = "".join(content_parts).strip()
 
-    # --------------------------------------------------------
-    # Translate response
-    # --------------------------------------------------------
+    if not content:
 
-    if user_lang.lower() in [
-        "en",
-        "en-us",
-        "en-gb"
-    ]:
+        content = (
+            "No valid response "
+            "was returned."
+        )
 
-        return filtered_content
+        filtered_parts = [content]
 
+        cacheable = False
 
-    try:
+    conversation_store.append(
+        prepared["session_id"],
+        "assistant",
+        content
+    )
 
-        return (
-            translator
-            .translate(
-                filtered_content,
-                dest=user_lang
-            )
-            .text
+    filtered_content = (
+        "".join(filtered_parts).strip()
+    )
+
+    fallback = get_fallback_sources(
+        prepared["translated_question"],
+        filtered_content
+    )
+
+    if show_tokens and fallback:
+
+        yield format_sse(
+            "token",
+            {"text": fallback}
         )
 
-    except Exception as e:
+    answer = translate_answer(
+        prepared,
+        filtered_content + fallback
+    )
 
-        app.logger.warning(
-            f"Response translation "
-            f"failed: {e}"
+    if cacheable:
+
+        remember_answer(
+            prepared,
+            content,
+            answer
         )
 
-        return filtered_content
+    yield format_sse(
+        "done",
+        {"answer": answer}
+    )
 
 
 # ============================================================
@@ -917,18 +6698,123 @@ def ask():
         ), 400
 
 
-    answer = (
-        get_llama3_response(
-            question,
-            lang
+    session_id = get_session_id(data)
+
+
+    trace = (
+        RequestTrace()
+        if is_trace_requested()
+        else None
+    )
+
+    trace_token = current_trace.set(trace)
+
+    try:
+
+        with stage("request"):
+
+            answer = get_llama3_response(
+                question,
+                lang,
+                session_id
+            )
+
+    finally:
+
+        current_trace.reset(trace_token)
+
+
+    payload = {
+        "answer": answer
+    }
+
+    if trace is not None:
+
+        payload["trace"] = trace.to_dict()
+
+        write_trace_file(trace)
+
+
+    response = jsonify(payload)
+
+    if trace is not None:
+
+        response.headers["Server-Timing"] = (
+            trace.server_timing()
         )
+
+        response.headers["X-Trace-Id"] = trace.id
+
+
+    return set_session_cookie(
+        response,
+        session_id
     )
 
 
-    return jsonify(
-        {
-            "answer": answer
-        }
+# ============================================================
+# ASK CHATBOT (STREAMING)
+# ============================================================
+
+@app.route(
+    "/ask/stream",
+    methods=["POST"]
+)
+def ask_stream():
+
+    data = (
+        request.get_json(
+            silent=True
+        )
+        or {}
+    )
+
+
+    question = data.get(
+        "question",
+        ""
+    )
+
+
+    lang = (
+        normalize_language_code(
+            data.get(
+                "language",
+                "en"
+            )
+        )
+    )
+
+
+    if not question:
+
+        return jsonify(
+            {
+                "error":
+                    "No question provided"
+            }
+        ), 400
+
+
+    session_id = get_session_id(data)
+
+
+    return set_session_cookie(
+        Response(
+            stream_with_context(
+                stream_llama3_response(
+                    question,
+                    lang,
+                    session_id
+                )
+            ),
+            mimetype="text/event-stream",
+            headers={
+                "Cache-Control": "no-cache",
+                "X-Accel-Buffering": "no"
+            }
+        ),
+        session_id
     )
 
 
@@ -978,25 +6864,21 @@ def translate():
 
     try:
 
-        translation = (
-            Translator()
-            .translate(
-                text,
-                dest=lang
-            )
-        )
-
-
         return jsonify(
             {
                 "translated_text":
-                    translation.text
+                    translate_text(
+                        text,
+                        dest=lang
+                    )
             }
         )
 
 
     except Exception as e:
 
+        translation_failures.labels("endpoint").inc()
+
         app.logger.error(
             f"Translation error: {e}"
         )
@@ -1057,64 +6939,305 @@ def feedback():
 
         try:
 
-            conn = psycopg2.connect(
-                **db_config
+            submit_feedback(
+                user_id,
+                int(rating),
+                feedback_text
             )
 
 
-            cur = conn.cursor()
+            return render_template(
+                "feedback.html",
+                success=True
+            )
 
 
-            cur.execute(
+        except Exception as e:
 
-                """
-                INSERT INTO feedback
-                (
-                    user_id,
+            app.logger.error(
+                f"DB Error: {e}"
+            )
+
+
+            return render_template(
+                "feedback.html",
+                success=False
+            )
+
+
+    return render_template(
+        "feedback.html",
+        success=False
+    )
+
+
+# ============================================================
+# FEEDBACK DASHBOARD
+#
+# Protected by FEEDBACK_SECRET_KEY, and disabled while that
+# is unset or left at its default. Browsers sign in once with
+# a POST and get an HttpOnly cookie holding a token derived
+# from the key; scripts send the key in X-Dashboard-Key. The
+# key never appears in a URL. Charts come
+# from feedback_daily_summary; the row listing is paged by
+# id so each page is an index range scan.
+# ============================================================
+
+DASHBOARD_DAYS = int(
+    os.environ.get(
+        "DASHBOARD_DAYS",
+        30
+    )
+)
+
+DASHBOARD_PAGE_SIZE = int(
+    os.environ.get(
+        "DASHBOARD_PAGE_SIZE",
+        50
+    )
+)
+
+
+DASHBOARD_COOKIE = "dashboard_token"
+
+
+def dashboard_token():
+
+    return hmac.new(
+        FEEDBACK_SECRET_KEY.encode("utf-8"),
+        b"feedback-dashboard",
+        hashlib.sha256
+    ).hexdigest()
+
+
+def matches_secret(candidate, secret):
+
+    return hmac.compare_digest(
+        (candidate or "").encode("utf-8"),
+        secret.encode("utf-8")
+    )
+
+
+def is_dashboard_authorized():
+
+    return matches_secret(
+        request.headers.get("X-Dashboard-Key"),
+        FEEDBACK_SECRET_KEY
+    ) or matches_secret(
+        request.cookies.get(DASHBOARD_COOKIE),
+        dashboard_token()
+    )
+
+
+def load_dashboard_data(before_id=None):
+
+    summary_ready = ensure_feedback_summary()
+
+    def query(cur):
+
+        if summary_ready:
+
+            summary = "feedback_daily_summary"
+
+        else:
+
+            summary = f"""(
+                SELECT
+                    {feedback_day_expression(cur)} AS day,
                     rating,
-                    comments
-                )
-                VALUES (%s, %s, %s);
+                    COUNT(*) AS count
+                FROM feedback
+                WHERE rating IS NOT NULL
+                GROUP BY 1, 2
+            ) AS summary"""
+
+        cur.execute(
+            f"""
+            SELECT rating, SUM(count)
+            FROM {summary}
+            GROUP BY rating
+            ORDER BY rating;
+            """
+        )
+
+        distribution = [
+            (rating, int(count))
+            for rating, count in cur.fetchall()
+        ]
+
+        cur.execute(
+            f"""
+            SELECT
+                day,
+                SUM(rating * count)::float
+                    / SUM(count),
+                SUM(count)
+            FROM {summary}
+            WHERE day > CURRENT_DATE - %s
+            GROUP BY day
+            ORDER BY day;
+            """,
+            (DASHBOARD_DAYS,)
+        )
+
+        daily = [
+            (day, average, int(count))
+            for day, average, count
+            in cur.fetchall()
+        ]
+
+        if before_id is None:
+
+            cur.execute(
+                """
+                SELECT *
+                FROM feedback
+                ORDER BY id DESC
+                LIMIT %s;
                 """,
+                (DASHBOARD_PAGE_SIZE,)
+            )
 
-                (
-                    user_id,
-                    int(rating),
-                    feedback_text
-                )
+        else:
 
+            cur.execute(
+                """
+                SELECT *
+                FROM feedback
+                WHERE id < %s
+                ORDER BY id DESC
+                LIMIT %s;
+                """,
+                (before_id, DASHBOARD_PAGE_SIZE)
             )
 
+        return distribution, daily, cur.fetchall()
 
-            conn.commit()
+    distribution, daily, rows = (
+        run_in_db_transaction(query)
+    )
 
-            cur.close()
+    total = sum(
+        count for _, count in distribution
+    )
 
-            conn.close()
+    return {
+        "distribution": distribution,
+        "daily": daily,
+        "feedback": rows,
+        "total": total,
+        "average": (
+            sum(
+                rating * count
+                for rating, count in distribution
+            ) / total
+            if total
+            else None
+        ),
+        "next_before": (
+            rows[-1][0]
+            if len(rows) == DASHBOARD_PAGE_SIZE
+            else None
+        )
+    }
 
 
-            return render_template(
-                "feedback.html",
-                success=True
-            )
+@app.route(
+    "/dashboard",
+    methods=["GET", "POST"]
+)
+def dashboard():
 
+    # Refuse to serve behind the placeholder key that ships
+    # as the default.
+    if FEEDBACK_SECRET_KEY in ("", "test-key"):
 
-        except Exception as e:
+        return jsonify(
+            {
+                "error":
+                    "FEEDBACK_SECRET_KEY is not configured"
+            }
+        ), 503
 
-            app.logger.error(
-                f"DB Error: {e}"
-            )
 
+    if request.method == "POST":
+
+        if not matches_secret(
+            request.form.get("key"),
+            FEEDBACK_SECRET_KEY
+        ):
 
             return render_template(
-                "feedback.html",
-                success=False
-            )
+                "dashboard_login.html",
+                failed=True
+            ), 403
+
+        response = redirect(
+            url_for("dashboard"),
+            code=303
+        )
+
+        response.set_cookie(
+            DASHBOARD_COOKIE,
+            dashboard_token(),
+            max_age=12 * 60 * 60,
+            path=url_for("dashboard"),
+            secure=request.is_secure,
+            httponly=True,
+            samesite="Strict"
+        )
+
+        return response
+
+
+    if not is_dashboard_authorized():
+
+        return render_template(
+            "dashboard_login.html",
+            failed=False
+        ), 403
+
+
+    if not DATABASE_URL:
+
+        return jsonify(
+            {
+                "error":
+                    "DATABASE_URL is not configured"
+            }
+        ), 503
+
+
+    before_id = request.args.get(
+        "before",
+        type=int
+    )
+
+
+    try:
+
+        data = load_dashboard_data(
+            before_id
+        )
+
+    except Exception as e:
+
+        app.logger.error(
+            f"Dashboard DB Error: {e}"
+        )
+
+        return jsonify(
+            {
+                "error":
+                    "Could not load feedback"
+            }
+        ), 500
 
 
     return render_template(
-        "feedback.html",
-        success=False
+        "dashboard.html",
+        days=DASHBOARD_DAYS,
+        **data
     )
 
 
@@ -1137,14 +7260,98 @@ def check_env():
             "DATABASE_URL_SET":
                 bool(DATABASE_URL),
 
+            "REDIS_URL_SET":
+                bool(REDIS_URL),
+
+            "METRICS_MULTIPROCESS":
+                bool(PROMETHEUS_MULTIPROC_DIR),
+
             "PDF_CONTEXT_LOADED":
-                combined_text
+                corpus_index
                 is not None
 
         }
     )
 
 
+# ============================================================
+# RUNTIME STATISTICS
+# ============================================================
+
+@app.route("/stats")
+def stats():
+
+    return jsonify(
+        {
+
+            "http":
+                get_http_pool_stats(),
+
+            "answer_cache":
+                answer_cache.stats(),
+
+            "semantic_cache":
+                semantic_cache.stats(),
+
+            "search_cache":
+                search_cache.stats(),
+
+            "link_status_cache":
+                link_status_cache.stats(),
+
+            "translation_cache":
+                translation_cache.stats(),
+
+            "conversations":
+                conversation_store.stats(),
+
+            "feedback":
+                get_feedback_stats(),
+
+            "prompt_tokens":
+                prompt_token_stats,
+
+            "statistics":
+                get_statistics_store().stats(),
+
+            "tables":
+                table_index.stats()
+                if table_index is not None
+                else None,
+
+            "corpus_refresh":
+                corpus_refresh_metrics,
+
+            "corpus":
+                {
+                    "chunks": len(corpus_index),
+                    "memory_mapped": isinstance(
+                        corpus_index,
+                        MappedCorpusIndex
+                    )
+                }
+                if corpus_index is not None
+                else None
+
+        }
+    )
+
+
+# ============================================================
+# PROMETHEUS METRICS
+# ============================================================
+
+@app.route("/metrics")
+def metrics():
+
+    return Response(
+        generate_latest(
+            get_metrics_registry()
+        ),
+        content_type=CONTENT_TYPE_LATEST
+    )
+
+
 # ============================================================
 # LOCAL DEVELOPMENT SERVER
 #
@@ -181,29 +181,33 @@ document.addEventListener("DOMContentLoaded", function () {
     // ADD MESSAGE TO CHAT
     // =========================================================
 
-    function appendMessage(sender, message) {
-        const msgDiv = document.createElement("div");
-
-        msgDiv.classList.add(
-            sender === "bot" ? "bot-message" : "user-message"
-        );
-
-        const safeMessage = message
+    function formatMessage(message) {
+        return message
             .replace(/\n/g, "<br>")
             .replace(
                 /(https?:\/\/[^\s<]+)/g,
                 '<a href="$1" target="_blank" style="color: #81cfff;">$1</a>'
             );
+    }
 
-        msgDiv.innerHTML = safeMessage;
+    function appendMessage(sender, message, speak = true) {
+        const msgDiv = document.createElement("div");
+
+        msgDiv.classList.add(
+            sender === "bot" ? "bot-message" : "user-message"
+        );
+
+        msgDiv.innerHTML = formatMessage(message);
 
         chatBox.appendChild(msgDiv);
 
         chatBox.scrollTop = chatBox.scrollHeight;
 
-        if (sender === "bot") {
+        if (sender === "bot" && speak) {
             speakText(message);
         }
+
+        return msgDiv;
     }
 
 
@@ -211,6 +215,105 @@ document.addEventListener("DOMContentLoaded", function () {
     // SEND MESSAGE
     // =========================================================
 
+    function removeThinkingMessage() {
+
+        const botMessages =
+            document.querySelectorAll(".bot-message");
+
+        const lastBotMessage =
+            botMessages[botMessages.length - 1];
+
+        if (
+            lastBotMessage &&
+            lastBotMessage.textContent ===
+                languageData[currentLanguage].thinkingMessage
+        ) {
+            lastBotMessage.remove();
+        }
+    }
+
+
+    // Parses the Server-Sent Events sent by /ask/stream.
+    // Tokens are shown as they arrive; the "done" event
+    // carries the final (filtered and translated) answer.
+    async function readAnswerStream(response) {
+
+        const reader = response.body.getReader();
+
+        const decoder = new TextDecoder();
+
+        let buffer = "";
+
+        let streamed = "";
+
+        let msgDiv = null;
+
+        while (true) {
+
+            const { value, done } = await reader.read();
+
+            if (done) break;
+
+            buffer += decoder.decode(value, { stream: true });
+
+            let boundary;
+
+            while ((boundary = buffer.indexOf("\n\n")) !== -1) {
+
+                const rawEvent = buffer.slice(0, boundary);
+
+                buffer = buffer.slice(boundary + 2);
+
+                let eventName = "message";
+
+                let eventData = "";
+
+                rawEvent.split("\n").forEach(line => {
+                    if (line.startsWith("event:")) {
+                        eventName = line.slice(6).trim();
+                    } else if (line.startsWith("data:")) {
+                        eventData += line.slice(5).trim();
+                    }
+                });
+
+                const data = JSON.parse(eventData || "{}");
+
+                if (eventName === "token") {
+
+                    streamed += data.text || "";
+
+                    if (!msgDiv) {
+                        removeThinkingMessage();
+                        msgDiv = appendMessage("bot", streamed, false);
+                    } else {
+                        msgDiv.innerHTML = formatMessage(streamed);
+                        chatBox.scrollTop = chatBox.scrollHeight;
+                    }
+
+                } else if (eventName === "done") {
+
+                    const answer =
+                        data.answer ||
+                        "Error: Could not get a response.";
+
+                    removeThinkingMessage();
+
+                    if (msgDiv) {
+                        msgDiv.innerHTML = formatMessage(answer);
+                        chatBox.scrollTop = chatBox.scrollHeight;
+                        speakText(answer);
+                    } else {
+                        appendMessage("bot", answer);
+                    }
+
+                    return;
+                }
+            }
+        }
+
+        throw new Error("Stream ended without an answer");
+    }
+
     function sendMessage(text) {
         if (!text || !text.trim()) return;
 
@@ -223,7 +326,7 @@ document.addEventListener("DOMContentLoaded", function () {
             languageData[currentLanguage].thinkingMessage
         );
 
-        fetch("/ask", {
+        fetch("/ask/stream", {
             method: "POST",
 
             headers: {
@@ -236,48 +339,20 @@ document.addEventListener("DOMContentLoaded", function () {
             })
         })
 
-        .then(res => res.json())
-
-        .then(data => {
-
-            const botMessages =
-                document.querySelectorAll(".bot-message");
-
-            const lastBotMessage =
-                botMessages[botMessages.length - 1];
+        .then(res => {
 
-            if (
-                lastBotMessage &&
-                lastBotMessage.textContent ===
-                    languageData[currentLanguage].thinkingMessage
-            ) {
-                lastBotMessage.remove();
+            if (!res.ok || !res.body) {
+                throw new Error(`HTTP ${res.status}`);
             }
 
-            const response =
-                data.answer ||
-                "Error: Could not get a response.";
-
-            appendMessage("bot", response);
+            return readAnswerStream(res);
         })
 
         .catch(error => {
 
             console.error("Request error:", error);
 
-            const botMessages =
-                document.querySelectorAll(".bot-message");
-
-            const lastBotMessage =
-                botMessages[botMessages.length - 1];
-
-            if (
-                lastBotMessage &&
-                lastBotMessage.textContent ===
-                    languageData[currentLanguage].thinkingMessage
-            ) {
-                lastBotMessage.remove();
-            }
+            removeThinkingMessage();
 
             appendMessage(
                 "bot",
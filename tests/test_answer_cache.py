@@ -0,0 +1,104 @@
+import os
+import sys
+import unittest
+from unittest import mock
+
+sys.path.insert(
+    0,
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+)
+
+import llama3chatbotopioid as chatbot
+
+
+QUESTION = "How does naloxone reverse an opioid overdose?"
+
+PASSAGE = "Naloxone displaces opioids from their receptors."
+
+
+class AnswerCacheHistoryTest(unittest.TestCase):
+
+    def setUp(self):
+
+        chatbot.answer_cache.clear()
+
+        chatbot.semantic_cache.clear()
+
+        for target, value in (
+            ("TABLE_ANSWERS", False),
+            ("get_shared_store", lambda: None),
+            ("iter_statistics_blocks", lambda question: iter(())),
+            ("iter_context_blocks", lambda question: iter([("naloxone.pdf", PASSAGE)])),
+            (
+                "conversation_store",
+                chatbot.ConversationStore(
+                    chatbot.CONVERSATION_MAX_TURNS,
+                    chatbot.CONVERSATION_IDLE_TTL,
+                    chatbot.CONVERSATION_MAX_SESSIONS,
+                    chatbot.CONVERSATION_MAX_CHARS
+                )
+            )
+        ):
+
+            patcher = mock.patch.object(chatbot, target, value)
+
+            patcher.start()
+
+            self.addCleanup(patcher.stop)
+
+    def prepare(self, session_id, question=QUESTION):
+
+        return chatbot.prepare_llama3_request(
+            question,
+            "en",
+            session_id,
+            translated_question=question
+        )
+
+    def test_first_turn_answers_are_shared(self):
+
+        chatbot.remember_answer(self.prepare("a"), "content", "answer")
+
+        self.assertEqual(self.prepare("b").get("answer"), "answer")
+
+        self.assertEqual(
+            self.prepare("c", QUESTION.lower()).get("answer"),
+            "answer"
+        )
+
+    def test_follow_up_skips_caches(self):
+
+        chatbot.remember_answer(self.prepare("a"), "content", "answer")
+
+        chatbot.conversation_store.append(
+            "b",
+            "user",
+            "What is fentanyl?"
+        )
+
+        chatbot.conversation_store.append(
+            "b",
+            "assistant",
+            "A synthetic opioid."
+        )
+
+        prepared = self.prepare("b")
+
+        self.assertNotEqual(prepared.get("answer"), "answer")
+
+        self.assertTrue(prepared["history"])
+
+        # Answered mid-conversation: stays out of the
+        # question-only semantic cache.
+        chatbot.remember_answer(prepared, "other", "follow-up")
+
+        self.assertEqual(
+            chatbot.semantic_cache.lookup(QUESTION, "en")["answer"],
+            "answer"
+        )
+
+        self.assertEqual(self.prepare("c").get("answer"), "answer")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,97 @@
+import json
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(
+    0,
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+)
+
+import llama3chatbotopioid as chatbot
+
+
+CHUNKS = [
+    ("a.pdf", "naloxone reverses an opioid overdose"),
+    ("b.pdf", "fentanyl is a synthetic opioid")
+]
+
+PAGE_TABLES = [
+    ("a.pdf", 2, [[["Location", "Deaths"], ["Ohio", "5,174"]]]),
+    ("b.pdf", 1, [[["Year", "Deaths"], ["2022", "73,838"]]]),
+    ("b.pdf", 4, [[["Year", "Rate"], ["2022", "22.7"]]])
+]
+
+
+class CorpusFileTest(unittest.TestCase):
+
+    def setUp(self):
+
+        directory = tempfile.TemporaryDirectory()
+
+        self.addCleanup(directory.cleanup)
+
+        patcher = mock.patch.object(
+            chatbot,
+            "CORPUS_FILE",
+            os.path.join(directory.name, "corpus.bin")
+        )
+
+        patcher.start()
+
+        self.addCleanup(patcher.stop)
+
+        chatbot.write_corpus_file(
+            "key",
+            ["a.pdf", "b.pdf"],
+            CHUNKS,
+            PAGE_TABLES
+        )
+
+    def header(self):
+
+        with open(chatbot.CORPUS_FILE, "rb") as f:
+
+            f.seek(8)
+
+            length = int.from_bytes(f.read(8), "little")
+
+            return json.loads(f.read(length))
+
+    def test_tables_are_not_in_the_header(self):
+
+        self.assertNotIn("tables", self.header())
+
+        index = chatbot.open_corpus_file("key")
+
+        self.assertEqual(
+            index.document_tables("b.pdf"),
+            [
+                tuple(json.loads(json.dumps(entry)))
+                for entry in PAGE_TABLES[1:]
+            ]
+        )
+
+        self.assertEqual(index.document_tables("c.pdf"), [])
+
+        self.assertEqual(
+            [entry[:2] for entry in index.page_tables],
+            [entry[:2] for entry in PAGE_TABLES]
+        )
+
+    def test_version_mismatch_is_rejected(self):
+
+        self.assertIsNotNone(chatbot.open_corpus_file("key"))
+
+        with mock.patch.object(
+            chatbot,
+            "CORPUS_FILE_VERSION",
+            chatbot.CORPUS_FILE_VERSION + 1
+        ):
+            self.assertIsNone(chatbot.open_corpus_file("key"))
+
+
+if __name__ == "__main__":
+    unittest.main()
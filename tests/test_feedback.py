@@ -0,0 +1,268 @@
+import os
+import sys
+import unittest
+from unittest import mock
+
+sys.path.insert(
+    0,
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+)
+
+import llama3chatbotopioid as chatbot
+
+
+class DashboardKeyTest(unittest.TestCase):
+
+    def setUp(self):
+
+        for name, value in (
+            ("FEEDBACK_SECRET_KEY", "s3cret"),
+            ("DATABASE_URL", "")
+        ):
+            patcher = mock.patch.object(chatbot, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        self.client = chatbot.app.test_client()
+
+    def assertPastKeyCheck(self, response):
+
+        # Past the key check, the missing database answers.
+        self.assertEqual(response.status_code, 503)
+
+        self.assertIn(
+            "DATABASE_URL",
+            response.get_json()["error"]
+        )
+
+    def test_default_key_is_refused(self):
+
+        for secret in ("test-key", ""):
+            with self.subTest(secret=secret), mock.patch.object(
+                chatbot,
+                "FEEDBACK_SECRET_KEY",
+                secret
+            ):
+                self.assertEqual(
+                    self.client.get(
+                        "/dashboard",
+                        headers={"X-Dashboard-Key": secret}
+                    ).status_code,
+                    503
+                )
+
+    def test_anonymous_gets_login_form(self):
+
+        response = self.client.get("/dashboard")
+
+        self.assertEqual(response.status_code, 403)
+
+        self.assertIn(b'method="post"', response.data)
+
+    def test_key_in_query_string_is_not_accepted(self):
+
+        self.assertEqual(
+            self.client.get(
+                "/dashboard",
+                query_string={"key": "s3cret"}
+            ).status_code,
+            403
+        )
+
+    def test_header_key_is_accepted(self):
+
+        self.assertPastKeyCheck(
+            self.client.get(
+                "/dashboard",
+                headers={"X-Dashboard-Key": "s3cret"}
+            )
+        )
+
+    def test_wrong_login_is_forbidden(self):
+
+        response = self.client.post(
+            "/dashboard",
+            data={"key": "guess"}
+        )
+
+        self.assertEqual(response.status_code, 403)
+
+        self.assertNotIn("Set-Cookie", response.headers)
+
+    def test_login_sets_cookie_without_the_key(self):
+
+        response = self.client.post(
+            "/dashboard",
+            data={"key": "s3cret"}
+        )
+
+        self.assertEqual(response.status_code, 303)
+
+        self.assertNotIn("s3cret", response.headers["Location"])
+
+        cookie = response.headers["Set-Cookie"]
+
+        self.assertNotIn("s3cret", cookie)
+
+        self.assertIn("HttpOnly", cookie)
+
+        self.assertPastKeyCheck(self.client.get("/dashboard"))
+
+
+class RecordingCursor:
+
+    def __init__(self):
+        self.statements = []
+
+    def execute(self, sql, args=None):
+        self.statements.append(sql)
+
+    def fetchone(self):
+        return None
+
+    def fetchall(self):
+        return []
+
+
+class FeedbackSummaryTest(unittest.TestCase):
+
+    def setUp(self):
+
+        patcher = mock.patch.object(
+            chatbot,
+            "feedback_summary_pid",
+            None
+        )
+
+        patcher.start()
+
+        self.addCleanup(patcher.stop)
+
+    def test_insert_path_runs_no_summary_sql(self):
+
+        with mock.patch.object(
+            chatbot,
+            "ensure_feedback_summary"
+        ) as ensure, mock.patch.object(
+            chatbot,
+            "run_in_db_transaction",
+            side_effect=lambda callback: callback(mock.Mock())
+        ), mock.patch.object(
+            chatbot,
+            "execute_values"
+        ) as execute_values:
+
+            chatbot.insert_feedback_rows([("user", 5, "ok")])
+
+        ensure.assert_not_called()
+
+        self.assertEqual(execute_values.call_count, 1)
+
+        self.assertIn(
+            "INSERT INTO feedback\n",
+            execute_values.call_args.args[1]
+        )
+
+    def test_failed_migration_is_latched(self):
+
+        with mock.patch.object(
+            chatbot,
+            "run_in_db_transaction",
+            side_effect=Exception("permission denied")
+        ) as run:
+
+            self.assertFalse(chatbot.ensure_feedback_summary())
+
+            self.assertFalse(chatbot.ensure_feedback_summary())
+
+        self.assertEqual(run.call_count, 1)
+
+    def test_dashboard_scans_feedback_without_summary(self):
+
+        cursor = RecordingCursor()
+
+        with mock.patch.object(
+            chatbot,
+            "ensure_feedback_summary",
+            return_value=False
+        ), mock.patch.object(
+            chatbot,
+            "run_in_db_transaction",
+            side_effect=lambda callback: callback(cursor)
+        ):
+
+            data = chatbot.load_dashboard_data()
+
+        self.assertEqual(data["total"], 0)
+
+        sql = "\n".join(cursor.statements)
+
+        self.assertNotIn("FROM feedback_daily_summary", sql)
+
+        self.assertIn("FROM feedback\n", sql)
+
+
+class FeedbackQueueTest(unittest.TestCase):
+
+    def setUp(self):
+
+        patcher = mock.patch.object(chatbot, "feedback_pending", [])
+
+        patcher.start()
+
+        self.addCleanup(patcher.stop)
+
+        while not chatbot.feedback_queue.empty():
+            chatbot.feedback_queue.get_nowait()
+
+    def test_failed_batch_is_retried(self):
+
+        rows = [("a", 5, ""), ("b", 4, "")]
+
+        for row in rows:
+            chatbot.feedback_queue.put_nowait(row)
+
+        with mock.patch.object(
+            chatbot,
+            "insert_feedback_rows",
+            side_effect=[Exception("db down"), None]
+        ) as insert:
+
+            self.assertFalse(chatbot.flush_pending_feedback())
+
+            self.assertEqual(chatbot.feedback_pending, rows)
+
+            self.assertTrue(chatbot.flush_pending_feedback())
+
+        self.assertEqual(
+            [call.args[0] for call in insert.call_args_list],
+            [rows, rows]
+        )
+
+        self.assertEqual(chatbot.feedback_pending, [])
+
+    def test_exit_flushes_in_flight_row(self):
+
+        # The writer holds this row while it sleeps.
+        chatbot.feedback_pending.append(("a", 5, ""))
+
+        chatbot.feedback_queue.put_nowait(("b", 3, ""))
+
+        with mock.patch.object(
+            chatbot,
+            "feedback_writer_pid",
+            os.getpid()
+        ), mock.patch.object(
+            chatbot,
+            "insert_feedback_rows"
+        ) as insert:
+
+            chatbot.flush_feedback_on_exit()
+
+        insert.assert_called_once_with(
+            [("a", 5, ""), ("b", 3, "")]
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
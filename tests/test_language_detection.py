@@ -0,0 +1,93 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(
+    0,
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+)
+
+import llama3chatbotopioid as chatbot
+
+
+ENGLISH = [
+    "What is naloxone?",
+    "How does fentanyl affect the body?",
+    "Where can I get treatment near me?",
+    "what to do if someone overdosed",
+    "Is methadone safe during pregnancy?",
+    "How many people died from opioid overdoses in 2022?",
+    "my brother is addicted to pills, what should I do",
+    "Can I get Narcan without a prescription?",
+    "How long does withdrawal last?",
+    "why is fentanyl so dangerous",
+    "Tell me about buprenorphine",
+    "is it illegal to carry naloxone"
+]
+
+FOREIGN = [
+    "Что такое налоксон?",
+    "ナロキソンとは何ですか",
+    "날록손이란 무엇입니까",
+    "什么是纳洛酮？",
+    "Was ist Naloxon und wie wirkt es?",
+    "O que é naloxona e como funciona?",
+    "Co to jest nalokson i jak działa?",
+    "Wat is naloxon en hoe werkt het?",
+    "Hoe kan ik hulp krijgen bij verslaving?",
+    "¿Qué es la naloxona?",
+    "Qu'est-ce que la naloxone ?",
+    "Come funziona il naloxone?",
+    "Naloxon nedir?"
+]
+
+
+class QuestionNeedsTranslationTest(unittest.TestCase):
+
+    def test_english_skips_translation(self):
+
+        for question in ENGLISH:
+            with self.subTest(question=question):
+                self.assertFalse(
+                    chatbot.question_needs_translation(
+                        question,
+                        "en"
+                    )
+                )
+
+    def test_foreign_is_translated_for_english_clients(self):
+
+        # Regression: these were sent untranslated when the
+        # client reported "en", and refused as off-topic.
+        for question in FOREIGN:
+            with self.subTest(question=question):
+                self.assertTrue(
+                    chatbot.question_needs_translation(
+                        question,
+                        "en"
+                    )
+                )
+
+    def test_unrecognised_input_is_translated(self):
+
+        for question in ("naloxone", "fentanyl test strips"):
+            with self.subTest(question=question):
+                self.assertTrue(
+                    chatbot.question_needs_translation(
+                        question,
+                        "en"
+                    )
+                )
+
+    def test_english_from_foreign_client_skips_translation(self):
+
+        self.assertFalse(
+            chatbot.question_needs_translation(
+                "What is naloxone?",
+                "es"
+            )
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,141 @@
+import os
+import sys
+import threading
+import time
+import unittest
+from unittest import mock
+
+import requests
+
+sys.path.insert(
+    0,
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+)
+
+import llama3chatbotopioid as chatbot
+
+
+RESULTS_HTML = """
+<a class="result__a" href="https://www.cdc.gov/overdose/a">a</a>
+<a class="result__a" href="https://www.cdc.gov/overdose/b">b</a>
+"""
+
+
+class FakeSession:
+
+    def __init__(self, head):
+        self.head = head
+
+    def get(self, url, **kwargs):
+        return mock.Mock(
+            text=RESULTS_HTML,
+            raise_for_status=lambda: None
+        )
+
+
+class LinkCheckTest(unittest.TestCase):
+
+    def setUp(self):
+
+        chatbot.search_cache.clear()
+
+        chatbot.link_status_cache.clear()
+
+    def entry_ttl(self, url):
+
+        _, expires = chatbot.link_status_cache.items[url]
+
+        return expires - time.monotonic()
+
+    def test_failed_check_expires_quickly(self):
+
+        def head(url, **kwargs):
+            raise requests.Timeout("slow")
+
+        with mock.patch.object(
+            chatbot,
+            "get_http_session",
+            return_value=FakeSession(head)
+        ):
+
+            self.assertFalse(
+                chatbot.is_link_alive("https://www.cdc.gov/a")
+            )
+
+        self.assertLessEqual(
+            self.entry_ttl("https://www.cdc.gov/a"),
+            chatbot.LINK_FAILURE_TTL
+        )
+
+    def test_live_link_uses_search_ttl(self):
+
+        with mock.patch.object(
+            chatbot,
+            "get_http_session",
+            return_value=FakeSession(
+                lambda url, **kwargs: mock.Mock(status_code=200)
+            )
+        ):
+
+            self.assertTrue(
+                chatbot.is_link_alive("https://www.cdc.gov/a")
+            )
+
+        self.assertGreater(
+            self.entry_ttl("https://www.cdc.gov/a"),
+            chatbot.LINK_FAILURE_TTL
+        )
+
+    def test_deadline_cut_results_are_not_cached(self):
+
+        release = threading.Event()
+
+        def head(url, **kwargs):
+
+            release.wait(5)
+
+            return mock.Mock(status_code=200)
+
+        with mock.patch.object(
+            chatbot,
+            "get_http_session",
+            return_value=FakeSession(head)
+        ), mock.patch.object(
+            chatbot,
+            "LINK_CHECK_DEADLINE",
+            0.05
+        ):
+
+            try:
+                links = chatbot.search_duckduckgo("naloxone", 3)
+            finally:
+                release.set()
+
+        self.assertEqual(links, [])
+
+        self.assertIsNone(
+            chatbot.search_cache.get(("naloxone", 3))
+        )
+
+    def test_decided_results_are_cached(self):
+
+        with mock.patch.object(
+            chatbot,
+            "get_http_session",
+            return_value=FakeSession(
+                lambda url, **kwargs: mock.Mock(status_code=200)
+            )
+        ):
+
+            links = chatbot.search_duckduckgo("naloxone", 3)
+
+        self.assertEqual(len(links), 2)
+
+        self.assertEqual(
+            chatbot.search_cache.get(("naloxone", 3)),
+            links
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,93 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(
+    0,
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+)
+
+import llama3chatbotopioid as chatbot
+
+
+# Same question, different words: must hit.
+PARAPHRASES = [
+    ("how does narcan work", "what does naloxone do"),
+    ("What are the signs of an opioid overdose?",
+     "what are the symptoms of opioid overdose"),
+    ("Where can I get Narcan?", "where can i get naloxone"),
+    ("What is fentanyl?", "what is fentanyl exactly"),
+    ("How many opioid overdose deaths were there in Virginia "
+     "in 2022?",
+     "how many opioid overdose deaths in virginia in 2022"),
+    ("Is suboxone safe?", "is buprenorphine safe"),
+    ("What are opioids?", "what is an opioid"),
+    ("How do I help someone who is overdosing?",
+     "how do i help someone who is having an overdose"),
+    ("What are the side effects of oxycontin?",
+     "side effects of oxycodone"),
+    ("Where can I find rehab near me?",
+     "where can i find rehabilitation near me"),
+    ("What is MAT treatment?", "what is mat treatment for opioids"),
+    ("How long does withdrawal last?",
+     "how long do opioid withdrawal symptoms last")
+]
+
+# Similar wording, different answer: must miss.
+NEAR_MISSES = [
+    ("how many overdose deaths in Virginia",
+     "how many overdose deaths in West Virginia"),
+    ("overdose deaths in 2021", "overdose deaths in 2022"),
+    ("What is fentanyl?", "what is carfentanil"),
+    ("What is naloxone?", "what is naltrexone"),
+    ("Is methadone safe?", "is methadone safe during pregnancy"),
+    ("What are the signs of an opioid overdose?",
+     "what are the signs of opioid withdrawal"),
+    ("How does buprenorphine work?", "how does methadone work"),
+    ("What is heroin?", "what is black tar heroin"),
+    ("how many teens use opioids", "how many adults use opioids"),
+    ("how do i get naloxone", "how do i use naloxone"),
+    ("What is hydrocodone?", "what is hydromorphone"),
+    ("opioid deaths among men", "opioid deaths among women")
+]
+
+
+class SemanticCacheTest(unittest.TestCase):
+
+    def lookup(self, cached, asked):
+
+        cache = chatbot.SemanticCache(
+            16,
+            chatbot.SEMANTIC_CACHE_THRESHOLD
+        )
+
+        cache.add(cached, "en", {"answer": cached})
+
+        return cache.lookup(asked, "en")
+
+    def test_paraphrases_hit(self):
+
+        for cached, asked in PARAPHRASES:
+            with self.subTest(cached=cached, asked=asked):
+                self.assertIsNotNone(self.lookup(cached, asked))
+
+    def test_near_misses_miss(self):
+
+        for cached, asked in NEAR_MISSES:
+            with self.subTest(cached=cached, asked=asked):
+                self.assertIsNone(self.lookup(cached, asked))
+
+    def test_language_must_match(self):
+
+        cache = chatbot.SemanticCache(
+            16,
+            chatbot.SEMANTIC_CACHE_THRESHOLD
+        )
+
+        cache.add("what is naloxone", "en", {"answer": "en"})
+
+        self.assertIsNone(cache.lookup("what is naloxone", "es"))
+
+
+if __name__ == "__main__":
+    unittest.main()
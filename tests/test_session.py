@@ -0,0 +1,52 @@
+import os
+import sys
+import unittest
+from unittest import mock
+
+sys.path.insert(
+    0,
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+)
+
+import llama3chatbotopioid as chatbot
+
+
+class SessionIdTest(unittest.TestCase):
+
+    def session_id(self, data):
+
+        with chatbot.app.test_request_context("/ask"):
+            return chatbot.get_session_id(data)
+
+    def test_valid_id_is_kept(self):
+
+        self.assertEqual(
+            self.session_id({"session_id": "abc_123-x"}),
+            "abc_123-x"
+        )
+
+    def test_invalid_ids_get_a_new_id(self):
+
+        for value in (123, ["a"], {"a": 1}, True, "bad id!", "x" * 65):
+            with self.subTest(value=value):
+                session_id = self.session_id({"session_id": value})
+                self.assertRegex(session_id, r"^[0-9a-f]{32}$")
+
+    def test_non_string_id_does_not_fail_ask(self):
+
+        with mock.patch.object(
+            chatbot,
+            "get_llama3_response",
+            return_value="ok"
+        ):
+
+            response = chatbot.app.test_client().post(
+                "/ask",
+                json={"question": "What is naloxone?", "session_id": 123}
+            )
+
+        self.assertEqual(response.status_code, 200)
+
+
+if __name__ == "__main__":
+    unittest.main()
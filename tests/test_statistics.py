@@ -0,0 +1,63 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(
+    0,
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+)
+
+import llama3chatbotopioid as chatbot
+
+
+class StatisticsQueryTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+
+        cls.store = chatbot.build_statistics_store()
+
+        if not cls.store.codes["location"]:
+            raise unittest.SkipTest("no KFF workbooks in pdf_folder")
+
+    def match(self, question):
+
+        return chatbot.match_statistics_query(
+            self.store,
+            question
+        )
+
+    def test_definitions_inject_nothing(self):
+
+        # Regression: race and age words used to default to
+        # national rows.
+        for question in (
+            "What is black tar heroin?",
+            "What is white fentanyl?",
+            "Is methadone safe for older adults?",
+            "What treatment is available in Ohio?"
+        ):
+            with self.subTest(question=question):
+                self.assertEqual(self.match(question), ([], []))
+
+    def test_statistics_questions_match(self):
+
+        locations, groups = self.match(
+            "What is the overdose death rate for Black Americans?"
+        )
+
+        self.assertEqual(locations, ["United States"])
+
+        self.assertIn(("race", "Black"), groups)
+
+        locations, groups = self.match(
+            "How many Hispanic people died of overdoses in Texas?"
+        )
+
+        self.assertEqual(locations, ["Texas"])
+
+        self.assertIn(("race", "Hispanic"), groups)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,141 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(
+    0,
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+)
+
+import llama3chatbotopioid as chatbot
+
+
+# Laid out the way pdfplumber returns the KFF tables in
+# "2023 National Survey on Drug Use and Health.pdf".
+DEATHS_PAGE = [
+    ["Location", "Opioid\nOverdose\nDeaths", "All Drug\nOverdose\nDeaths",
+     "Opioid\nOverdose\nDeaths as a\nPercent of All\nDrug\nOverdose\n"
+     "Deaths"],
+    ["United States", "81,806", "107,941", "0.76"],
+    ["Florida", "5,581", "7,769", "0.72"],
+    ["Maryland", "2,247", "2,573", "0.87"]
+]
+
+DEATHS_CONTINUED = [
+    ["Virginia", "2,108", "2,496", "0.84"],
+    ["West Virginia", "1,146", "1,335", "0.86"]
+]
+
+RACE_PAGE = [
+    ["Title: Opioid\nOverdose Deaths by\nRace/Ethnicity | KFF",
+     "", "", ""],
+    ["Timeframe: 2022", "", "", ""],
+    ["Location", "Overall", "White", "Black"],
+    ["Wisconsin", "NaN", "916", "302"],
+    ["Montana", "130", "95", "0"]
+]
+
+
+def build_index():
+
+    return chatbot.TableIndex(
+        chatbot.build_structured_tables(
+            [
+                ("deaths.pdf", 2, [DEATHS_PAGE]),
+                ("deaths.pdf", 3, [DEATHS_CONTINUED]),
+                ("race.pdf", 1, [RACE_PAGE])
+            ]
+        )
+    )
+
+
+class TableIndexTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.index = build_index()
+
+    def value(self, question):
+
+        found = self.index.lookup(question)
+
+        return found and found["value"]
+
+    def test_answers_direct_lookups(self):
+
+        self.assertEqual(
+            self.value(
+                "How many opioid overdose deaths were there "
+                "in Maryland?"
+            ),
+            "2,247"
+        )
+
+        self.assertEqual(
+            self.value(
+                "What percentage of drug overdose deaths in "
+                "Maryland were from opioids?"
+            ),
+            "87%"
+        )
+
+        self.assertEqual(
+            self.value(
+                "How many drug overdose deaths in West Virginia?"
+            ),
+            "1,335"
+        )
+
+        self.assertEqual(
+            self.value(
+                "How many Black people died of opioid "
+                "overdoses in Wisconsin?"
+            ),
+            "302"
+        )
+
+    def test_cites_continuation_page(self):
+
+        found = self.index.lookup(
+            "How many opioid overdose deaths in Virginia?"
+        )
+
+        self.assertEqual(found["page"], 3)
+
+    def test_unmatched_qualifiers_fall_through(self):
+
+        # Regression: these used to return all-ages totals.
+        self.assertIsNone(
+            self.value(
+                "In Virginia, how many teens had opioid "
+                "overdose deaths?"
+            )
+        )
+
+        self.assertIsNone(
+            self.value(
+                "how many opioid overdose deaths among people "
+                "aged 55+ in Florida?"
+            )
+        )
+
+    def test_non_quantity_questions_fall_through(self):
+
+        self.assertIsNone(
+            self.value(
+                "Why are overdose deaths in Maryland so high?"
+            )
+        )
+
+    def test_unreported_values_fall_through(self):
+
+        self.assertIsNone(
+            self.value(
+                "How many overall opioid overdose deaths "
+                "in Wisconsin?"
+            )
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,98 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(
+    0,
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+)
+
+import llama3chatbotopioid as chatbot
+
+
+QUESTIONS = [
+    "what to do if someone overdosed",
+    "What are the signs of an opioid overdose?",
+    "opioids and alcohol",
+    "Is my friend addicted?",
+    "addictions in teens",
+    "painkillers after surgery",
+    "My back pain is getting worse",
+    "rehabilitation centers near me",
+    "detoxing at home",
+    "substance use disorder",
+    "fentanyl-laced pills",
+    "Narcan spray",
+    "withdrawals from heroin",
+    "How does naloxone work?",
+    "treatments for OUD",
+    "What is xylazine?",
+    "Is Suboxone or methadone better?",
+    "Who is the best singer of all time?",
+    "recommend a movie",
+    "food near me",
+    "recovered from covid",
+    "What is the capital of France?"
+]
+
+# Questions where the compiled matcher deliberately differs
+# from the original substring scan, and its answer.
+IMPROVEMENTS = {
+    # "overdose" is not a substring of "overdosing".
+    "someone is overdosing": True,
+    "how to stop overdosing": True,
+    "harm-reduction services": True,
+    # "pain" inside "Spain" is not a topic.
+    "What is the weather like in Spain this week?": False
+}
+
+
+def substring_is_relevant(question):
+
+    q = question.lower()
+
+    return any(
+        topic in q
+        for topic in chatbot.relevant_topics
+    )
+
+
+class TopicMatcherTest(unittest.TestCase):
+
+    def test_agrees_with_substring_scan(self):
+
+        for question in QUESTIONS:
+            with self.subTest(question=question):
+                self.assertEqual(
+                    chatbot.is_question_relevant(question),
+                    substring_is_relevant(question)
+                )
+
+    def test_improvements_over_substring_scan(self):
+
+        for question, expected in IMPROVEMENTS.items():
+            with self.subTest(question=question):
+                self.assertNotEqual(
+                    substring_is_relevant(question),
+                    expected
+                )
+                self.assertEqual(
+                    chatbot.is_question_relevant(question),
+                    expected
+                )
+
+    def test_relevant_wins_over_irrelevant(self):
+
+        self.assertTrue(
+            chatbot.is_question_relevant(
+                "Which singer died of a fentanyl overdose?"
+            )
+        )
+
+    def test_empty_question(self):
+
+        self.assertFalse(chatbot.is_question_relevant(""))
+
+
+if __name__ == "__main__":
+    unittest.main()
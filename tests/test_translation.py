@@ -0,0 +1,38 @@
+import os
+import sys
+import unittest
+from unittest import mock
+
+sys.path.insert(
+    0,
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+)
+
+import llama3chatbotopioid as chatbot
+
+
+class PretranslatedMessageTest(unittest.TestCase):
+
+    def test_survives_translation_cache_eviction(self):
+
+        chatbot.translation_cache.clear()
+
+        with mock.patch.object(
+            chatbot,
+            "get_translator",
+            side_effect=RuntimeError("translator down")
+        ), mock.patch.object(chatbot, "TRANSLATE_ENDPOINT", ""):
+
+            self.assertEqual(
+                chatbot.translate_text(
+                    chatbot.OFF_TOPIC_MESSAGE,
+                    dest="es"
+                ),
+                chatbot.PRETRANSLATED_MESSAGES[
+                    chatbot.OFF_TOPIC_MESSAGE
+                ]["es"]
+            )
+
+
+if __name__ == "__main__":
+    unittest.main()